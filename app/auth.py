@@ -13,6 +13,10 @@ from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import requests
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.services.ml_cache import TTLCache
 
 # Carrega .env da raiz do projeto (utf-8-sig evita BOM no Windows)
 _PROJECT_ROOT = Path(__file__).resolve().parent.parent
@@ -28,9 +32,14 @@ CLERK_JWKS_URL = os.getenv("CLERK_JWKS_URL")
 CLERK_PUBLISHABLE_KEY = os.getenv("CLERK_PUBLISHABLE_KEY")
 CLERK_FRONTEND_API = os.getenv("CLERK_FRONTEND_API")
 CLERK_SECRET_KEY = os.getenv("CLERK_SECRET_KEY")
+# E-mail buscado na API do Clerk (quando o JWT não traz): cacheado por clerk_user_id
+CLERK_EMAIL_CACHE_TTL = float(os.getenv("CLERK_EMAIL_CACHE_TTL", "3600"))
+CLERK_EMAIL_NEGATIVE_TTL = float(os.getenv("CLERK_EMAIL_NEGATIVE_TTL", "60"))  # falha/sem e-mail: tenta de novo depois
 
 logger = logging.getLogger(__name__)
 
+_CLERK_EMAIL_CACHE = TTLCache("clerk_email", max_size=5000, ttl=CLERK_EMAIL_CACHE_TTL, stale_ttl=0)
+
 # Lista de e-mails admin (separados por vírgula) — lida em tempo de execução para refletir env após restart
 def _get_admin_emails() -> List[str]:
     raw = os.getenv("ADMIN_EMAILS", "")
@@ -74,8 +83,14 @@ def _get_claims(credentials: HTTPAuthorizationCredentials | None):
     return decoded
 
 
-def get_current_user(credentials: HTTPAuthorizationCredentials | None = Depends(clerk_auth_guard)):
-    """Retorna o User do banco a partir do JWT. Sincroniza com Clerk via get_or_create_user."""
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials | None = Depends(clerk_auth_guard),
+    db: Session = Depends(get_db),
+):
+    """Retorna o User do banco a partir do JWT. Sincroniza com Clerk via get_or_create_user.
+
+    Usa a sessão da requisição (a mesma que o handler recebe com Depends(get_db)).
+    """
     from app.models import User
     from app.services.user_service import get_or_create_user
 
@@ -90,7 +105,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials | None = Depends(
     if not email and CLERK_SECRET_KEY:
         # Session token may not include email by default in production; fallback to Clerk Backend API.
         email = _fetch_email_from_clerk_api(clerk_user_id)
-    return get_or_create_user(clerk_user_id, email)
+    return get_or_create_user(clerk_user_id, email, db=db)
 
 
 def _extract_email_from_claims(claims: dict) -> str | None:
@@ -115,9 +130,14 @@ def _extract_email_from_claims(claims: dict) -> str | None:
 
 
 def _fetch_email_from_clerk_api(clerk_user_id: str) -> str | None:
-    """Fetch user email from Clerk Backend API when JWT claims do not include it."""
+    """Fetch user email from Clerk Backend API when JWT claims do not include it (cached)."""
+    entry, fresh = _CLERK_EMAIL_CACHE.lookup(clerk_user_id)
+    if entry is not None and fresh:
+        return entry.value
     info = _fetch_clerk_user_info(clerk_user_id)
-    return info.get("email")
+    email = info.get("email")
+    _CLERK_EMAIL_CACHE.set(clerk_user_id, email, ttl=CLERK_EMAIL_CACHE_TTL if email else CLERK_EMAIL_NEGATIVE_TTL)
+    return email
 
 
 def _fetch_clerk_user_info(clerk_user_id: str) -> dict:
@@ -159,6 +179,13 @@ def _fetch_clerk_user_info(clerk_user_id: str) -> dict:
         return {"ok": False, "status": None, "error": str(e), "email": None}
 
 
+def get_auth_cache_stats() -> dict:
+    """Estatísticas dos caches de autenticação (usuários e e-mails do Clerk)."""
+    from app.services.user_service import get_user_cache_stats
+
+    return {"users": get_user_cache_stats(), "clerk_email": _CLERK_EMAIL_CACHE.stats()}
+
+
 def get_admin_emails() -> List[str]:
     """Retorna a lista atual de e-mails admin (para diagnóstico)."""
     return _get_admin_emails()
@@ -1,9 +1,17 @@
 # app/database.py — Conexão ao banco (SQLite local / PostgreSQL produção)
+import asyncio
+import logging
 import os
+import threading
+import time
 from pathlib import Path
+from typing import Any, Callable, Dict, Optional, TypeVar
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app.services.metrics import LatencyWindow
 
 _PROJECT_ROOT = Path(__file__).resolve().parent.parent
 _db_file = (_PROJECT_ROOT / "ml_intelligence.db").as_posix()
@@ -15,18 +23,239 @@ if _raw_url.startswith("postgres://"):
     _raw_url = _raw_url.replace("postgres://", "postgresql://", 1)
 
 _DB_PATH = _raw_url
-_connect_args = {}
-if "sqlite" in _DB_PATH:
-    _connect_args["check_same_thread"] = False
+_IS_SQLITE = "sqlite" in _DB_PATH
+_SQLITE_MEMORY = _IS_SQLITE and (_DB_PATH in ("sqlite://", "sqlite:///") or ":memory:" in _DB_PATH)
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes")
+
+
+# ------------------------------------------------------------------
+# Perfil do engine (pool e pragmas), ajustável por env
+# ------------------------------------------------------------------
+# Pool: dimensione DB_POOL_SIZE + DB_MAX_OVERFLOW pela concorrência real (requisições + tarefas em
+# background por worker) e pelo limite de conexões do PostgreSQL dividido pelo número de workers.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # PostgreSQL: evita conexões mortas por idle do servidor/proxy
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "1")
+# SQLite: WAL deixa leituras rodarem durante uma escrita; busy_timeout espera o lock em vez de falhar na hora
+DB_SQLITE_WAL = _env_bool("DB_SQLITE_WAL", "1")
+DB_SQLITE_SYNCHRONOUS = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()  # NORMAL é seguro com WAL
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_SQLITE_MMAP_MB = int(os.getenv("DB_SQLITE_MMAP_MB", "64"))
+DB_SQLITE_CACHE_MB = int(os.getenv("DB_SQLITE_CACHE_MB", "16"))
+
+
+class _PoolMetrics:
+    """Espera por conexão (checkout), timeouts e pico de uso do pool."""
+
+    def __init__(self):
+        self.wait = LatencyWindow(1000)
+        self._lock = threading.Lock()
+        self._counters = {"checkouts": 0, "timeouts": 0, "connects": 0, "peak_checked_out": 0}
+
+    def record_wait(self, seconds: float, checked_out: int) -> None:
+        self.wait.add(seconds)
+        with self._lock:
+            self._counters["checkouts"] += 1
+            self._counters["peak_checked_out"] = max(self._counters["peak_checked_out"], checked_out)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+_POOL_METRICS = _PoolMetrics()
+
+
+class _InstrumentedQueuePool(QueuePool):
+    """QueuePool que mede quanto cada checkout esperou por uma conexão livre."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            _POOL_METRICS.count("timeouts")
+            raise
+        _POOL_METRICS.record_wait(time.perf_counter() - started, self.checkedout())
+        return conn
+
+
+def _engine_options() -> Dict[str, Any]:
+    connect_args: Dict[str, Any] = {}
+    if _IS_SQLITE:
+        connect_args["check_same_thread"] = False
+        if _SQLITE_MEMORY:
+            return {"connect_args": connect_args}
+        connect_args["timeout"] = DB_SQLITE_BUSY_TIMEOUT_MS / 1000
+    options: Dict[str, Any] = {
+        "connect_args": connect_args,
+        "poolclass": _InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if not _IS_SQLITE:
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+        options["pool_recycle"] = DB_POOL_RECYCLE
+    return options
+
 
 # SQLAlchemy exige connect_args como dict; None causa TypeError no create_engine
-engine = create_engine(_DB_PATH, connect_args=_connect_args)
+engine = create_engine(_DB_PATH, **_engine_options())
+
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_conn, _record) -> None:
+    _POOL_METRICS.count("connects")
+    if not _IS_SQLITE or _SQLITE_MEMORY:
+        return
+    cur = dbapi_conn.cursor()
+    try:
+        if DB_SQLITE_WAL:
+            cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA synchronous={DB_SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA busy_timeout={DB_SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={DB_SQLITE_MMAP_MB * 1024 * 1024}")
+        cur.execute(f"PRAGMA cache_size=-{DB_SQLITE_CACHE_MB * 1024}")  # negativo = KiB
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Uso do pool de conexões e espera no checkout (painel admin)."""
+    pool = engine.pool
+    stats: Dict[str, Any] = {"backend": "sqlite" if _IS_SQLITE else engine.dialect.name, "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + DB_MAX_OVERFLOW
+        checked_out = pool.checkedout()
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checked_out": checked_out,
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "utilization": round(checked_out / capacity, 4) if capacity else None,
+            "timeout_seconds": DB_POOL_TIMEOUT,
+        })
+    wait = _POOL_METRICS.wait.summary()
+    stats.update(_POOL_METRICS.snapshot())
+    stats["checkout_wait"] = {"samples": wait["samples"], "p50_ms": wait["p50_ms"], "p95_ms": wait["p95_ms"], "p99_ms": wait["p99_ms"]}
+    if _IS_SQLITE and not _SQLITE_MEMORY:
+        stats["sqlite"] = {
+            "wal": DB_SQLITE_WAL,
+            "synchronous": DB_SQLITE_SYNCHRONOUS,
+            "busy_timeout_ms": DB_SQLITE_BUSY_TIMEOUT_MS,
+            "mmap_mb": DB_SQLITE_MMAP_MB,
+        }
+    async_engine = _async_state["engine"]
+    if async_engine is not None:
+        pool = async_engine.pool
+        stats["async"] = {"driver": async_engine.dialect.driver, "pool": type(pool).__name__, "checked_out": pool.checkedout()}
+    elif _async_state["ready"]:
+        stats["async"] = {"driver": None, "fallback": "threadpool", "reason": _async_state["error"]}
+    return stats
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# ------------------------------------------------------------------
+# Engine assíncrono (rotas async def): asyncpg / aiosqlite
+# ------------------------------------------------------------------
+# Mesmo banco e mesmo perfil de pool/pragmas do engine síncrono. Criado na primeira chamada a run_db;
+# sem o driver (pip install "sqlalchemy[asyncio]" asyncpg aiosqlite) ou com DB_ASYNC=0, run_db usa
+# a sessão síncrona numa thread — o event loop nunca espera pelo banco em nenhum dos dois casos.
+DB_ASYNC = _env_bool("DB_ASYNC", "1")
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+T = TypeVar("T")
+_async_lock = threading.Lock()
+_async_state: Dict[str, Any] = {"ready": False, "engine": None, "sessionmaker": None, "error": None}
+
+
+def _async_url(url: str) -> Optional[str]:
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db; postgresql://... -> postgresql+asyncpg://... (None se não houver driver)."""
+    scheme, sep, rest = url.partition("://")
+    driver = _ASYNC_DRIVERS.get(scheme)
+    if not sep or not driver:
+        return None  # URL já com driver explícito (postgresql+psycopg2://) ou backend sem versão async
+    return f"{scheme}+{driver}://{rest}"
+
+
+def _async_engine_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+    if _IS_SQLITE:
+        options["connect_args"] = {"timeout": DB_SQLITE_BUSY_TIMEOUT_MS / 1000}
+    else:
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+        options["pool_recycle"] = DB_POOL_RECYCLE
+    return options
+
+
+def _get_async_sessionmaker():
+    """async_sessionmaker do engine assíncrono, ou None se indisponível (decidido uma vez por processo)."""
+    if _async_state["ready"]:
+        return _async_state["sessionmaker"]
+    with _async_lock:
+        if _async_state["ready"]:
+            return _async_state["sessionmaker"]
+        url = _async_url(_DB_PATH) if DB_ASYNC and not _SQLITE_MEMORY else None
+        if url is None:
+            _async_state["error"] = "desativado" if not DB_ASYNC else "backend sem driver async"
+        else:
+            try:
+                from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+                async_engine = create_async_engine(url, **_async_engine_options())
+                event.listen(async_engine.sync_engine, "connect", _on_connect)
+                _async_state["engine"] = async_engine
+                _async_state["sessionmaker"] = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+            except ImportError as e:
+                _async_state["error"] = str(e)
+                logging.getLogger("ml-intelligence").warning("Engine async indisponível (%s); rotas async usam threadpool.", e)
+        _async_state["ready"] = True
+        return _async_state["sessionmaker"]
+
+
+def _run_in_session(fn: Callable[..., T], args: tuple, kwargs: Dict[str, Any]) -> T:
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Executa fn(db, *args, **kwargs) com uma sessão própria, sem bloquear o event loop.
+
+    Com o engine assíncrono, fn roda via AsyncSession.run_sync (I/O do driver async); sem ele, numa
+    thread com SessionLocal. fn usa a API síncrona da Session e deve fazer só I/O de banco (nada de
+    HTTP): no caminho async ela roda no próprio event loop. Escritas precisam de db.commit() em fn.
+    """
+    maker = _get_async_sessionmaker()
+    if maker is None:
+        return await asyncio.to_thread(_run_in_session, fn, args, kwargs)
+    async with maker() as session:
+        return await session.run_sync(fn, *args, **kwargs)
+
+
 def get_db():
-    """Dependency para obter sessão do banco."""
+    """Dependency para obter a sessão do banco da requisição.
+
+    O FastAPI resolve cada dependency uma vez por requisição: get_current_user, os guards
+    e o handler que pedem Depends(get_db) recebem a mesma sessão (uma conexão do pool).
+    """
     db = SessionLocal()
     try:
         yield db
@@ -34,32 +263,29 @@ def get_db():
         db.close()
 
 
-def _migrate_add_telegram_chat_id():
-    """Adiciona coluna telegram_chat_id em users se não existir (migração)."""
-    try:
-        with engine.connect() as conn:
-            if "sqlite" in _DB_PATH:
-                conn.execute(text("ALTER TABLE users ADD COLUMN telegram_chat_id VARCHAR(64)"))
-            else:
-                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_chat_id VARCHAR(64)"))
-            conn.commit()
-    except Exception as e:
-        msg = str(e).lower()
-        if "duplicate column" in msg or "already exists" in msg:
-            pass
-        else:
-            raise
+def end_read(db) -> None:
+    """Encerra a transação de leitura e devolve a conexão ao pool; a sessão continua utilizável.
+
+    Para uso logo após leituras no início da requisição (auth, token), antes de chamadas lentas.
+    Não faz nada se houver alterações pendentes na sessão.
+    """
+    if not (db.new or db.dirty or db.deleted):
+        db.commit()
 
 
 def init_db():
-    """Cria as tabelas se não existirem. Em produção use DATABASE_URL (PostgreSQL) para persistir dados."""
+    """Cria as tabelas e aplica as migrações pendentes (app/migrations.py).
+
+    Com o schema já na última versão, custa uma consulta à tabela schema_migrations.
+    Em produção use DATABASE_URL (PostgreSQL) para persistir dados.
+    """
     import logging
     from app import models  # noqa: F401
+    from app.migrations import migrate
 
-    Base.metadata.create_all(bind=engine)
-    try:
-        _migrate_add_telegram_chat_id()
-    except Exception:
-        pass
-    kind = "SQLite (dados locais)" if "sqlite" in _DB_PATH else "PostgreSQL (persistente)"
-    logging.getLogger("ml-intelligence").info("Banco: %s", kind)
+    before, after = migrate(engine, Base.metadata)
+    kind = "SQLite (dados locais)" if _IS_SQLITE else "PostgreSQL (persistente)"
+    if after != before:
+        logging.getLogger("ml-intelligence").info("Banco: %s | schema v%d -> v%d", kind, before, after)
+    else:
+        logging.getLogger("ml-intelligence").info("Banco: %s | schema v%d", kind, after)
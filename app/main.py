@@ -1,15 +1,17 @@
 # app/main.py
 import os
-from fastapi import FastAPI, Request, UploadFile, File, BackgroundTasks, HTTPException, Form, Depends
+from fastapi import FastAPI, Request, Response, UploadFile, File, BackgroundTasks, HTTPException, Form, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import PlainTextResponse, JSONResponse, RedirectResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from app.auth import (
     admin_guard,
     get_admin_emails,
+    get_auth_cache_stats,
     get_clerk_config,
     get_current_user,
     is_admin,
@@ -19,11 +21,12 @@ import hashlib
 import hmac
 import json
 import logging
+import math
 import time
 import uuid
 from pathlib import Path
 import aiofiles
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union
 import io
 import re
 import pandas as pd
@@ -34,7 +37,8 @@ import pandas as pd
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 LOG_FILE = LOG_DIR / "backend.log"
-DEBUG_LOG = Path(__file__).resolve().parent.parent / ".cursor" / "debug.log"
+# DEBUG_LOG: arquivo de depuração (JSON por linha); o benchmark aponta para bench/results/
+DEBUG_LOG = Path(os.getenv("DEBUG_LOG") or Path(__file__).resolve().parent.parent / ".cursor" / "debug.log")
 
 def _debug_log(message: str, data: dict, hypothesis_id: str = ""):
     try:
@@ -81,39 +85,18 @@ async def _debug_exception_handler(request: Request, exc: Exception):
 
 
 def _sync_all_users_questions():
-    """Polling: busca perguntas não respondidas de todos os usuários a cada 30min."""
+    """Polling: busca perguntas não respondidas de todos os vendedores (ver app/services/question_poller.py)."""
     logger.info("Polling de perguntas: iniciando...")
-    db = SessionLocal()
     try:
-        tokens = db.query(MlToken).all()
-        total_synced = 0
-        for ml_token in tokens:
-            user = db.query(User).filter(User.id == ml_token.user_id).first()
-            if not user:
-                continue
-            token = get_valid_ml_token(user)
-            if not token or not token.seller_id:
-                continue
-            result = get_questions_search(token.access_token, seller_id=token.seller_id, limit=50, offset=0)
-            if not result:
-                continue
-            for q in result.get("questions", []):
-                status = (q.get("status") or "").upper()
-                if status in ("ANSWERED", "BANNED", "DELETED", "DISABLED"):
-                    continue
-                question_id = str(q.get("id") or "").strip()
-                if not question_id:
-                    continue
-                if db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.question_id == question_id).first():
-                    continue
-                _process_ml_question_webhook(question_id, user.id)
-                total_synced += 1
-        if total_synced:
-            logger.info("Polling de perguntas: %d novas sincronizadas", total_synced)
+        summary = question_poller.run_cycle(_process_ml_question_webhook)
     except Exception as e:
         logger.exception("Erro no polling de perguntas: %s", e)
-    finally:
-        db.close()
+        return
+    if summary:
+        logger.info(
+            "Polling de perguntas: %d vendedor(es), %d nova(s) enviada(s) à IA, %d erro(s) em %.0f ms",
+            summary["sellers"], summary["dispatched"], summary["errors"], summary["duration_ms"],
+        )
 
 
 @app.on_event("startup")
@@ -128,26 +111,47 @@ def startup():
         from apscheduler.triggers.interval import IntervalTrigger
         _scheduler = BackgroundScheduler()
         _scheduler.add_job(_sync_all_users_questions, trigger=IntervalTrigger(minutes=10), id="sync_questions", replace_existing=True)
+        _scheduler.add_job(
+            ml_token_service.refresh_expiring_tokens,
+            trigger=IntervalTrigger(minutes=ml_token_service.ML_TOKEN_REFRESH_INTERVAL_MINUTES),
+            id="refresh_ml_tokens",
+            replace_existing=True,
+        )
+        _scheduler.add_job(
+            audit_log.purge_expired,
+            trigger=IntervalTrigger(hours=audit_log.AUDIT_PURGE_INTERVAL_HOURS),
+            id="purge_audit_logs",
+            replace_existing=True,
+        )
         _scheduler.start()
         app.state._question_scheduler = _scheduler
         logger.info("Polling de perguntas: ativo (a cada 10 min)")
+        logger.info(f"Renovação antecipada de tokens ML: ativa (a cada {ml_token_service.ML_TOKEN_REFRESH_INTERVAL_MINUTES} min)")
     except ImportError:
         logger.warning("APScheduler não instalado. Polling de perguntas desabilitado.")
 
 
+@app.on_event("shutdown")
+def shutdown():
+    audit_log.flush()  # grava os eventos de auditoria ainda na fila
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=_CORS_LIST,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Partial-Result", "X-Next-Cursor", "X-Total-Count"],
 )
 
 # ------------------------------------------------------------------
 # Import dos serviços (suas funções)
 # ------------------------------------------------------------------
 # *Se der ImportError, colocar os módulos no PYTHONPATH ou ajustar import relativo*
-from app.database import SessionLocal, init_db
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, end_read, get_db, get_pool_stats, init_db, run_db
 from app.models import AuditLog, CompetitorItem, ItemCost, MlToken, PendingQuestion, QuestionAnswerFeedback, Subscription, User
 from app.services.sheets_reader import read_sheet
 from app.services.normalizer import normalize_concorrentes
@@ -169,9 +173,9 @@ from app.services.mercado_pago_service import (
 from app.services.ml_api import (
     exchange_code_for_tokens,
     get_auth_url,
-    refresh_access_token,
     get_user_info,
     get_user_items,
+    get_all_user_item_ids,
     get_item_details,
     get_item_description,
     get_orders,
@@ -180,9 +184,80 @@ from app.services.ml_api import (
     get_question_detail,
     get_questions_search,
     get_item_by_id,
+    get_circuit_states,
+    get_ml_api_stats,
     post_answer,
     search_public,
+    search_public_cached,
 )
+from app.services import ml_api_async, ml_deadline, ml_token_service
+from app.services.ml_circuit import CircuitOpenError
+from app.services.ml_ratelimit import RateLimitExceeded
+from app.services.item_cost_service import bulk_upsert_costs
+from app.services import audit_log, pagination, question_poller
+
+# ------------------------------------------------------------------
+# Prazo das chamadas ao ML por rota (ver app/services/ml_deadline.py)
+# ------------------------------------------------------------------
+# (prefixo da rota, segundos); vale o primeiro prefixo que casar
+ML_ROUTE_DEADLINES = (
+    ("/api/financial-panel", float(os.getenv("ML_DEADLINE_FINANCIAL_PANEL", "8"))),
+    ("/api/ml/", float(os.getenv("ML_DEADLINE_ML", "12"))),
+)
+
+
+class MlDeadlineMiddleware:
+    """Abre um escopo ml_deadline para as rotas de ML_ROUTE_DEADLINES.
+
+    Chamadas ao ML feitas depois do prazo são abortadas; se alguma foi, a resposta
+    leva o header X-Partial-Result: 1.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "") if scope["type"] == "http" else ""
+        seconds = next((sec for prefix, sec in ML_ROUTE_DEADLINES if path.startswith(prefix)), None)
+        if seconds is None or seconds <= 0:
+            await self.app(scope, receive, send)
+            return
+        with ml_deadline.deadline(seconds) as dl:
+            async def _send(message):
+                if message["type"] == "http.response.start" and dl.exceeded:
+                    headers = message.get("headers", [])
+                    if not any(k.lower() == b"x-partial-result" for k, _ in headers):
+                        message = {**message, "headers": [*headers, (b"x-partial-result", b"1")]}
+                await send(message)
+
+            await self.app(scope, receive, _send)
+
+
+app.add_middleware(MlDeadlineMiddleware)
+
+
+@app.exception_handler(ml_deadline.DeadlineExceeded)
+async def _ml_deadline_exceeded_handler(request: Request, exc: ml_deadline.DeadlineExceeded):
+    """Prazo esgotado antes de haver o que devolver: 504 marcado como parcial, sem o 500 genérico."""
+    logger.warning("Prazo do ML esgotado em %s: %s", request.url.path, exc)
+    return JSONResponse(
+        status_code=504,
+        content={"detail": "O Mercado Livre demorou a responder. Tente novamente em instantes."},
+        headers={"X-Partial-Result": "1"},
+    )
+
+
+@app.exception_handler(CircuitOpenError)
+@app.exception_handler(RateLimitExceeded)
+async def _ml_unavailable_handler(request: Request, exc: Union[CircuitOpenError, RateLimitExceeded]):
+    """Circuito aberto ou fila do rate limit cheia: a chamada nem foi ao ML. 503 com Retry-After."""
+    retry_in = max(1, math.ceil(exc.retry_in))
+    logger.warning("API do ML indisponível em %s: %s", request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Mercado Livre temporariamente indisponível. Tente novamente em {retry_in}s."},
+        headers={"Retry-After": str(retry_in)},
+    )
 
 # ------------------------------------------------------------------
 # STORE de jobs (em memória) + idempotência de webhook
@@ -357,6 +432,16 @@ def _parse_currency(val: Any) -> float:
         return float("nan")
 
 
+# Projeções do multi-get de itens: só os campos que cada tela usa
+_ITEM_LIST_ATTRIBUTES = (
+    "id", "title", "price", "status", "sold_quantity", "available_quantity", "initial_quantity",
+    "permalink", "thumbnail", "secure_thumbnail", "pictures",
+)
+_FINANCIAL_PANEL_ATTRIBUTES = (
+    "id", "title", "price", "status", "sold_quantity", "available_quantity", "seller_custom_field",
+)
+
+
 def _is_subscription_plan(item: dict) -> bool:
     """Identifica anúncios que são planos de assinatura (não produtos)."""
     title = (item.get("title") or "").lower()
@@ -512,7 +597,10 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    """Liveness + estado dos circuit breakers da API do ML (status "degraded" se algum estiver aberto)."""
+    circuits = get_circuit_states()
+    degraded = any(state != "closed" for state in circuits.values())
+    return {"status": "degraded" if degraded else "ok", "ml_api": circuits}
 
 
 @app.get("/api/clerk-config")
@@ -545,21 +633,17 @@ class TelegramLinkInput(BaseModel):
 
 
 @app.post("/api/me/telegram")
-def link_telegram(data: TelegramLinkInput, user: User = Depends(get_current_user)):
+def link_telegram(data: TelegramLinkInput, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Vincula o chat_id do Telegram ao usuário para receber notificações de perguntas nos anúncios."""
     chat_id = (data.chat_id or "").strip()
     if not chat_id:
         raise HTTPException(status_code=400, detail="chat_id é obrigatório.")
-    db = SessionLocal()
-    try:
-        u = db.query(User).filter(User.id == user.id).first()
-        if not u:
-            raise HTTPException(status_code=404, detail="Usuário não encontrado.")
-        u.telegram_chat_id = chat_id[:64]
-        db.commit()
-        return {"ok": True, "message": "Telegram vinculado. Você receberá notificações de novas perguntas."}
-    finally:
-        db.close()
+    u = db.query(User).filter(User.id == user.id).first()
+    if not u:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+    u.telegram_chat_id = chat_id[:64]
+    db.commit()
+    return {"ok": True, "message": "Telegram vinculado. Você receberá notificações de novas perguntas."}
 
 
 @app.get("/api/telegram/bot-info")
@@ -629,7 +713,7 @@ class MlOAuthInput(BaseModel):
 
 
 @app.post("/api/ml-oauth-callback")
-def ml_oauth_callback(data: MlOAuthInput, user: User = Depends(get_current_user)):
+def ml_oauth_callback(data: MlOAuthInput, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Recebe o code do OAuth e salva os tokens do Mercado Livre."""
     if not data.code or not data.code.strip():
         raise HTTPException(status_code=400, detail="Código OAuth ausente.")
@@ -644,196 +728,157 @@ def ml_oauth_callback(data: MlOAuthInput, user: User = Depends(get_current_user)
     if expires_in:
         from datetime import datetime, timedelta
         expires_at = datetime.utcnow() + timedelta(seconds=int(expires_in))
-    db = SessionLocal()
-    try:
-        existing = db.query(MlToken).filter(MlToken.user_id == user.id).first()
-        if existing:
-            existing.access_token = access_token
-            existing.refresh_token = refresh_token
-            existing.seller_id = str(seller_id) if seller_id else None
-            existing.expires_at = expires_at
-        else:
-            db.add(MlToken(
-                user_id=user.id,
-                access_token=access_token,
-                refresh_token=refresh_token,
-                seller_id=str(seller_id) if seller_id else None,
-                expires_at=expires_at,
-            ))
-        db.commit()
-        return {"ok": True, "seller_id": seller_id}
-    finally:
-        db.close()
+    existing = db.query(MlToken).filter(MlToken.user_id == user.id).first()
+    if existing:
+        existing.access_token = access_token
+        existing.refresh_token = refresh_token
+        existing.seller_id = str(seller_id) if seller_id else None
+        existing.expires_at = expires_at
+    else:
+        db.add(MlToken(
+            user_id=user.id,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            seller_id=str(seller_id) if seller_id else None,
+            expires_at=expires_at,
+        ))
+    db.commit()
+    ml_token_service.invalidate(user.id)
+    return {"ok": True, "seller_id": seller_id}
 
 
-def get_valid_ml_token(user: User) -> Optional[MlToken]:
-    """Retorna token válido do ML para o usuário, renovando se necessário."""
-    db = SessionLocal()
-    try:
-        token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
-        if not token:
-            return None
-        
-        # Verifica se o token expirou ou está próximo de expirar (renova com 5min de antecedência)
-        from datetime import datetime, timedelta
-        if token.expires_at and token.expires_at <= datetime.utcnow() + timedelta(minutes=5):
-            # Token expirado ou próximo de expirar - renova
-            new_tokens = refresh_access_token(token.refresh_token)
-            if new_tokens and "access_token" in new_tokens:
-                token.access_token = new_tokens.get("access_token", "")
-                if "refresh_token" in new_tokens:
-                    token.refresh_token = new_tokens.get("refresh_token", "")
-                expires_in = new_tokens.get("expires_in")
-                if expires_in:
-                    token.expires_at = datetime.utcnow() + timedelta(seconds=int(expires_in))
-                db.commit()
-                logger.info(f"Token ML renovado para usuário {user.id}")
-            else:
-                logger.warning(f"Falha ao renovar token ML para usuário {user.id}")
-                return None
-        
-        return token
-    finally:
-        db.close()
+def get_valid_ml_token(user: User, db: Optional[Session] = None) -> Optional[MlToken]:
+    """Retorna token válido do ML para o usuário (cache em memória; renova se necessário).
+
+    O objeto retornado é um snapshot (CachedMlToken) com os mesmos atributos de MlToken.
+    Nas rotas, passe a sessão da requisição (db) para não abrir outra conexão.
+    """
+    return ml_token_service.get_valid_token(user.id, db)
 
 
 @app.get("/api/ml-status")
-def ml_status(user: User = Depends(get_current_user)):
+def ml_status(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Retorna se o usuário tem conta ML conectada. Tenta renovar o token automaticamente se expirado."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     return {"connected": token is not None, "seller_id": token.seller_id if token else None}
 
 
 @app.delete("/api/ml-disconnect")
-def ml_disconnect(user: User = Depends(get_current_user)):
+def ml_disconnect(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Desconecta a conta do Mercado Livre (remove token do banco)."""
-    db = SessionLocal()
-    try:
-        token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
-        if not token:
-            raise HTTPException(status_code=404, detail="Nenhuma conta ML conectada.")
-        
-        db.delete(token)
-        db.commit()
-        logger.info(f"Conta ML desconectada para user_id={user.id}")
-        return {"ok": True, "message": "Conta do Mercado Livre desconectada com sucesso."}
-    finally:
-        db.close()
+    token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
+    if not token:
+        raise HTTPException(status_code=404, detail="Nenhuma conta ML conectada.")
+    
+    db.delete(token)
+    db.commit()
+    ml_token_service.invalidate(user.id)
+    logger.info(f"Conta ML desconectada para user_id={user.id}")
+    return {"ok": True, "message": "Conta do Mercado Livre desconectada com sucesso."}
 
 
 @app.get("/api/ml-diagnostic")
-def ml_diagnostic(user: User = Depends(get_current_user)):
+def ml_diagnostic(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Diagnóstico detalhado da conexão ML com testes de API e permissões."""
     from datetime import datetime, timedelta
     
-    db = SessionLocal()
-    try:
-        token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
-        
-        if not token:
-            return {
-                "connected": False,
-                "message": "Nenhuma conta ML conectada.",
-                "recommendations": [
-                    "Clique em 'Conectar Mercado Livre' para autorizar sua conta.",
-                ]
-            }
-        
-        # Verifica expiração
-        now = datetime.utcnow()
-        is_expired = token.expires_at and token.expires_at <= now
-        time_until_expiry = None
-        if token.expires_at:
-            delta = token.expires_at - now
-            time_until_expiry = delta.total_seconds() / 60  # minutos
-        
-        # Tenta renovar se expirado
-        if is_expired:
-            new_tokens = refresh_access_token(token.refresh_token)
-            if new_tokens and "access_token" in new_tokens:
-                token.access_token = new_tokens.get("access_token", "")
-                if "refresh_token" in new_tokens:
-                    token.refresh_token = new_tokens.get("refresh_token", "")
-                expires_in = new_tokens.get("expires_in")
-                if expires_in:
-                    token.expires_at = datetime.utcnow() + timedelta(seconds=int(expires_in))
-                db.commit()
-                is_expired = False
-                logger.info(f"Token ML renovado durante diagnóstico para user_id={user.id}")
-        
-        # Testes de API
-        tests = {}
-        recommendations = []
-        
-        # Teste 1: Buscar informações do usuário
-        user_info = get_user_info(token.access_token)
-        tests["Buscar dados do usuário (/users/me)"] = {
-            "success": user_info is not None,
-            "message": "OK - Dados do usuário carregados" if user_info else "Falhou - Token pode estar inválido"
+    token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
+    
+    if not token:
+        return {
+            "connected": False,
+            "message": "Nenhuma conta ML conectada.",
+            "recommendations": [
+                "Clique em 'Conectar Mercado Livre' para autorizar sua conta.",
+            ]
         }
-        if not user_info:
-            recommendations.append("Token inválido. Reconecte sua conta ML.")
-        
-        # Teste 2: Buscar anúncios (verifica permissão Items)
-        if user_info and token.seller_id:
-            items = get_user_items(token.access_token, token.seller_id, status="active", limit=1)
-            tests["Buscar anúncios (/users/{id}/items/search)"] = {
-                "success": items is not None,
-                "message": "OK - Permissão 'Items' ativa" if items else "Falhou - Sem permissão 'Publicação e sincronização'"
-            }
-            if not items:
-                recommendations.append("⚠️ CRÍTICO: Ative permissão 'Publicação e sincronização' (Leitura) no portal ML.")
-        
-        # Teste 3: Buscar perguntas (verifica permissão Comunicações)
-        if token.seller_id:
-            questions = get_questions_search(token.access_token, seller_id=token.seller_id, limit=1)
-            tests["Buscar perguntas (/questions/search)"] = {
-                "success": questions is not None,
-                "message": "OK - Permissão 'Comunicações' ativa" if questions else "Falhou - Sem permissão 'Comunicações'"
-            }
-            if not questions:
-                recommendations.append("Permissão 'Comunicações' pode não estar habilitada no portal ML.")
-        
-        # Teste 4: Buscar produto público (verifica acesso básico)
-        test_item = get_item_by_id(token.access_token, "MLB2172237836")  # Produto de teste público
-        tests["Buscar produto público (/items/{id})"] = {
-            "success": test_item is not None and not test_item.get("error"),
-            "message": "OK - Acesso a produtos" if (test_item and not test_item.get("error")) else "Falhou - Verifique permissões"
+    
+    # Verifica expiração
+    now = datetime.utcnow()
+    is_expired = token.expires_at and token.expires_at <= now
+    time_until_expiry = None
+    if token.expires_at:
+        delta = token.expires_at - now
+        time_until_expiry = delta.total_seconds() / 60  # minutos
+    
+    # Tenta renovar se expirado (mesma renovação single-flight do get_valid_ml_token)
+    if is_expired:
+        refreshed = ml_token_service.refresh_if_expiring(user.id, timedelta(0))
+        if refreshed is not None:
+            token = refreshed
+            is_expired = False
+            logger.info(f"Token ML renovado durante diagnóstico para user_id={user.id}")
+    
+    # Testes de API
+    tests = {}
+    recommendations = []
+    
+    # Teste 1: Buscar informações do usuário
+    user_info = get_user_info(token.access_token)
+    tests["Buscar dados do usuário (/users/me)"] = {
+        "success": user_info is not None,
+        "message": "OK - Dados do usuário carregados" if user_info else "Falhou - Token pode estar inválido"
+    }
+    if not user_info:
+        recommendations.append("Token inválido. Reconecte sua conta ML.")
+    
+    # Teste 2: Buscar anúncios (verifica permissão Items)
+    if user_info and token.seller_id:
+        items = get_user_items(token.access_token, token.seller_id, status="active", limit=1)
+        tests["Buscar anúncios (/users/{id}/items/search)"] = {
+            "success": items is not None,
+            "message": "OK - Permissão 'Items' ativa" if items else "Falhou - Sem permissão 'Publicação e sincronização'"
         }
-        if test_item and test_item.get("error") and test_item.get("status_code") == 403:
-            recommendations.append("⚠️ Erro 403 ao buscar produtos. Verifique permissão 'Publicação e sincronização' no portal ML.")
-        
-        # Scopes do token (se disponível)
-        scopes = []
-        if user_info and "scopes" in user_info:
-            scopes = user_info.get("scopes", [])
-        
-        # Recomendações gerais
-        if is_expired:
-            recommendations.append("Token expirado. Será renovado automaticamente na próxima requisição.")
-        elif time_until_expiry and time_until_expiry < 60:
-            recommendations.append(f"Token expira em {int(time_until_expiry)} minutos. Será renovado automaticamente.")
-        
-        if not recommendations:
-            recommendations.append("✅ Tudo OK! Conexão e permissões estão corretas.")
-        
-        return {
-            "connected": True,
-            "seller_id": token.seller_id,
-            "expires_at": token.expires_at.isoformat() if token.expires_at else None,
-            "created_at": token.created_at.isoformat() if token.created_at else None,
-            "token_expired": is_expired,
-            "time_until_expiry_minutes": time_until_expiry,
-            "tests": tests,
-            "scopes": scopes,
-            "recommendations": recommendations
+        if not items:
+            recommendations.append("⚠️ CRÍTICO: Ative permissão 'Publicação e sincronização' (Leitura) no portal ML.")
+    
+    # Teste 3: Buscar perguntas (verifica permissão Comunicações)
+    if token.seller_id:
+        questions = get_questions_search(token.access_token, seller_id=token.seller_id, limit=1)
+        tests["Buscar perguntas (/questions/search)"] = {
+            "success": questions is not None,
+            "message": "OK - Permissão 'Comunicações' ativa" if questions else "Falhou - Sem permissão 'Comunicações'"
         }
+        if not questions:
+            recommendations.append("Permissão 'Comunicações' pode não estar habilitada no portal ML.")
     
-    finally:
-        db.close()
+    # Teste 4: Buscar produto público (verifica acesso básico)
+    test_item = get_item_by_id(token.access_token, "MLB2172237836")  # Produto de teste público
+    tests["Buscar produto público (/items/{id})"] = {
+        "success": test_item is not None and not test_item.get("error"),
+        "message": "OK - Acesso a produtos" if (test_item and not test_item.get("error")) else "Falhou - Verifique permissões"
+    }
+    if test_item and test_item.get("error") and test_item.get("status_code") == 403:
+        recommendations.append("⚠️ Erro 403 ao buscar produtos. Verifique permissão 'Publicação e sincronização' no portal ML.")
+    
+    # Scopes do token (se disponível)
+    scopes = []
+    if user_info and "scopes" in user_info:
+        scopes = user_info.get("scopes", [])
+    
+    # Recomendações gerais
+    if is_expired:
+        recommendations.append("Token expirado. Será renovado automaticamente na próxima requisição.")
+    elif time_until_expiry and time_until_expiry < 60:
+        recommendations.append(f"Token expira em {int(time_until_expiry)} minutos. Será renovado automaticamente.")
+    
+    if not recommendations:
+        recommendations.append("✅ Tudo OK! Conexão e permissões estão corretas.")
+    
+    return {
+        "connected": True,
+        "seller_id": token.seller_id,
+        "expires_at": token.expires_at.isoformat() if token.expires_at else None,
+        "created_at": token.created_at.isoformat() if token.created_at else None,
+        "token_expired": is_expired,
+        "time_until_expiry_minutes": time_until_expiry,
+        "tests": tests,
+        "scopes": scopes,
+        "recommendations": recommendations
+    }
 
 
-def _build_diagnostic_report(user: User) -> str:
+def _build_diagnostic_report(user: User, db: Session) -> str:
     """Gera relatório de diagnóstico EXTREMO em texto para download — testa todos os fluxos possíveis."""
     from datetime import datetime, timedelta
     lines = []
@@ -865,39 +910,35 @@ def _build_diagnostic_report(user: User) -> str:
     lines.append("-" * 70)
     lines.append("2. CONEXÃO MERCADO LIVRE")
     lines.append("-" * 70)
-    db = SessionLocal()
     token = None
-    try:
-        token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
-        if not token:
-            lines.append("  Status: NENHUMA CONTA ML CONECTADA")
-        else:
-            now = datetime.utcnow()
-            is_expired = token.expires_at and token.expires_at <= now
-            lines.append(f"  Status: Conectado | Seller ID: {token.seller_id}")
-            lines.append(f"  Token expirado: {'Sim' if is_expired else 'Não'}")
-
-            lines.append("")
-            lines.append("  Testes de API:")
-            user_info = get_user_info(token.access_token)
-            lines.append(f"    /users/me: {'OK' if user_info else 'FALHOU'}")
-            if token.seller_id:
-                for st in ["active", "paused", "closed", "pending", "under_review"]:
-                    r = get_user_items(token.access_token, token.seller_id, status=st, limit=5)
-                    cnt = r.get("paging", {}).get("total", 0) if r else "ERRO"
-                    err = " (erro)" if r is None else ""
-                    lines.append(f"    /items/search?status={st}: total={cnt}{err}")
-                qs = get_questions_search(token.access_token, seller_id=token.seller_id, limit=5)
-                qcnt = len(qs.get("questions", [])) if qs else "ERRO"
-                lines.append(f"    /questions/search: {qcnt} perguntas")
-            test_ids = ["MLB4443868923", "MLB1000"]
-            for tid in test_ids:
-                it = get_item_by_id(token.access_token, tid)
-                ok = it and not it.get("error")
-                sc = it.get("status_code", "?") if it and it.get("error") else "200"
-                lines.append(f"    /items/{tid}: {'OK' if ok else f'FALHOU ({sc})'}")
-    finally:
-        db.close()
+    token = db.query(MlToken).filter(MlToken.user_id == user.id).first()
+    if not token:
+        lines.append("  Status: NENHUMA CONTA ML CONECTADA")
+    else:
+        now = datetime.utcnow()
+        is_expired = token.expires_at and token.expires_at <= now
+        lines.append(f"  Status: Conectado | Seller ID: {token.seller_id}")
+        lines.append(f"  Token expirado: {'Sim' if is_expired else 'Não'}")
+
+        lines.append("")
+        lines.append("  Testes de API:")
+        user_info = get_user_info(token.access_token)
+        lines.append(f"    /users/me: {'OK' if user_info else 'FALHOU'}")
+        if token.seller_id:
+            for st in ["active", "paused", "closed", "pending", "under_review"]:
+                r = get_user_items(token.access_token, token.seller_id, status=st, limit=5)
+                cnt = r.get("paging", {}).get("total", 0) if r else "ERRO"
+                err = " (erro)" if r is None else ""
+                lines.append(f"    /items/search?status={st}: total={cnt}{err}")
+            qs = get_questions_search(token.access_token, seller_id=token.seller_id, limit=5)
+            qcnt = len(qs.get("questions", [])) if qs else "ERRO"
+            lines.append(f"    /questions/search: {qcnt} perguntas")
+        test_ids = ["MLB4443868923", "MLB1000"]
+        for tid in test_ids:
+            it = get_item_by_id(token.access_token, tid)
+            ok = it and not it.get("error")
+            sc = it.get("status_code", "?") if it and it.get("error") else "200"
+            lines.append(f"    /items/{tid}: {'OK' if ok else f'FALHOU ({sc})'}")
 
     lines.append("")
     lines.append("-" * 70)
@@ -918,7 +959,7 @@ def _build_diagnostic_report(user: User) -> str:
     lines.append("-" * 70)
     lines.append("4. PERGUNTAS — fluxo e pendentes")
     lines.append("-" * 70)
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if token and token.seller_id:
         qs = get_questions_search(token.access_token, seller_id=token.seller_id, limit=20)
         if qs:
@@ -930,12 +971,8 @@ def _build_diagnostic_report(user: User) -> str:
             lines.append("  FALHOU ao buscar perguntas")
     else:
         lines.append("  (conta ML não conectada)")
-    db = SessionLocal()
-    try:
-        pend = db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.status == "pending").count()
-        lines.append(f"  Pendentes aguardando aprovação no sistema: {pend}")
-    finally:
-        db.close()
+    pend = db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.status == "pending").count()
+    lines.append(f"  Pendentes aguardando aprovação no sistema: {pend}")
 
     lines.append("")
     lines.append("-" * 70)
@@ -984,16 +1021,16 @@ def _build_diagnostic_report(user: User) -> str:
 
 
 @app.get("/api/diagnostic-report", response_class=PlainTextResponse)
-def api_diagnostic_report(user: User = Depends(get_current_user)):
+def api_diagnostic_report(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Executa vários testes e retorna relatório em texto para download."""
-    report = _build_diagnostic_report(user)
+    report = _build_diagnostic_report(user, db)
     return PlainTextResponse(report, media_type="text/plain; charset=utf-8")
 
 
 @app.get("/api/ml-test-item/{item_id}")
-def ml_test_item(item_id: str, user: User = Depends(get_current_user)):
+def ml_test_item(item_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Testa se consegue buscar um produto específico do ML."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token:
         raise HTTPException(status_code=403, detail="Conta ML não conectada. Conecte primeiro.")
     
@@ -1039,9 +1076,10 @@ def ml_items(
     limit: int = 50,
     offset: int = 0,
     user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
 ):
     """Lista anúncios do usuário conectado ao Mercado Livre."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(
             status_code=403,
@@ -1055,30 +1093,29 @@ def ml_items(
             detail="Erro ao buscar anúncios do Mercado Livre.",
         )
     
-    # Busca detalhes dos itens se houver IDs e custos salvos
+    # Busca detalhes dos itens da página (só os campos exibidos) e custos salvos
     items_data = []
     if result.get("results"):
-        item_ids = result["results"][:20]  # Máx 20 por vez
-        items_details = get_multiple_items(token.access_token, item_ids)
+        item_ids = result["results"]
+        if status == "all":
+            # status=all traz todos os IDs; detalha só a página pedida
+            item_ids = item_ids[offset:offset + min(limit, 50)]
+        items_details = get_multiple_items(token.access_token, item_ids, attributes=_ITEM_LIST_ATTRIBUTES)
         if items_details:
             items_data = [i for i in items_details if not _is_subscription_plan(i)]
         # Injeta custos salvos por item
         if items_data:
             ids = [i.get("id") for i in items_data if i.get("id")]
             if ids:
-                db = SessionLocal()
-                try:
-                    costs = {c.item_id: c for c in db.query(ItemCost).filter(ItemCost.user_id == user.id, ItemCost.item_id.in_(ids)).all()}
-                    for it in items_data:
-                        c = costs.get(it.get("id"))
-                        if c:
-                            it["custo_produto"] = c.custo_produto
-                            it["embalagem"] = c.embalagem or 0
-                            it["frete"] = c.frete or 0
-                            it["taxa_pct"] = c.taxa_pct
-                            it["imposto_pct"] = c.imposto_pct
-                finally:
-                    db.close()
+                costs = {c.item_id: c for c in db.query(ItemCost).filter(ItemCost.user_id == user.id, ItemCost.item_id.in_(ids)).all()}
+                for it in items_data:
+                    c = costs.get(it.get("id"))
+                    if c:
+                        it["custo_produto"] = c.custo_produto
+                        it["embalagem"] = c.embalagem or 0
+                        it["frete"] = c.frete or 0
+                        it["taxa_pct"] = c.taxa_pct
+                        it["imposto_pct"] = c.imposto_pct
     
     return {
         "total": result.get("paging", {}).get("total", 0),
@@ -1090,22 +1127,23 @@ def ml_items(
 
 
 @app.get("/api/ml/items/{item_id}")
-def ml_item_details(item_id: str, user: User = Depends(paid_guard)):
+async def ml_item_details(item_id: str, user: User = Depends(paid_guard)):
     """Busca detalhes de um anúncio específico."""
-    token = get_valid_ml_token(user)
+    token = await run_in_threadpool(get_valid_ml_token, user)
     if not token:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     
-    item = get_item_details(token.access_token, item_id)
+    # Item e descrição em paralelo; a descrição é opcional: se o prazo acabar só nela, volta sem descrição
+    item, description = await ml_api_async.gather_limited(
+        ml_api_async.get_item_details(token.access_token, item_id),
+        ml_api_async.until_deadline(ml_api_async.get_item_description(token.access_token, item_id)),
+    )
     if item is None:
         raise HTTPException(
             status_code=404,
             detail="Anúncio não encontrado.",
         )
     
-    # Busca descrição também
-    description = get_item_description(token.access_token, item_id)
-    
     return {
         "item": item,
         "description": description,
@@ -1118,9 +1156,10 @@ def ml_orders(
     limit: int = 50,
     offset: int = 0,
     user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
 ):
     """Lista pedidos/vendas do usuário conectado ao Mercado Livre."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     
@@ -1135,9 +1174,9 @@ def ml_orders(
 
 
 @app.get("/api/ml/orders/{order_id}")
-def ml_order_details(order_id: str, user: User = Depends(paid_guard)):
+def ml_order_details(order_id: str, user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Busca detalhes de um pedido específico."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     
@@ -1163,19 +1202,13 @@ def ml_search(
     if not q or len(q.strip()) < 2:
         raise HTTPException(status_code=400, detail="Digite pelo menos 2 caracteres para buscar.")
     
-    # Prioriza busca SEM token: API ML retorna 403 com token em apps não certificados
-    result = search_public(site_id="MLB", q=q.strip(), limit=limit, offset=offset, sort=sort, access_token=None)
-    
-    # Verifica se houve erro na primeira tentativa
-    if result and result.get("error"):
-        error_status = result.get("status_code", 0)
-        logger.info(f"Busca sem token falhou com status {error_status}, tentando com token...")
-        
-        # Se foi 403, tenta com token (pode ser restrição de app não autenticado)
+    # Prioriza busca SEM token (API ML retorna 403 com token em apps não certificados);
+    # se falhar, tenta com token. Resultados em cache (stale-while-revalidate).
+    def _token_getter() -> Optional[str]:
         token = get_valid_ml_token(user)
-        access_token = token.access_token if token else None
-        if access_token:
-            result = search_public(site_id="MLB", q=q.strip(), limit=limit, offset=offset, sort=sort, access_token=access_token)
+        return token.access_token if token else None
+
+    result = search_public_cached(site_id="MLB", q=q.strip(), limit=limit, offset=offset, sort=sort, token_getter=_token_getter)
     
     # Se result é None ou ainda tem erro
     if result is None or result.get("error"):
@@ -1221,9 +1254,9 @@ class AddCompetitorInput(BaseModel):
 
 
 @app.post("/api/ml/competitors")
-def ml_competitors_add(data: AddCompetitorInput, user: User = Depends(paid_guard)):
+def ml_competitors_add(data: AddCompetitorInput, user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Adiciona um concorrente por ID ou URL do anúncio no ML (funciona sem certificação da busca)."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     item_id = _parse_ml_item_id(data.item_id or data.url or "")
@@ -1263,75 +1296,71 @@ def ml_competitors_add(data: AddCompetitorInput, user: User = Depends(paid_guard
     if not item:
         raise HTTPException(status_code=404, detail="Anúncio não encontrado no Mercado Livre. Verifique o ID ou a URL.")
     
-    db = SessionLocal()
-    try:
-        existing = db.query(CompetitorItem).filter(CompetitorItem.user_id == user.id, CompetitorItem.item_id == item_id).first()
-        if existing:
-            if data.nickname is not None:
-                existing.nickname = (data.nickname or "").strip()[:128] or None
-                db.commit()
-            return {"ok": True, "item_id": item_id, "message": "Concorrente já cadastrado; apelido atualizado."}
-        db.add(CompetitorItem(user_id=user.id, item_id=item_id, nickname=(data.nickname or "").strip()[:128] or None))
-        db.commit()
-        return {"ok": True, "item_id": item_id, "message": "Concorrente adicionado."}
-    finally:
-        db.close()
+    existing = db.query(CompetitorItem).filter(CompetitorItem.user_id == user.id, CompetitorItem.item_id == item_id).first()
+    if existing:
+        if data.nickname is not None:
+            existing.nickname = (data.nickname or "").strip()[:128] or None
+            db.commit()
+        return {"ok": True, "item_id": item_id, "message": "Concorrente já cadastrado; apelido atualizado."}
+    db.add(CompetitorItem(user_id=user.id, item_id=item_id, nickname=(data.nickname or "").strip()[:128] or None))
+    db.commit()
+    return {"ok": True, "item_id": item_id, "message": "Concorrente adicionado."}
+
+
+def _list_competitor_rows(db: Session, user_id: int) -> List[CompetitorItem]:
+    return db.query(CompetitorItem).filter(CompetitorItem.user_id == user_id).order_by(CompetitorItem.created_at.desc()).all()
 
 
 @app.get("/api/ml/competitors")
-def ml_competitors_list(user: User = Depends(paid_guard)):
+async def ml_competitors_list(user: User = Depends(paid_guard)):
     """Lista concorrentes cadastrados com detalhes (preço, título, vendidos) do ML."""
-    token = get_valid_ml_token(user)
+    token = await run_in_threadpool(get_valid_ml_token, user)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
-    db = SessionLocal()
-    try:
-        rows = db.query(CompetitorItem).filter(CompetitorItem.user_id == user.id).order_by(CompetitorItem.created_at.desc()).all()
-        items = []
-        for r in rows:
-            detail = get_item_by_id(token.access_token, r.item_id)
-            # Verifica se retornou erro ou dados válidos
-            if detail and not detail.get("error"):
-                items.append({
-                    "item_id": r.item_id,
-                    "nickname": r.nickname,
-                    "title": detail.get("title"),
-                    "price": detail.get("price"),
-                    "sold_quantity": detail.get("sold_quantity", 0),
-                    "permalink": detail.get("permalink"),
-                    "thumbnail": detail.get("thumbnail"),
-                })
-            else:
-                # Produto não encontrado ou erro - mostra dados vazios
-                items.append({"item_id": r.item_id, "nickname": r.nickname, "title": None, "price": None, "sold_quantity": None, "permalink": None, "thumbnail": None})
-        return {"items": items}
-    finally:
-        db.close()
+    rows = await run_db(_list_competitor_rows, user.id)
+    # Detalhes de todos os concorrentes em paralelo (ordem preservada)
+    details = await ml_api_async.gather_limited(
+        *(ml_api_async.get_item_by_id(token.access_token, r.item_id) for r in rows)
+    )
+    items = []
+    for r, detail in zip(rows, details):
+        # Verifica se retornou erro ou dados válidos
+        if detail and not detail.get("error"):
+            items.append({
+                "item_id": r.item_id,
+                "nickname": r.nickname,
+                "title": detail.get("title"),
+                "price": detail.get("price"),
+                "sold_quantity": detail.get("sold_quantity", 0),
+                "permalink": detail.get("permalink"),
+                "thumbnail": detail.get("thumbnail"),
+            })
+        else:
+            # Produto não encontrado ou erro - mostra dados vazios
+            items.append({"item_id": r.item_id, "nickname": r.nickname, "title": None, "price": None, "sold_quantity": None, "permalink": None, "thumbnail": None})
+    return {"items": items}
 
 
 @app.delete("/api/ml/competitors/{item_id}")
-def ml_competitors_remove(item_id: str, user: User = Depends(paid_guard)):
+def ml_competitors_remove(item_id: str, user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Remove um concorrente da lista."""
     item_id = _parse_ml_item_id(item_id) or item_id
-    db = SessionLocal()
-    try:
-        row = db.query(CompetitorItem).filter(CompetitorItem.user_id == user.id, CompetitorItem.item_id == item_id).first()
-        if not row:
-            raise HTTPException(status_code=404, detail="Concorrente não encontrado.")
-        db.delete(row)
-        db.commit()
-        return {"ok": True, "message": "Concorrente removido."}
-    finally:
-        db.close()
+    row = db.query(CompetitorItem).filter(CompetitorItem.user_id == user.id, CompetitorItem.item_id == item_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Concorrente não encontrado.")
+    db.delete(row)
+    db.commit()
+    return {"ok": True, "message": "Concorrente removido."}
 
 
 @app.get("/api/ml/compare/{item_id}")
 def ml_compare(
     item_id: str,
     user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
 ):
     """Compara um anúncio do usuário com concorrentes na busca do ML."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     
@@ -1346,13 +1375,8 @@ def ml_compare(
     if not search_term or len(search_term) < 2:
         raise HTTPException(status_code=400, detail="Não foi possível definir termo de busca para este anúncio.")
     
-    # Busca pública primeiro (token gera 403 em apps não certificados)
-    result = search_public(site_id="MLB", q=search_term[:80], limit=50, offset=0, access_token=None)
-    
-    # Verifica se houve erro e tenta com token
-    if result and result.get("error"):
-        logger.info(f"Comparação sem token falhou, tentando com token...")
-        result = search_public(site_id="MLB", q=search_term[:80], limit=50, offset=0, access_token=token.access_token)
+    # Busca pública primeiro (token gera 403 em apps não certificados), depois com token; com cache
+    result = search_public_cached(site_id="MLB", q=search_term[:80], limit=50, offset=0, access_token=token.access_token)
     
     # Se ainda tem erro ou é None
     if result is None or result.get("error"):
@@ -1390,19 +1414,20 @@ def ml_compare(
 
 
 @app.get("/api/ml/metrics")
-def ml_metrics(user: User = Depends(paid_guard)):
+async def ml_metrics(user: User = Depends(paid_guard)):
     """Retorna métricas gerais da conta do Mercado Livre."""
-    token = get_valid_ml_token(user)
+    token = await run_in_threadpool(get_valid_ml_token, user)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     
-    # Busca anúncios ativos
-    active_items = get_user_items(token.access_token, token.seller_id, status="active", limit=50)
-    paused_items = get_user_items(token.access_token, token.seller_id, status="paused", limit=50)
-    closed_items = get_user_items(token.access_token, token.seller_id, status="closed", limit=50)
-    
-    # Busca pedidos pagos recentes
-    paid_orders = get_orders(token.access_token, token.seller_id, status="paid", limit=50)
+    # Anúncios por status + pedidos pagos recentes, buscados em paralelo
+    # (chamada abortada pelo prazo da rota conta como 0 e a resposta sai com partial=True)
+    active_items, paused_items, closed_items, paid_orders = await ml_api_async.gather_limited(
+        ml_api_async.until_deadline(ml_api_async.get_user_items(token.access_token, token.seller_id, status="active", limit=50)),
+        ml_api_async.until_deadline(ml_api_async.get_user_items(token.access_token, token.seller_id, status="paused", limit=50)),
+        ml_api_async.until_deadline(ml_api_async.get_user_items(token.access_token, token.seller_id, status="closed", limit=50)),
+        ml_api_async.until_deadline(ml_api_async.get_orders(token.access_token, token.seller_id, status="paid", limit=50)),
+    )
     
     total_active = active_items.get("paging", {}).get("total", 0) if active_items else 0
     total_paused = paused_items.get("paging", {}).get("total", 0) if paused_items else 0
@@ -1410,6 +1435,7 @@ def ml_metrics(user: User = Depends(paid_guard)):
     total_orders = paid_orders.get("paging", {}).get("total", 0) if paid_orders else 0
     
     return {
+        "partial": ml_deadline.exceeded(),
         "items": {
             "active": total_active,
             "paused": total_paused,
@@ -1425,21 +1451,23 @@ def ml_metrics(user: User = Depends(paid_guard)):
 # ------------------------------------------------------------------
 # Perguntas nos anúncios ML (webhook + fila aprovação + publicar)
 # ------------------------------------------------------------------
-def _user_by_seller_id(seller_id: str) -> Optional[User]:
-    """Retorna User que possui o seller_id no MlToken."""
+def _user_by_seller_id(db: Session, seller_id: str) -> Optional[User]:
+    """Retorna User que possui o seller_id no MlToken (via run_db nas rotas async)."""
     if not seller_id:
         return None
-    db = SessionLocal()
-    try:
-        token = db.query(MlToken).filter(MlToken.seller_id == str(seller_id)).first()
-        return db.query(User).filter(User.id == token.user_id).first() if token else None
-    finally:
-        db.close()
+    return db.query(User).join(MlToken, MlToken.user_id == User.id).filter(MlToken.seller_id == str(seller_id)).first()
 
 
-def _get_few_shot_feedback(user_id: int, item_id: Optional[str], limit: int = 5) -> list:
-    """Últimos (pergunta, resposta_final) do usuário para few-shot."""
-    db = SessionLocal()
+def _users_with_ml_token(db: Session) -> List[User]:
+    """Usuários com conta ML conectada (uma consulta, sem N+1)."""
+    return db.query(User).join(MlToken, MlToken.user_id == User.id).all()
+
+
+def _get_few_shot_feedback(user_id: int, item_id: Optional[str], limit: int = 5, db: Optional[Session] = None) -> list:
+    """Últimos (pergunta, resposta_final) do usuário para few-shot (db: reaproveita a sessão de quem chama)."""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
     try:
         q = (
             db.query(QuestionAnswerFeedback)
@@ -1453,7 +1481,8 @@ def _get_few_shot_feedback(user_id: int, item_id: Optional[str], limit: int = 5)
             out.append((r.pergunta_texto or "", r.resposta_final_publicada or ""))
         return out[:limit]
     finally:
-        db.close()
+        if own_session:
+            db.close()
 
 
 def _process_ml_question_webhook(question_id: str, user_id: int):
@@ -1468,7 +1497,10 @@ def _process_ml_question_webhook(question_id: str, user_id: int):
         token = db.query(MlToken).filter(MlToken.user_id == user_id).first()
         if not token or not token.access_token:
             return
-        detail = get_question_detail(token.access_token, question_id)
+        access_token = token.access_token
+        # ML e IA levam segundos: não segura uma conexão do pool enquanto espera
+        end_read(db)
+        detail = get_question_detail(access_token, question_id)
         if not detail:
             logger.warning("Webhook question: não foi possível obter detalhe da pergunta %s", question_id)
             return
@@ -1480,11 +1512,12 @@ def _process_ml_question_webhook(question_id: str, user_id: int):
         pergunta_texto = (detail.get("text") or "").strip()
         if not pergunta_texto:
             return
+        few_shot = _get_few_shot_feedback(user_id, item_id, db=db)
+        end_read(db)
         item_title = None
         if item_id:
-            item = get_item_details(token.access_token, item_id)
+            item = get_item_details(access_token, item_id)
             item_title = (item or {}).get("title")
-        few_shot = _get_few_shot_feedback(user_id, item_id)
         try:
             resposta_ia = run_answer_for_question(
                 pergunta_texto,
@@ -1566,24 +1599,18 @@ async def ml_webhook(request: Request, background_tasks: BackgroundTasks):
 
     logger.info("Webhook ML questions: question_id=%s user_id_ml=%s", question_id, user_id_ml)
 
+    # Banco via run_db e ML via threads: nada aqui bloqueia o event loop
     user = None
     if user_id_ml is not None:
-        user = _user_by_seller_id(str(user_id_ml))
+        user = await run_db(_user_by_seller_id, str(user_id_ml))
     if not user:
-        db = SessionLocal()
-        try:
-            for token in db.query(MlToken).all():
-                u = db.query(User).filter(User.id == token.user_id).first()
-                if not u:
-                    continue
-                t = get_valid_ml_token(u)
-                if t and t.access_token:
-                    detail = get_question_detail(t.access_token, question_id)
-                    if detail:
-                        user = u
-                        break
-        finally:
-            db.close()
+        for u in await run_db(_users_with_ml_token):
+            t = await run_in_threadpool(get_valid_ml_token, u)
+            if t and t.access_token:
+                detail = await ml_api_async.get_question_detail(t.access_token, question_id)
+                if detail:
+                    user = u
+                    break
 
     if user:
         background_tasks.add_task(_process_ml_question_webhook, question_id, user.id)
@@ -1601,9 +1628,10 @@ def ml_questions_list(
     limit: int = 50,
     offset: int = 0,
     user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
 ):
     """Lista perguntas recebidas nos anúncios do vendedor (API ML)."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     result = get_questions_search(
@@ -1619,31 +1647,50 @@ def ml_questions_list(
     return result
 
 
-@app.get("/api/ml/questions/pending")
-def ml_questions_pending(user: User = Depends(paid_guard)):
-    """Lista perguntas com resposta sugerida aguardando aprovação/edição."""
-    db = SessionLocal()
+def _keyset_page(query, model, limit: int, cursor: Optional[str]):
     try:
-        rows = (
-            db.query(PendingQuestion)
-            .filter(PendingQuestion.user_id == user.id, PendingQuestion.status == "pending")
-            .order_by(PendingQuestion.created_at.desc())
-            .all()
-        )
-        return [
-            {
-                "id": r.id,
-                "question_id": r.question_id,
-                "item_id": r.item_id,
-                "item_title": r.item_title,
-                "pergunta_texto": r.pergunta_texto,
-                "resposta_ia_sugerida": r.resposta_ia_sugerida,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
-            }
-            for r in rows
-        ]
-    finally:
-        db.close()
+        return pagination.keyset_page(query, model, limit, cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+
+def _set_page_headers(response: Response, next_cursor: Optional[str], total: Optional[int] = None) -> None:
+    """Listas que retornam array: próxima página e total aproximado vão nos headers."""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+
+
+@app.get("/api/ml/questions/pending")
+def ml_questions_pending(
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
+):
+    """Lista perguntas com resposta sugerida aguardando aprovação/edição (mais recentes primeiro).
+
+    Paginação por cursor: o header X-Next-Cursor traz o cursor da próxima página (ausente na última).
+    """
+    q = db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.status == "pending")
+    rows, next_cursor = _keyset_page(q, PendingQuestion, pagination.clamp_limit(limit, 100), cursor)
+    total = pagination.approx_count(("pending", user.id), q.count) if include_total else None
+    _set_page_headers(response, next_cursor, total)
+    return [
+        {
+            "id": r.id,
+            "question_id": r.question_id,
+            "item_id": r.item_id,
+            "item_title": r.item_title,
+            "pergunta_texto": r.pergunta_texto,
+            "resposta_ia_sugerida": r.resposta_ia_sugerida,
+            "created_at": r.created_at.isoformat() if r.created_at else None,
+        }
+        for r in rows
+    ]
 
 
 class PublishAnswerInput(BaseModel):
@@ -1651,9 +1698,9 @@ class PublishAnswerInput(BaseModel):
 
 
 @app.get("/api/ml/questions/metrics")
-def ml_questions_metrics(user: User = Depends(paid_guard)):
+def ml_questions_metrics(user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Métricas de atendimento: total de perguntas, respondidas, não respondidas, tempo médio até resposta."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     result = get_questions_search(token.access_token, seller_id=token.seller_id, limit=100, offset=0)
@@ -1694,71 +1741,71 @@ def ml_questions_metrics(user: User = Depends(paid_guard)):
 
 
 @app.get("/api/ml/questions/history")
-def ml_questions_history(limit: int = 50, offset: int = 0, user: User = Depends(paid_guard)):
-    """Histórico de perguntas e respostas já publicadas, armazenadas no banco."""
-    db = SessionLocal()
-    try:
-        rows = (
-            db.query(QuestionAnswerFeedback)
-            .filter(QuestionAnswerFeedback.user_id == user.id)
-            .order_by(QuestionAnswerFeedback.created_at.desc())
-            .offset(offset)
-            .limit(limit)
-            .all()
-        )
-        total = db.query(QuestionAnswerFeedback).filter(QuestionAnswerFeedback.user_id == user.id).count()
-        return {
-            "total": total,
-            "items": [
-                {
-                    "id": r.id,
-                    "question_id": r.question_id,
-                    "item_id": r.item_id,
-                    "pergunta_texto": r.pergunta_texto,
-                    "resposta_ia_sugerida": r.resposta_ia_sugerida,
-                    "resposta_publicada": r.resposta_final_publicada,
-                    "created_at": r.created_at.isoformat() if r.created_at else None,
-                }
-                for r in rows
-            ],
-        }
-    finally:
-        db.close()
+def ml_questions_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    include_total: bool = True,
+    user: User = Depends(paid_guard),
+    db: Session = Depends(get_db),
+):
+    """Histórico de perguntas e respostas já publicadas, armazenadas no banco.
+
+    Paginação por cursor: passe o next_cursor da resposta anterior. offset continua aceito (legado),
+    mas custa proporcional à página. total é aproximado (cacheado por alguns segundos).
+    """
+    q = db.query(QuestionAnswerFeedback).filter(QuestionAnswerFeedback.user_id == user.id)
+    limit = pagination.clamp_limit(limit, 50)
+    if offset and not cursor:
+        rows = q.order_by(QuestionAnswerFeedback.created_at.desc(), QuestionAnswerFeedback.id.desc()).offset(offset).limit(limit + 1).all()
+        next_cursor = pagination.encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+        rows = rows[:limit]
+    else:
+        rows, next_cursor = _keyset_page(q, QuestionAnswerFeedback, limit, cursor)
+    total = pagination.approx_count(("history", user.id), q.count) if include_total else None
+    return {
+        "total": total,
+        "next_cursor": next_cursor,
+        "items": [
+            {
+                "id": r.id,
+                "question_id": r.question_id,
+                "item_id": r.item_id,
+                "pergunta_texto": r.pergunta_texto,
+                "resposta_ia_sugerida": r.resposta_ia_sugerida,
+                "resposta_publicada": r.resposta_final_publicada,
+                "created_at": r.created_at.isoformat() if r.created_at else None,
+            }
+            for r in rows
+        ],
+    }
 
 
 @app.post("/api/ml/questions/sync")
-def ml_questions_sync(user: User = Depends(paid_guard)):
+def ml_questions_sync(user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Busca perguntas não respondidas no ML e enfileira para aprovação (não depende do webhook)."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     result = get_questions_search(token.access_token, seller_id=token.seller_id, limit=50, offset=0)
     if result is None:
         raise HTTPException(status_code=503, detail="Não foi possível buscar perguntas no Mercado Livre. Tente novamente.")
-    questions = result.get("questions") or []
-    db = SessionLocal()
+    question_ids = question_poller.open_question_ids(result.get("questions") or [])
+    existing = question_poller.existing_question_ids(db, user.id, question_ids)
+    end_read(db)  # a IA leva segundos por pergunta: não segura a conexão enquanto isso
     enqueued = 0
-    try:
-        for q in questions:
-            status = (q.get("status") or "").upper()
-            if status in ("ANSWERED", "BANNED", "DELETED", "DISABLED"):
-                continue
-            question_id = str(q.get("id") or "").strip()
-            if not question_id:
-                continue
-            if db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.question_id == question_id).first():
-                continue
-            _process_ml_question_webhook(question_id, user.id)
-            enqueued += 1
-        return {"ok": True, "synced": enqueued, "message": f"{enqueued} pergunta(s) trazida(s) para aprovação." if enqueued else "Nenhuma pergunta nova para aprovar."}
-    finally:
-        db.close()
+    for question_id in question_ids:
+        if question_id in existing:
+            continue
+        _process_ml_question_webhook(question_id, user.id)
+        enqueued += 1
+    return {"ok": True, "synced": enqueued, "message": f"{enqueued} pergunta(s) trazida(s) para aprovação." if enqueued else "Nenhuma pergunta nova para aprovar."}
 
 
 @app.post("/api/ml/questions/{question_id}/publish")
-def ml_question_publish(question_id: str, data: PublishAnswerInput, user: User = Depends(paid_guard)):
+def ml_question_publish(question_id: str, data: PublishAnswerInput, user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Aprova ou edita a resposta e publica no ML. Grava feedback para few-shot."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
     text = (data.text or "").strip()
@@ -1767,25 +1814,23 @@ def ml_question_publish(question_id: str, data: PublishAnswerInput, user: User =
     result = post_answer(token.access_token, question_id, text)
     if result is None:
         raise HTTPException(status_code=400, detail="Não foi possível publicar a resposta no Mercado Livre.")
-    db = SessionLocal()
-    try:
-        pending = db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.question_id == question_id).first()
-        if pending:
-            db.add(
-                QuestionAnswerFeedback(
-                    user_id=user.id,
-                    question_id=question_id,
-                    item_id=pending.item_id,
-                    pergunta_texto=pending.pergunta_texto or "",
-                    resposta_ia_sugerida=pending.resposta_ia_sugerida,
-                    resposta_final_publicada=text[:2048],
-                )
+    pending = db.query(PendingQuestion).filter(PendingQuestion.user_id == user.id, PendingQuestion.question_id == question_id).first()
+    if pending:
+        db.add(
+            QuestionAnswerFeedback(
+                user_id=user.id,
+                question_id=question_id,
+                item_id=pending.item_id,
+                pergunta_texto=pending.pergunta_texto or "",
+                resposta_ia_sugerida=pending.resposta_ia_sugerida,
+                resposta_final_publicada=text[:2048],
             )
-            pending.status = "published"
-            db.commit()
-        return {"ok": True, "message": "Resposta publicada."}
-    finally:
-        db.close()
+        )
+        pending.status = "published"
+        db.commit()
+        pagination.invalidate_count(("history", user.id))
+        pagination.invalidate_count(("pending", user.id))
+    return {"ok": True, "message": "Resposta publicada."}
 
 
 @app.post("/api/calculate-profit")
@@ -1809,55 +1854,31 @@ def calculate_profit_endpoint(
 # Painel financeiro integrado ML (dados via API + custos no banco)
 # ------------------------------------------------------------------
 @app.get("/api/financial-panel")
-def financial_panel(user: User = Depends(paid_guard)):
+def financial_panel(user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Retorna dados financeiros dos anúncios do usuário via API ML + custos salvos no banco."""
-    return _compute_financial_panel(user)
+    return _compute_financial_panel(user, db)
 
 
 @app.post("/api/financial-panel/costs")
-def save_financial_costs(data: ItemCostsBatch, user: User = Depends(paid_guard)):
-    """Salva/atualiza custos por anúncio no banco."""
-    db = SessionLocal()
-    try:
-        for upd in data.items:
-            c = db.query(ItemCost).filter(ItemCost.user_id == user.id, ItemCost.item_id == upd.item_id).first()
-            if c is None:
-                c = ItemCost(user_id=user.id, item_id=upd.item_id)
-                db.add(c)
-            if upd.sku is not None:
-                c.sku = upd.sku
-            if upd.custo_produto is not None:
-                c.custo_produto = upd.custo_produto
-            if upd.embalagem is not None:
-                c.embalagem = upd.embalagem
-            if upd.frete is not None:
-                c.frete = upd.frete
-            if upd.taxa_pct is not None:
-                c.taxa_pct = upd.taxa_pct
-            if upd.imposto_pct is not None:
-                c.imposto_pct = upd.imposto_pct
-        db.commit()
-        return {"ok": True, "saved": len(data.items)}
-    finally:
-        db.close()
+def save_financial_costs(data: ItemCostsBatch, user: User = Depends(paid_guard), db: Session = Depends(get_db)):
+    """Salva/atualiza custos por anúncio no banco (upsert em lote; campos não enviados ficam como estão)."""
+    result = bulk_upsert_costs(db, user.id, (upd.model_dump() for upd in data.items))
+    return {"ok": True, **result}
 
 
-def _compute_financial_panel(user: User) -> dict:
+def _compute_financial_panel(user: User, db: Session) -> dict:
     """Lógica interna do painel financeiro (reutilizada por ai-insights)."""
-    token = get_valid_ml_token(user)
+    token = get_valid_ml_token(user, db)
     if not token or not token.seller_id:
         raise HTTPException(status_code=403, detail="ml_not_connected")
-    result = get_user_items(token.access_token, token.seller_id, status="all", limit=50)
-    if not result or not result.get("results"):
-        return {"metrics": {"total_listings": 0, "profit_total": 0, "margin_mean": 0, "missing_cost": 0}, "items": [], "top_profit": []}
-    item_ids = result["results"][:50]
-    items_data = get_multiple_items(token.access_token, item_ids) or []
+    started = time.time()
+    item_ids = get_all_user_item_ids(token.access_token, token.seller_id)
+    if not item_ids:
+        return {"partial": ml_deadline.exceeded(), "metrics": {"total_listings": 0, "profit_total": 0, "margin_mean": 0, "missing_cost": 0}, "items": [], "top_profit": []}
+    logger.info("Painel financeiro: %d anúncios listados em %.2fs (user_id=%s)", len(item_ids), time.time() - started, user.id)
+    items_data = get_multiple_items(token.access_token, item_ids, attributes=_FINANCIAL_PANEL_ATTRIBUTES) or []
     items_data = [i for i in items_data if not _is_subscription_plan(i)]
-    db = SessionLocal()
-    try:
-        costs = {c.item_id: c for c in db.query(ItemCost).filter(ItemCost.user_id == user.id).all()}
-    finally:
-        db.close()
+    costs = {c.item_id: c for c in db.query(ItemCost).filter(ItemCost.user_id == user.id).all()}
     DEFAULT_TAXA, DEFAULT_IMPOSTO = 13.0, 5.0
     items = []
     for it in items_data:
@@ -1886,29 +1907,22 @@ def _compute_financial_panel(user: User) -> dict:
     fee_total = sum(i["fee_amount"] for i in items)
     missing_cost = sum(1 for i in items if i["custo_produto"] is None)
     top_profit = sorted(valid_profits, key=lambda x: x["profit"], reverse=True)[:10]
-    return {"metrics": {"total_listings": total_listings, "active_listings": active_listings, "total_stock": total_stock, "avg_price": round(avg_price, 2), "avg_fee_pct": round(avg_fee, 2), "profit_mean": round(profit_mean, 2), "margin_mean": round(margin_mean, 2), "profit_total": round(profit_total, 2), "fee_total": round(fee_total, 2), "missing_cost": missing_cost}, "items": items, "top_profit": [{"ITEM_ID": i["id"], "SKU_STR": i["sku"], "TITLE": i["title"], "PRICE_NUM": i["price"], "COST": i["custo_produto"], "PROFIT": i["profit"], "MARGIN_PCT": i["margin_pct"]} for i in top_profit]}
+    return {"partial": ml_deadline.exceeded(), "metrics": {"total_listings": total_listings, "active_listings": active_listings, "total_stock": total_stock, "avg_price": round(avg_price, 2), "avg_fee_pct": round(avg_fee, 2), "profit_mean": round(profit_mean, 2), "margin_mean": round(margin_mean, 2), "profit_total": round(profit_total, 2), "fee_total": round(fee_total, 2), "missing_cost": missing_cost}, "items": items, "top_profit": [{"ITEM_ID": i["id"], "SKU_STR": i["sku"], "TITLE": i["title"], "PRICE_NUM": i["price"], "COST": i["custo_produto"], "PROFIT": i["profit"], "MARGIN_PCT": i["margin_pct"]} for i in top_profit]}
 
 
 def _log_ia_failure(user_id: Optional[int], event_type: str, message: str, extra: Optional[str] = None):
-    """Registra falha de IA no audit_log para admin."""
-    db = SessionLocal()
-    try:
-        db.add(AuditLog(user_id=user_id, event_type=event_type, message=message[:512], extra=(extra or "")[:1024]))
-        db.commit()
-    except Exception as ex:
-        logger.warning("Falha ao registrar audit_log: %s", ex)
-    finally:
-        db.close()
+    """Registra falha de IA no audit_log para admin (enfileirado; gravado em lote em background)."""
+    audit_log.record(user_id, event_type, message, extra)
 
 
 @app.post("/api/financial-panel/ai-insights")
-def financial_ai_insights(user: User = Depends(paid_guard)):
+def financial_ai_insights(user: User = Depends(paid_guard), db: Session = Depends(get_db)):
     """Gera insights de IA sobre o painel financeiro."""
     try:
         from app.services.llm_service import run_market_analysis
     except Exception:
         raise HTTPException(status_code=503, detail="IA não configurada. Defina OPENAI_API_KEY.")
-    panel = _compute_financial_panel(user)
+    panel = _compute_financial_panel(user, db)
     items = panel.get("items", [])
     metrics = panel.get("metrics", {})
     # Monta resumo por item: preço, margem, vendidos (CRÍTICO para avaliar competitividade)
@@ -2221,51 +2235,52 @@ def get_job(job_id: str, user: User = Depends(paid_guard)):
 
 
 @app.get("/api/admin/users")
-def admin_users(admin_user: User = Depends(admin_guard)):
-    """Lista todos os usuários (admin)."""
-    db = SessionLocal()
-    try:
-        users = db.query(User).order_by(User.created_at.desc()).all()
-        return [
-            {
-                "id": u.id,
-                "email": u.email,
-                "clerk_user_id": u.clerk_user_id,
-                "plan": u.plan,
-                "created_at": u.created_at.isoformat() if u.created_at else None,
-            }
-            for u in users
-        ]
-    finally:
-        db.close()
+def admin_users(
+    response: Response,
+    limit: int = 200,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    admin_user: User = Depends(admin_guard),
+    db: Session = Depends(get_db),
+):
+    """Lista usuários (admin), mais recentes primeiro; próxima página pelo header X-Next-Cursor."""
+    users, next_cursor = _keyset_page(db.query(User), User, pagination.clamp_limit(limit, 200), cursor)
+    total = pagination.approx_count(("admin_users",), db.query(User).count) if include_total else None
+    _set_page_headers(response, next_cursor, total)
+    return [
+        {
+            "id": u.id,
+            "email": u.email,
+            "clerk_user_id": u.clerk_user_id,
+            "plan": u.plan,
+            "created_at": u.created_at.isoformat() if u.created_at else None,
+        }
+        for u in users
+    ]
 
 
 @app.get("/api/admin/subscriptions")
-def admin_subscriptions(admin_user: User = Depends(admin_guard)):
+def admin_subscriptions(admin_user: User = Depends(admin_guard), db: Session = Depends(get_db)):
     """Lista assinaturas (admin)."""
-    db = SessionLocal()
-    try:
-        subs = (
-            db.query(Subscription)
-            .join(User)
-            .order_by(Subscription.created_at.desc())
-            .all()
-        )
-        return [
-            {
-                "id": s.id,
-                "user_id": s.user_id,
-                "user_email": s.user.email if s.user else None,
-                "stripe_subscription_id": s.stripe_subscription_id,
-                "status": s.status,
-                "started_at": s.started_at.isoformat() if s.started_at else None,
-                "ends_at": s.ends_at.isoformat() if s.ends_at else None,
-                "created_at": s.created_at.isoformat() if s.created_at else None,
-            }
-            for s in subs
-        ]
-    finally:
-        db.close()
+    subs = (
+        db.query(Subscription)
+        .join(User)
+        .order_by(Subscription.created_at.desc())
+        .all()
+    )
+    return [
+        {
+            "id": s.id,
+            "user_id": s.user_id,
+            "user_email": s.user.email if s.user else None,
+            "stripe_subscription_id": s.stripe_subscription_id,
+            "status": s.status,
+            "started_at": s.started_at.isoformat() if s.started_at else None,
+            "ends_at": s.ends_at.isoformat() if s.ends_at else None,
+            "created_at": s.created_at.isoformat() if s.created_at else None,
+        }
+        for s in subs
+    ]
 
 
 @app.post("/api/create-checkout-session")
@@ -2338,62 +2353,75 @@ async def mercado_pago_webhook(request: Request):
     if not preapproval_id:
         return {"received": True}
 
-    preapproval = get_preapproval(preapproval_id)
+    preapproval = await run_in_threadpool(get_preapproval, preapproval_id)
     if not preapproval:
         return {"received": True}
 
+    # Os handlers também consultam a API do MP (plano): sessão síncrona numa thread, não run_db
+    await run_in_threadpool(_apply_mp_preapproval, body.get("action", ""), preapproval)
+    return {"received": True}
+
+
+def _apply_mp_preapproval(action: str, preapproval: dict) -> None:
     db = SessionLocal()
     try:
-        action = body.get("action", "")
         if action in ("created", "authorized"):
             handle_preapproval_created(preapproval, db)
         else:
             handle_preapproval_updated(preapproval, db)
     finally:
         db.close()
-    return {"received": True}
 
 
 @app.get("/api/admin/audit-logs")
 def admin_audit_logs(
+    response: Response,
     event_type: Optional[str] = None,
     limit: int = 100,
+    cursor: Optional[str] = None,
     admin_user: User = Depends(admin_guard),
+    db: Session = Depends(get_db),
 ):
-    """Lista logs de auditoria (falhas IA, etc.) — admin."""
-    db = SessionLocal()
-    try:
-        q = db.query(AuditLog).order_by(AuditLog.created_at.desc()).limit(limit)
-        if event_type:
-            q = q.filter(AuditLog.event_type == event_type)
-        logs = q.all()
-        return [
-            {"id": l.id, "user_id": l.user_id, "event_type": l.event_type, "message": l.message, "extra": l.extra, "created_at": l.created_at.isoformat() if l.created_at else None}
-            for l in logs
-        ]
-    finally:
-        db.close()
+    """Lista logs de auditoria (falhas IA, etc.) — admin.
+
+    Com event_type, a consulta segue o índice (event_type, created_at); próxima página pelo header X-Next-Cursor.
+    """
+    q = db.query(AuditLog)
+    if event_type:
+        q = q.filter(AuditLog.event_type == event_type)
+    logs, next_cursor = _keyset_page(q, AuditLog, pagination.clamp_limit(limit, 100), cursor)
+    _set_page_headers(response, next_cursor)
+    return [
+        {"id": l.id, "user_id": l.user_id, "event_type": l.event_type, "message": l.message, "extra": l.extra, "created_at": l.created_at.isoformat() if l.created_at else None}
+        for l in logs
+    ]
 
 
 @app.get("/api/admin/metrics")
-def admin_metrics(admin_user: User = Depends(admin_guard)):
+def admin_metrics(admin_user: User = Depends(admin_guard), db: Session = Depends(get_db)):
     """Métricas do sistema para gestão (admin)."""
-    db = SessionLocal()
-    try:
-        total_users = db.query(User).count()
-        active_plan = db.query(User).filter(User.plan == "active").count()
-        free_plan = db.query(User).filter(User.plan == "free").count()
-        subs = db.query(Subscription).filter(Subscription.status == "active").count()
-        ml_connected = db.query(MlToken).count()
-        return {
-            "total_users": total_users,
-            "users_active_plan": active_plan,
-            "users_free_plan": free_plan,
-            "subscriptions_active": subs,
-            "ml_accounts_connected": ml_connected,
-        }
-    finally:
-        db.close()
+    total_users = db.query(User).count()
+    active_plan = db.query(User).filter(User.plan == "active").count()
+    free_plan = db.query(User).filter(User.plan == "free").count()
+    subs = db.query(Subscription).filter(Subscription.status == "active").count()
+    ml_connected = db.query(MlToken).count()
+    return {
+        "total_users": total_users,
+        "users_active_plan": active_plan,
+        "users_free_plan": free_plan,
+        "subscriptions_active": subs,
+        "ml_accounts_connected": ml_connected,
+        "auth_cache": get_auth_cache_stats(),
+        "audit_log": audit_log.get_stats(),
+        "question_poller": question_poller.get_stats(),
+        "db_pool": get_pool_stats(),
+    }
+
+
+@app.get("/api/admin/ml-api-stats")
+def admin_ml_api_stats(admin_user: User = Depends(admin_guard)):
+    """Estatísticas da integração com a API do ML (pool de conexões, reuso, cache de tokens) — admin."""
+    return {**get_ml_api_stats(), "tokens": ml_token_service.get_stats()}
 
 
 class AdminUpdatePlan(BaseModel):
@@ -2405,20 +2433,17 @@ def admin_update_user_plan(
     user_id: int,
     data: AdminUpdatePlan,
     admin_user: User = Depends(admin_guard),
+    db: Session = Depends(get_db),
 ):
     """Altera o plano de um usuário (admin)."""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuário não encontrado.")
-        if data.plan not in ("free", "active"):
-            raise HTTPException(status_code=400, detail="Plano inválido. Use 'free' ou 'active'.")
-        user.plan = data.plan
-        db.commit()
-        return {"ok": True, "user_id": user_id, "plan": data.plan}
-    finally:
-        db.close()
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+    if data.plan not in ("free", "active"):
+        raise HTTPException(status_code=400, detail="Plano inválido. Use 'free' ou 'active'.")
+    user.plan = data.plan
+    db.commit()
+    return {"ok": True, "user_id": user_id, "plan": data.plan}
 
 
 @app.get("/api/admin/logs")
@@ -2444,143 +2469,131 @@ def admin_logs(admin_user: User = Depends(admin_guard)):
 # ------------------------------------------------------------------
 
 @app.get("/api/billing/status")
-def billing_status(user: User = Depends(get_current_user)):
+def billing_status(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Status da assinatura do usuário (plano, valor, datas, status)."""
-    db = SessionLocal()
-    try:
-        sub = (
-            db.query(Subscription)
-            .filter(Subscription.user_id == user.id)
-            .order_by(Subscription.created_at.desc())
-            .first()
-        )
-        if not sub:
-            return {
-                "plan": "free",
-                "status": "no_subscription",
-                "amount": None,
-                "currency": "BRL",
-                "started_at": None,
-                "next_billing_at": None,
-                "cancel_at_period_end": False,
-                "provider": "mercado_pago",
-                "subscription_id": None,
-            }
-
-        # Buscar dados atualizados do MP se possível
-        mp_data = None
-        if sub.stripe_subscription_id:
-            try:
-                mp_data = get_preapproval(sub.stripe_subscription_id)
-            except Exception:
-                pass
-
-        next_billing = None
-        amount = MP_PLAN_VALUE
-        cancel_at_period_end = False
-
-        if mp_data:
-            auto_rec = mp_data.get("auto_recurring") or {}
-            amount = auto_rec.get("transaction_amount", MP_PLAN_VALUE)
-            next_payment = mp_data.get("next_payment_date")
-            if next_payment:
-                next_billing = next_payment
-            mp_status = mp_data.get("status", sub.status)
-            cancel_at_period_end = mp_status in ("cancelled", "paused")
-        else:
-            mp_status = sub.status
-
+    sub = (
+        db.query(Subscription)
+        .filter(Subscription.user_id == user.id)
+        .order_by(Subscription.created_at.desc())
+        .first()
+    )
+    if not sub:
         return {
-            "plan": "pro_mensal" if user.plan == "active" else "free",
-            "status": mp_status or sub.status,
-            "amount": amount,
+            "plan": "free",
+            "status": "no_subscription",
+            "amount": None,
             "currency": "BRL",
-            "started_at": sub.started_at.isoformat() if sub.started_at else None,
-            "ends_at": sub.ends_at.isoformat() if sub.ends_at else None,
-            "next_billing_at": next_billing,
-            "cancel_at_period_end": cancel_at_period_end,
+            "started_at": None,
+            "next_billing_at": None,
+            "cancel_at_period_end": False,
             "provider": "mercado_pago",
-            "subscription_id": sub.stripe_subscription_id,
+            "subscription_id": None,
         }
-    finally:
-        db.close()
+
+    # Buscar dados atualizados do MP se possível
+    mp_data = None
+    if sub.stripe_subscription_id:
+        try:
+            mp_data = get_preapproval(sub.stripe_subscription_id)
+        except Exception:
+            pass
+
+    next_billing = None
+    amount = MP_PLAN_VALUE
+    cancel_at_period_end = False
+
+    if mp_data:
+        auto_rec = mp_data.get("auto_recurring") or {}
+        amount = auto_rec.get("transaction_amount", MP_PLAN_VALUE)
+        next_payment = mp_data.get("next_payment_date")
+        if next_payment:
+            next_billing = next_payment
+        mp_status = mp_data.get("status", sub.status)
+        cancel_at_period_end = mp_status in ("cancelled", "paused")
+    else:
+        mp_status = sub.status
+
+    return {
+        "plan": "pro_mensal" if user.plan == "active" else "free",
+        "status": mp_status or sub.status,
+        "amount": amount,
+        "currency": "BRL",
+        "started_at": sub.started_at.isoformat() if sub.started_at else None,
+        "ends_at": sub.ends_at.isoformat() if sub.ends_at else None,
+        "next_billing_at": next_billing,
+        "cancel_at_period_end": cancel_at_period_end,
+        "provider": "mercado_pago",
+        "subscription_id": sub.stripe_subscription_id,
+    }
 
 
 @app.get("/api/billing/history")
-def billing_history(user: User = Depends(get_current_user)):
+def billing_history(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Histórico de assinaturas do usuário."""
-    db = SessionLocal()
-    try:
-        subs = (
-            db.query(Subscription)
-            .filter(Subscription.user_id == user.id)
-            .order_by(Subscription.created_at.desc())
-            .all()
-        )
-        return [
-            {
-                "id": s.id,
-                "subscription_id": s.stripe_subscription_id,
-                "status": s.status,
-                "started_at": s.started_at.isoformat() if s.started_at else None,
-                "ends_at": s.ends_at.isoformat() if s.ends_at else None,
-                "created_at": s.created_at.isoformat() if s.created_at else None,
-            }
-            for s in subs
-        ]
-    finally:
-        db.close()
+    subs = (
+        db.query(Subscription)
+        .filter(Subscription.user_id == user.id)
+        .order_by(Subscription.created_at.desc())
+        .all()
+    )
+    return [
+        {
+            "id": s.id,
+            "subscription_id": s.stripe_subscription_id,
+            "status": s.status,
+            "started_at": s.started_at.isoformat() if s.started_at else None,
+            "ends_at": s.ends_at.isoformat() if s.ends_at else None,
+            "created_at": s.created_at.isoformat() if s.created_at else None,
+        }
+        for s in subs
+    ]
 
 
 @app.post("/api/billing/cancel")
-def billing_cancel(user: User = Depends(get_current_user)):
+def billing_cancel(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Solicita cancelamento da assinatura ativa."""
-    db = SessionLocal()
-    try:
-        sub = (
-            db.query(Subscription)
-            .filter(Subscription.user_id == user.id, Subscription.status == "active")
-            .order_by(Subscription.created_at.desc())
-            .first()
-        )
-        if not sub:
-            raise HTTPException(status_code=404, detail="Nenhuma assinatura ativa encontrada.")
-
-        # Tentar cancelar no Mercado Pago
-        canceled_at_mp = False
-        if sub.stripe_subscription_id and MP_ACCESS_TOKEN:
-            try:
-                headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}", "Content-Type": "application/json"}
-                resp = requests.put(
-                    f"https://api.mercadopago.com/preapproval/{sub.stripe_subscription_id}",
-                    json={"status": "cancelled"},
-                    headers=headers,
-                    timeout=15,
-                )
-                if resp.status_code == 200:
-                    canceled_at_mp = True
-                    logger.info("Billing: assinatura %s cancelada no MP", sub.stripe_subscription_id)
-                else:
-                    logger.warning("Billing: falha ao cancelar no MP. status=%s body=%s", resp.status_code, resp.text[:300])
-            except Exception as e:
-                logger.exception("Billing: erro ao cancelar no MP: %s", e)
-
-        # Atualizar banco local
-        sub.status = "canceled"
-        sub.ends_at = datetime.utcnow()
-        user_obj = db.query(User).filter(User.id == user.id).first()
-        if user_obj:
-            user_obj.plan = "free"
-            user_obj.updated_at = datetime.utcnow()
-        db.commit()
-
-        # Registrar auditoria
-        db.add(AuditLog(user_id=user.id, event_type="billing_cancel", message=f"Assinatura cancelada. MP={canceled_at_mp}"))
-        db.commit()
+    sub = (
+        db.query(Subscription)
+        .filter(Subscription.user_id == user.id, Subscription.status == "active")
+        .order_by(Subscription.created_at.desc())
+        .first()
+    )
+    if not sub:
+        raise HTTPException(status_code=404, detail="Nenhuma assinatura ativa encontrada.")
 
-        return {"ok": True, "canceled_at_mp": canceled_at_mp}
-    finally:
-        db.close()
+    # Tentar cancelar no Mercado Pago
+    canceled_at_mp = False
+    if sub.stripe_subscription_id and MP_ACCESS_TOKEN:
+        try:
+            headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}", "Content-Type": "application/json"}
+            resp = requests.put(
+                f"https://api.mercadopago.com/preapproval/{sub.stripe_subscription_id}",
+                json={"status": "cancelled"},
+                headers=headers,
+                timeout=15,
+            )
+            if resp.status_code == 200:
+                canceled_at_mp = True
+                logger.info("Billing: assinatura %s cancelada no MP", sub.stripe_subscription_id)
+            else:
+                logger.warning("Billing: falha ao cancelar no MP. status=%s body=%s", resp.status_code, resp.text[:300])
+        except Exception as e:
+            logger.exception("Billing: erro ao cancelar no MP: %s", e)
+
+    # Atualizar banco local
+    sub.status = "canceled"
+    sub.ends_at = datetime.utcnow()
+    user_obj = db.query(User).filter(User.id == user.id).first()
+    if user_obj:
+        user_obj.plan = "free"
+        user_obj.updated_at = datetime.utcnow()
+    db.commit()
+
+    # Registrar auditoria
+    db.add(AuditLog(user_id=user.id, event_type="billing_cancel", message=f"Assinatura cancelada. MP={canceled_at_mp}"))
+    db.commit()
+
+    return {"ok": True, "canceled_at_mp": canceled_at_mp}
 
 
 # ------------------------------------------------------------------
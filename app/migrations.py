@@ -0,0 +1,115 @@
+# app/migrations.py — Migrações de schema versionadas (tabela schema_migrations)
+# No boot, init_db consulta a versão aplicada; se já estiver na última, não roda DDL nenhum.
+# Senão, sob lock (advisory lock no PostgreSQL, BEGIN IMMEDIATE no SQLite) cria as tabelas que
+# faltam e aplica só as migrações pendentes — um worker aplica, os outros esperam e encontram tudo pronto.
+#
+# Para adicionar uma migração: acrescente uma função ao fim de MIGRATIONS (versão = posição + 1).
+# As funções recebem a conexão da transação e devem ser idempotentes (o banco pode ter sido criado
+# direto pelo create_all com o modelo atual).
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+_log = logging.getLogger("ml-intelligence")
+
+_PG_LOCK_KEY = 7_345_113_901  # chave do pg_advisory_xact_lock das migrações
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _m001_users_telegram_chat_id(conn: Connection) -> None:
+    """users.telegram_chat_id (notificações de perguntas pelo Telegram)."""
+    if not _has_column(conn, "users", "telegram_chat_id"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN telegram_chat_id VARCHAR(64)"))
+
+
+def _create_indexes(conn: Connection, indexes: List[Tuple[str, str, str]]) -> None:
+    for name, table, columns in indexes:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _m002_hot_query_indexes(conn: Connection) -> None:
+    """Índices compostos das consultas quentes (ver bench/index_advisor.py)."""
+    _create_indexes(conn, [
+        ("ix_pending_questions_user_status_created", "pending_questions", "user_id, status, created_at"),
+        ("ix_question_answer_feedback_user_created", "question_answer_feedback", "user_id, created_at"),
+        ("ix_competitor_items_user_item", "competitor_items", "user_id, item_id"),
+        ("ix_item_costs_user_sku", "item_costs", "user_id, sku"),
+        ("ix_audit_logs_event_created", "audit_logs", "event_type, created_at"),
+        ("ix_audit_logs_created_at", "audit_logs", "created_at"),
+        ("ix_ml_tokens_seller_id", "ml_tokens", "seller_id"),
+        ("ix_ml_tokens_expires_at", "ml_tokens", "expires_at"),
+        ("ix_subscriptions_stripe_subscription_id", "subscriptions", "stripe_subscription_id"),
+    ])
+
+
+def _m003_users_created_at_index(conn: Connection) -> None:
+    """Índice em users.created_at (paginação por cursor do admin_users)."""
+    _create_indexes(conn, [("ix_users_created_at", "users", "created_at")])
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _m001_users_telegram_chat_id,
+    _m002_hot_query_indexes,
+    _m003_users_created_at_index,
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def _describe(fn: Callable[[Connection], None]) -> str:
+    return ((fn.__doc__ or fn.__name__).strip().splitlines() or [fn.__name__])[0][:255]
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(255), applied_at TIMESTAMP)"
+    ))
+
+
+def _current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table("schema_migrations"):
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar() or 0
+
+
+def _lock(conn: Connection) -> None:
+    """Serializa as migrações entre workers até o fim da transação."""
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+
+
+def migrate(engine: Engine, metadata) -> Tuple[int, int]:
+    """Cria tabelas e aplica migrações pendentes. Retorna (versão anterior, versão atual)."""
+    with engine.connect() as conn:
+        version = _current_version(conn)
+        conn.rollback()
+    if version >= LATEST_VERSION:
+        return version, version
+
+    with engine.connect() as conn:
+        _lock(conn)
+        version = _current_version(conn)  # outro worker pode ter migrado enquanto esperávamos o lock
+        if version < LATEST_VERSION:
+            metadata.create_all(bind=conn)
+            _ensure_version_table(conn)
+            start = version
+            for number, fn in enumerate(MIGRATIONS[version:], start=version + 1):
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :at)"),
+                    {"v": number, "d": _describe(fn), "at": datetime.utcnow()},
+                )
+                _log.info("Migração %03d aplicada: %s", number, _describe(fn))
+            version = LATEST_VERSION
+            conn.commit()
+            return start, version
+        conn.rollback()
+        return version, version
@@ -1,6 +1,6 @@
 # app/models.py — Modelos User, Subscription, ItemCost (dados por usuário)
 from datetime import datetime
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -8,6 +8,7 @@ from app.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_created_at", "created_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     clerk_user_id = Column(String(128), unique=True, nullable=False, index=True)
@@ -29,8 +30,8 @@ class MlToken(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
     access_token = Column(String(512), nullable=False)
     refresh_token = Column(String(512), nullable=False)
-    seller_id = Column(String(64), nullable=True)
-    expires_at = Column(DateTime, nullable=True)
+    seller_id = Column(String(64), nullable=True, index=True)  # webhook do ML identifica o vendedor por aqui
+    expires_at = Column(DateTime, nullable=True, index=True)  # renovação antecipada busca os que vencem
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="ml_token")
@@ -41,7 +42,7 @@ class Subscription(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    stripe_subscription_id = Column(String(128), nullable=True)
+    stripe_subscription_id = Column(String(128), nullable=True, index=True)  # webhooks buscam por aqui
     status = Column(String(32), default="active")  # active | canceled | past_due
     started_at = Column(DateTime, nullable=True)
     ends_at = Column(DateTime, nullable=True)
@@ -53,7 +54,10 @@ class Subscription(Base):
 class ItemCost(Base):
     """Custos e dados por anúncio por usuário (custo, embalagem, frete, imposto). Um registro por (user_id, item_id)."""
     __tablename__ = "item_costs"
-    __table_args__ = (UniqueConstraint("user_id", "item_id", name="uq_item_costs_user_item"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "item_id", name="uq_item_costs_user_item"),
+        Index("ix_item_costs_user_sku", "user_id", "sku"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -73,6 +77,10 @@ class ItemCost(Base):
 class AuditLog(Base):
     """Log de eventos (falhas de IA, etc.) para debug e admin."""
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        Index("ix_audit_logs_event_created", "event_type", "created_at"),
+        Index("ix_audit_logs_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
@@ -85,6 +93,7 @@ class AuditLog(Base):
 class PendingQuestion(Base):
     """Fila de perguntas (dos anúncios ML) com resposta sugerida pela IA, aguardando aprovação/edição do vendedor."""
     __tablename__ = "pending_questions"
+    __table_args__ = (Index("ix_pending_questions_user_status_created", "user_id", "status", "created_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -103,6 +112,7 @@ class PendingQuestion(Base):
 class QuestionAnswerFeedback(Base):
     """Feedback para aprendizado: pergunta + resposta final (aprovada ou editada) publicada no ML."""
     __tablename__ = "question_answer_feedback"
+    __table_args__ = (Index("ix_question_answer_feedback_user_created", "user_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -119,6 +129,7 @@ class QuestionAnswerFeedback(Base):
 class CompetitorItem(Base):
     """Concorrentes cadastrados manualmente pelo vendedor (por link/ID) para comparação."""
     __tablename__ = "competitor_items"
+    __table_args__ = (Index("ix_competitor_items_user_item", "user_id", "item_id"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -0,0 +1,195 @@
+# app/services/audit_log.py — Gravação em lote e retenção do audit_log
+# record() só enfileira em memória (não abre sessão na requisição que falhou); uma thread grava
+# os eventos em lotes de até AUDIT_BATCH_SIZE, no máximo AUDIT_FLUSH_INTERVAL segundos depois.
+# purge_expired() (agendado no startup) apaga, por event_type e em lotes, o que passou da retenção;
+# as exclusões seguem o índice (event_type, created_at) e não varrem a tabela.
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, insert, select
+
+from app.database import SessionLocal
+from app.models import AuditLog
+
+logger = logging.getLogger("ml-intelligence")
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2"))  # segundos
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))  # cheia: descarta (e conta) em vez de travar a requisição
+# Retenção em dias por event_type, só para os tipos configurados: AUDIT_RETENTION_BY_EVENT="ia_insights_fail:30,ia_perguntas_fail:30".
+# AUDIT_RETENTION_DAYS vale para os demais tipos e por padrão é 0 (manter para sempre); billing* nunca
+# usa esse padrão — a trilha de cobrança só expira se o tipo estiver listado explicitamente.
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+AUDIT_PURGE_BATCH = int(os.getenv("AUDIT_PURGE_BATCH", "5000"))
+AUDIT_PURGE_INTERVAL_HOURS = float(os.getenv("AUDIT_PURGE_INTERVAL_HOURS", "6"))
+
+
+def _parse_retention(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in raw.split(","):
+        name, sep, days = part.partition(":")
+        if sep and name.strip() and days.strip().isdigit():
+            out[name.strip()] = int(days)
+    return out
+
+
+AUDIT_RETENTION_BY_EVENT = _parse_retention(os.getenv("AUDIT_RETENTION_BY_EVENT", ""))
+
+_STOP = object()
+_queue: "queue.Queue[Any]" = queue.Queue(maxsize=AUDIT_QUEUE_MAX)
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "write_failures": 0, "purged": 0}
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _ensure_writer() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_writer_loop, name="audit-log-writer", daemon=True)
+            _thread.start()
+
+
+def record(user_id: Optional[int], event_type: str, message: str, extra: Optional[str] = None) -> None:
+    """Enfileira um evento de auditoria; não bloqueia nem levanta exceção."""
+    row = {
+        "user_id": user_id,
+        "event_type": event_type[:64],
+        "message": (message or "")[:512],
+        "extra": (extra or "")[:1024],
+        "created_at": datetime.utcnow(),
+    }
+    _ensure_writer()
+    try:
+        _queue.put_nowait(row)
+        _count("enqueued")
+    except queue.Full:
+        _count("dropped")
+        logger.warning("audit_log: fila cheia, evento descartado (%s)", event_type)
+
+
+def _write(batch: List[Dict[str, Any]]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(insert(AuditLog), batch)
+        db.commit()
+        _count("written", len(batch))
+        _count("batches")
+    except Exception as e:
+        db.rollback()
+        _count("write_failures")
+        logger.warning("audit_log: falha ao gravar lote de %d evento(s): %s", len(batch), e)
+    finally:
+        db.close()
+
+
+def _writer_loop() -> None:
+    while True:
+        item = _queue.get()
+        if item is _STOP:
+            return
+        batch = [item]
+        stop = False
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        _write(batch)
+        if stop:
+            return
+
+
+def flush(timeout: float = 5.0) -> None:
+    """Grava o que está na fila e encerra a thread (shutdown). Um record() posterior a reinicia."""
+    thread = _thread
+    if thread is None or not thread.is_alive():
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    thread.join(timeout)
+
+
+def retention_days(event_type: str) -> int:
+    """Dias de retenção do tipo (0 = manter). billing* só expira se estiver em AUDIT_RETENTION_BY_EVENT."""
+    if event_type in AUDIT_RETENTION_BY_EVENT:
+        return AUDIT_RETENTION_BY_EVENT[event_type]
+    return 0 if event_type.startswith("billing") else AUDIT_RETENTION_DAYS
+
+
+def purge_expired(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Apaga eventos além da retenção do seu event_type, em lotes de AUDIT_PURGE_BATCH (commit por lote).
+
+    Retorna {event_type: linhas apagadas}.
+    """
+    now = now or datetime.utcnow()
+    purged: Dict[str, int] = {}
+    if AUDIT_RETENTION_DAYS <= 0 and not any(days > 0 for days in AUDIT_RETENTION_BY_EVENT.values()):
+        return purged  # nada configurado para expirar
+    db = SessionLocal()
+    try:
+        if AUDIT_RETENTION_DAYS > 0:
+            event_types = [r[0] for r in db.execute(select(AuditLog.event_type).distinct())]
+        else:
+            event_types = list(AUDIT_RETENTION_BY_EVENT)
+        for event_type in event_types:
+            days = retention_days(event_type)
+            if days <= 0:
+                continue
+            cutoff = now - timedelta(days=days)
+            total = 0
+            while True:
+                ids = db.execute(
+                    select(AuditLog.id).where(AuditLog.event_type == event_type, AuditLog.created_at < cutoff).limit(AUDIT_PURGE_BATCH)
+                ).scalars().all()
+                if not ids:
+                    break
+                db.execute(delete(AuditLog).where(AuditLog.id.in_(ids)))
+                db.commit()  # lotes curtos: não segura o lock de escrita (SQLite) durante a limpeza toda
+                total += len(ids)
+                if len(ids) < AUDIT_PURGE_BATCH:
+                    break
+            if total:
+                purged[event_type] = total
+        if purged:
+            _count("purged", sum(purged.values()))
+            logger.info("audit_log: retenção apagou %s", purged)
+        return purged
+    except Exception as e:
+        db.rollback()
+        logger.exception("audit_log: falha na retenção: %s", e)
+        return purged
+    finally:
+        db.close()
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    stats["queued"] = _queue.qsize()
+    stats["retention_days"] = AUDIT_RETENTION_DAYS
+    stats["retention_by_event"] = dict(AUDIT_RETENTION_BY_EVENT)
+    return stats
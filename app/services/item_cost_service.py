@@ -0,0 +1,95 @@
+# app/services/item_cost_service.py — Gravação em lote dos custos por anúncio (ItemCost)
+# Upsert em lote com INSERT ... ON CONFLICT (user_id, item_id) DO UPDATE (PostgreSQL e SQLite):
+# poucas instruções por lote em vez de um SELECT + UPDATE por anúncio.
+import os
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import ItemCost
+
+# Campos que o vendedor pode enviar; None = "não alterar"
+COST_FIELDS = ("sku", "custo_produto", "embalagem", "frete", "taxa_pct", "imposto_pct")
+ITEM_COSTS_UPSERT_CHUNK = int(os.getenv("ITEM_COSTS_UPSERT_CHUNK", "500"))  # linhas por instrução
+# Acima disso, commit a cada lote: transações curtas (no SQLite não segura o lock de escrita o upload todo)
+ITEM_COSTS_COMMIT_EVERY_ROWS = int(os.getenv("ITEM_COSTS_COMMIT_EVERY_ROWS", "5000"))
+
+
+def _merge_updates(updates: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Um registro por item_id (o mesmo item repetido no payload: vale o último valor de cada campo)."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for upd in updates:
+        item_id = (upd.get("item_id") or "").strip()
+        if not item_id:
+            continue
+        fields = {k: upd[k] for k in COST_FIELDS if upd.get(k) is not None}
+        merged.setdefault(item_id, {}).update(fields)
+    return merged
+
+
+def _insert_for(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _existing_ids(db: Session, user_id: int, item_ids: List[str]) -> set:
+    rows = db.execute(select(ItemCost.item_id).where(ItemCost.user_id == user_id, ItemCost.item_id.in_(item_ids)))
+    return {r[0] for r in rows}
+
+
+def _upsert_chunk(db: Session, user_id: int, chunk: Dict[str, Dict[str, Any]], insert) -> None:
+    # Linhas com o mesmo conjunto de campos vão na mesma instrução (o SET do ON CONFLICT muda por conjunto)
+    groups: Dict[FrozenSet[str], List[Dict[str, Any]]] = {}
+    for item_id, fields in chunk.items():
+        groups.setdefault(frozenset(fields), []).append({"user_id": user_id, "item_id": item_id, **fields})
+    now = datetime.utcnow()
+    for keys, rows in groups.items():
+        stmt = insert(ItemCost).values(rows)
+        set_ = {k: stmt.excluded[k] for k in keys}
+        set_["updated_at"] = now
+        db.execute(stmt.on_conflict_do_update(index_elements=["user_id", "item_id"], set_=set_))
+
+
+def _upsert_orm(db: Session, user_id: int, chunk: Dict[str, Dict[str, Any]]) -> None:
+    """Fallback para bancos sem ON CONFLICT: um registro por vez via ORM."""
+    existing = {c.item_id: c for c in db.query(ItemCost).filter(ItemCost.user_id == user_id, ItemCost.item_id.in_(list(chunk))).all()}
+    for item_id, fields in chunk.items():
+        c = existing.get(item_id)
+        if c is None:
+            c = ItemCost(user_id=user_id, item_id=item_id)
+            db.add(c)
+        for k, v in fields.items():
+            setattr(c, k, v)
+
+
+def bulk_upsert_costs(db: Session, user_id: int, updates: Iterable[Dict[str, Any]], chunk_size: int = ITEM_COSTS_UPSERT_CHUNK) -> Dict[str, int]:
+    """Insere/atualiza custos do usuário em lote e faz commit. Só os campos enviados (não None) são alterados.
+
+    Retorna {"saved", "inserted", "updated", "chunks"}. Payloads acima de ITEM_COSTS_COMMIT_EVERY_ROWS
+    são gravados com commit por lote (um erro no meio deixa os lotes anteriores gravados).
+    """
+    merged = _merge_updates(updates)
+    item_ids = list(merged)
+    dialect = db.get_bind().dialect.name
+    insert = _insert_for(dialect) if dialect in ("postgresql", "sqlite") else None
+    commit_each = len(item_ids) > ITEM_COSTS_COMMIT_EVERY_ROWS
+    chunk_size = max(1, chunk_size)
+    inserted = chunks = 0
+    for start in range(0, len(item_ids), chunk_size):
+        ids = item_ids[start:start + chunk_size]
+        chunk = {i: merged[i] for i in ids}
+        inserted += len(ids) - len(_existing_ids(db, user_id, ids))
+        if insert is not None:
+            _upsert_chunk(db, user_id, chunk, insert)
+        else:
+            _upsert_orm(db, user_id, chunk)
+        chunks += 1
+        if commit_each:
+            db.commit()
+    db.commit()
+    return {"saved": len(item_ids), "inserted": inserted, "updated": len(item_ids) - inserted, "chunks": chunks}
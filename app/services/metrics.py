@@ -0,0 +1,39 @@
+# app/services/metrics.py — Janelas de latência e percentis em memória
+# Usado pelas métricas de admin (hedging do ML, espera no pool do banco, ciclos do polling de perguntas).
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Sequence
+
+
+def percentile(samples: Sequence[float], pct: float) -> Optional[float]:
+    """Percentil por nearest-rank (samples em qualquer ordem)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+class LatencyWindow:
+    """Janela deslizante das últimas latências (segundos), thread-safe."""
+
+    def __init__(self, size: int = 500):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return list(self._samples)
+
+    def summary(self) -> Dict[str, Any]:
+        samples = self.snapshot()
+
+        def _ms(pct: float) -> Optional[float]:
+            value = percentile(samples, pct)
+            return round(value * 1000, 1) if value is not None else None
+
+        return {"samples": len(samples), "p50_ms": _ms(50), "p95_ms": _ms(95), "p99_ms": _ms(99)}
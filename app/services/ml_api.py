@@ -1,16 +1,254 @@
+import contextvars
+import copy
+import hashlib
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Sequence, TypeVar
 
 import requests
 
+from app.services import ml_deadline, ml_http
+from app.services.ml_cache import TTLCache
+from app.services.ml_circuit import CircuitRegistry, family_for_path
+from app.services.ml_hedge import Hedger
+from app.services.ml_ratelimit import (
+    ML_RATE_MAX_WAIT,
+    ML_RETRY_MAX,
+    ML_RETRY_MAX_DELAY,
+    RateLimiter,
+    RateLimitExceeded,
+    backoff_delay,
+    parse_retry_after,
+)
+from app.services.ml_singleflight import SingleFlight, WaitTimeout
+
 _log = logging.getLogger("ml-intelligence")
 
 ML_APP_ID = os.getenv("ML_APP_ID")
 ML_SECRET = os.getenv("ML_SECRET")
 ML_REDIRECT_URI = os.getenv("ML_REDIRECT_URI")
-ML_API = "https://api.mercadolibre.com"
+# Base da API; aponte para um servidor local (bench/fake_ml.py) em benchmarks e testes offline
+ML_API = os.getenv("ML_API", "https://api.mercadolibre.com").rstrip("/")
+# Máximo de chamadas simultâneas ao ML num fan-out (ex.: status="all")
+ML_FANOUT_WORKERS = int(os.getenv("ML_FANOUT_WORKERS", "6"))
+
+# Paginação de /users/{id}/items/search: o ML não aceita offset além de ~1000;
+# acima disso é preciso usar search_type=scan (cursor scroll_id, páginas de até 100).
+ML_ITEMS_PAGE_SIZE = 50
+ML_ITEMS_OFFSET_CAP = 1000
+ML_ITEMS_SCAN_PAGE_SIZE = 100
+# Novas tentativas (sequenciais) de uma página da listagem que falhou; esgotadas, o resultado é marcado parcial
+ML_ITEMS_PAGE_RETRIES = int(os.getenv("ML_ITEMS_PAGE_RETRIES", "2"))
+ML_ITEM_STATUSES = ("active", "paused", "closed", "under_review", "pending")
+ML_MULTIGET_MAX_IDS = 20  # limite do ML por GET /items?ids=
+
+_RATE_LIMITER = RateLimiter()
+_RETRY_STATUSES = (429, 503)
+_CIRCUITS = CircuitRegistry()
+# Coalescência de GETs idênticos em andamento (ex.: várias telas do dashboard abrindo juntas)
+ML_COALESCE_GETS = os.getenv("ML_COALESCE_GETS", "1").strip().lower() in ("1", "true", "yes")
+_SINGLE_FLIGHT = SingleFlight("ml_get")
+# GETs duplicados no p95 da família (opt-in: ML_HEDGE_ENABLED=1, famílias em ML_HEDGE_FAMILIES)
+_HEDGER = Hedger()
+
+# Cache de GET /items/{id} (get_item_by_id / get_item_details): LRU + TTL, revalida com ETag
+_ITEM_CACHE = TTLCache(
+    "items",
+    max_size=int(os.getenv("ML_ITEM_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("ML_ITEM_CACHE_TTL", "120")),
+)
+# Cache de /sites/{site}/search (search_public_cached): serve stale e atualiza em background
+_SEARCH_CACHE = TTLCache(
+    "search",
+    max_size=int(os.getenv("ML_SEARCH_CACHE_SIZE", "500")),
+    ttl=float(os.getenv("ML_SEARCH_CACHE_TTL", "60")),
+    stale_ttl=float(os.getenv("ML_SEARCH_CACHE_STALE_TTL", "600")),
+)
+# Consultas cuja busca anônima deu 403 (a próxima vai direto com token)
+_SEARCH_ANON_FORBIDDEN = TTLCache("search_anon_403", max_size=2000, ttl=float(os.getenv("ML_SEARCH_ANON_403_TTL", "3600")), stale_ttl=0)
+_SEARCH_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ml-search-refresh")
+_search_refreshing: set = set()
+_search_refreshing_lock = threading.Lock()
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _request(method: str, path: str, access_token: Optional[str] = None, **kwargs: Any) -> requests.Response:
+    """Chamada à API do ML pelo transporte compartilhado (pool keep-alive, User-Agent padrão).
+
+    Passa pelo rate limit local (bucket global + por token). Um 429 bloqueia o bucket
+    pelo Retry-After; GETs (idempotentes) com 429/503 são repetidos com backoff + jitter.
+    Cada família de endpoints tem um circuit breaker: erros de conexão/timeout e 5xx
+    seguidos abrem o circuito e as chamadas seguintes falham na hora (CircuitOpenError).
+    GETs idênticos simultâneos compartilham a mesma resposta (single-flight); quem espera respeita
+    o próprio prazo e, se o líder falhou pelo prazo dele, refaz a chamada por conta própria.
+    Dentro de um escopo ml_deadline.deadline() o timeout encolhe para o tempo restante e,
+    esgotado o prazo, a chamada levanta DeadlineExceeded (antes de ir à rede ou no timeout encurtado).
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    token_key = _token_key(access_token)
+    if method.upper() == "GET" and ML_COALESCE_GETS:
+        # GETs idênticos em andamento (mesmo path, params, headers e token) viram uma só chamada
+        key = (path, _freeze(kwargs.get("params")), _freeze(headers), token_key)
+        try:
+            resp, _ = _SINGLE_FLIGHT.do(
+                key,
+                lambda: _send(method, path, access_token, token_key, headers, **kwargs),
+                wait_timeout=ml_deadline.remaining(),
+                retry_if=lambda e: isinstance(e, ml_deadline.DeadlineExceeded),
+            )
+        except WaitTimeout:
+            # nosso prazo acabou esperando o líder: _send levanta DeadlineExceeded e marca o escopo
+            return _send(method, path, access_token, token_key, headers, **kwargs)
+        return resp
+    return _send(method, path, access_token, token_key, headers, **kwargs)
+
+
+def _send(
+    method: str,
+    path: str,
+    access_token: Optional[str],
+    token_key: Optional[str],
+    headers: Dict[str, str],
+    **kwargs: Any,
+) -> requests.Response:
+    headers = dict(headers)
+    if access_token:
+        headers["Authorization"] = f"Bearer {access_token}"
+    family = family_for_path(path)
+    breaker = _CIRCUITS.get(family)
+    attempt = 0
+    while True:
+        left = ml_deadline.check(f"{method} {path}")
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            _RATE_LIMITER.acquire(token_key, max_wait=None if left is None else min(ML_RATE_MAX_WAIT, left))
+            left = ml_deadline.check(f"{method} {path}")  # a fila local pode ter consumido o prazo
+        except requests.RequestException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        timeout = ml_http.ML_HTTP_TIMEOUT if left is None else min(ml_http.ML_HTTP_TIMEOUT, left)
+        try:
+            resp = _http_call(family, method, path, token_key, headers=headers, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if isinstance(e, requests.Timeout) and timeout < ml_http.ML_HTTP_TIMEOUT:
+                # timeout encurtado pelo prazo da requisição: não é sinal de ML fora do ar
+                if breaker is not None:
+                    breaker.release()
+                ml_deadline.mark_exceeded()
+                raise ml_deadline.DeadlineExceeded(f"Prazo da requisição esgotado durante {method} {path}") from e
+            if breaker is not None:
+                breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        except requests.RequestException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            if resp.status_code >= 500:
+                breaker.record_failure(f"HTTP {resp.status_code}")
+            elif resp.status_code == 429:
+                breaker.release()
+            else:
+                breaker.record_success()
+        if resp.status_code not in _RETRY_STATUSES:
+            return resp
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if resp.status_code == 429:
+            _RATE_LIMITER.penalize(token_key, retry_after if retry_after is not None else backoff_delay(attempt))
+        if method.upper() != "GET" or attempt >= ML_RETRY_MAX or (retry_after or 0) > ML_RETRY_MAX_DELAY:
+            return resp
+        delay = backoff_delay(attempt, retry_after)
+        left = ml_deadline.remaining()
+        if left is not None and delay >= left:
+            return resp
+        _log.info("ML %s %s -> %s; nova tentativa em %.2fs", method, path, resp.status_code, delay)
+        _RATE_LIMITER.record_retry()
+        time.sleep(delay)
+        attempt += 1
+
+
+def _http_call(family: str, method: str, path: str, token_key: Optional[str], **kwargs: Any) -> requests.Response:
+    """Uma requisição ao ML, medindo a latência da família; GETs de famílias com hedging vão pelo Hedger."""
+    url = f"{ML_API}{path}"
+
+    def _call() -> requests.Response:
+        return ml_http.request(method, url, **kwargs)
+
+    if method.upper() == "GET" and _HEDGER.applies(family):
+        return _HEDGER.run(family, _call, can_send_copy=lambda: _try_acquire_now(token_key))
+    started = time.monotonic()
+    try:
+        return _call()
+    finally:
+        _HEDGER.observe(family, time.monotonic() - started)
+
+
+def _try_acquire_now(token_key: Optional[str]) -> bool:
+    """Reserva uma vaga no rate limit só se não houver espera (a cópia de um GET hedged nunca enfileira)."""
+    try:
+        _RATE_LIMITER.acquire(token_key, max_wait=0)
+        return True
+    except RateLimitExceeded:
+        return False
+
+
+def _freeze(value: Any) -> Any:
+    """Versão hashable (e independente de ordem) de params/headers, para a chave do single-flight."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), str(v)) for k, v in value.items()))
+    return tuple((str(k), str(v)) for k, v in value)
+
+
+def _token_key(access_token: Optional[str]) -> Optional[str]:
+    """Identifica o token na chave do cache sem guardar o token em si."""
+    if not access_token:
+        return None
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+def _get_json_cached(cache: TTLCache, path: str, access_token: Optional[str] = None) -> tuple:
+    """GET com cache: (body, None) em hit/200/304; (None, resp) para qualquer outro status.
+
+    Entrada fresca não vai à rede; entrada vencida é revalidada com If-None-Match /
+    If-Modified-Since e um 304 só renova a validade. A chave inclui o token, pois com
+    token o ML pode devolver campos privados do vendedor.
+    """
+    key = (path, _token_key(access_token))
+    entry, fresh = cache.lookup(key)
+    if entry is not None and fresh:
+        return copy.copy(entry.value), None
+    headers = entry.conditional_headers() if entry is not None else {}
+    resp = _request("GET", path, access_token, headers=headers)
+    if resp.status_code == 304 and entry is not None:
+        cache.revalidated(key)
+        return copy.copy(entry.value), None
+    if resp.status_code != 200:
+        return None, resp
+    body = resp.json()
+    cache.set(key, body, etag=resp.headers.get("ETag"), last_modified=resp.headers.get("Last-Modified"))
+    return copy.copy(body), None
+
+
+def _parallel_map(fn: Callable[[T], R], args: Iterable[T], max_workers: Optional[int] = None) -> List[R]:
+    """Aplica fn a cada argumento em paralelo (threads) e devolve na ordem de entrada."""
+    args = list(args)
+    if len(args) <= 1:
+        return [fn(a) for a in args]
+    workers = min(len(args), max_workers or ML_FANOUT_WORKERS)
+    # cada tarefa roda numa cópia do contexto de quem chamou (prazo da requisição, ml_deadline)
+    contexts = [contextvars.copy_context() for _ in args]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda ctx, a: ctx.run(fn, a), contexts, args))
 
 
 def get_auth_url() -> Optional[str]:
@@ -38,7 +276,7 @@ def exchange_code_for_tokens(code: str) -> Optional[dict]:
         "code": code,
         "redirect_uri": ML_REDIRECT_URI,
     }
-    resp = requests.post(f"{ML_API}/oauth/token", data=payload, timeout=15)
+    resp = _request("POST", "/oauth/token", data=payload)
     if resp.status_code != 200:
         return None
     return resp.json()
@@ -54,7 +292,7 @@ def refresh_access_token(refresh_token: str) -> Optional[dict]:
         "client_secret": ML_SECRET,
         "refresh_token": refresh_token,
     }
-    resp = requests.post(f"{ML_API}/oauth/token", data=payload, timeout=15)
+    resp = _request("POST", "/oauth/token", data=payload)
     if resp.status_code != 200:
         return None
     return resp.json()
@@ -62,8 +300,7 @@ def refresh_access_token(refresh_token: str) -> Optional[dict]:
 
 def get_user_info(access_token: str) -> Optional[dict]:
     """Busca informações do usuário autenticado."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{ML_API}/users/me", headers=headers, timeout=15)
+    resp = _request("GET", "/users/me", access_token)
     if resp.status_code != 200:
         return None
     return resp.json()
@@ -80,42 +317,179 @@ def get_user_items(access_token: str, user_id: str, status: str = "active", limi
         offset: Offset para paginação
     """
     if status == "all":
-        # Busca active + paused + closed + under_review + pending (inclui "inativo para revisar")
-        all_results: List[str] = []
-        all_paging = {"total": 0, "offset": 0, "limit": limit}
-        for st in ["active", "paused", "closed", "under_review", "pending"]:
-            r = get_user_items(access_token, user_id, status=st, limit=50, offset=0)
-            if r and r.get("results"):
-                all_results.extend(r["results"])
-                p = r.get("paging", {})
-                all_paging["total"] = all_paging.get("total", 0) + p.get("total", 0)
+        # Busca active + paused + closed + under_review + pending (inclui "inativo para revisar"),
+        # percorrendo todas as páginas de cada status (ver get_all_user_item_ids).
+        all_results = get_all_user_item_ids(access_token, user_id)
         return {"results": all_results, "paging": {"total": len(all_results), "offset": 0, "limit": limit}}
     
-    headers = {"Authorization": f"Bearer {access_token}"}
     params = {
         "status": status,
         "limit": min(limit, 50),
         "offset": offset,
     }
-    resp = requests.get(f"{ML_API}/users/{user_id}/items/search", headers=headers, params=params, timeout=15)
+    resp = _request("GET", f"/users/{user_id}/items/search", access_token, params=params)
     if resp.status_code != 200:
         return None
     return resp.json()
 
 
-def get_item_details(access_token: str, item_id: str) -> Optional[dict]:
-    """Busca detalhes de um anúncio específico."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{ML_API}/items/{item_id}", headers=headers, timeout=15)
+def _scan_user_items_page(access_token: str, user_id: str, status: str, scroll_id: Optional[str] = None) -> Optional[dict]:
+    """Uma página do modo scan (search_type=scan). Sem scroll_id inicia o cursor."""
+    params = {"status": status, "search_type": "scan", "limit": ML_ITEMS_SCAN_PAGE_SIZE}
+    if scroll_id:
+        params["scroll_id"] = scroll_id
+    resp = _request("GET", f"/users/{user_id}/items/search", access_token, params=params)
     if resp.status_code != 200:
+        _log.warning("ML items scan failed: user=%s status=%s http=%s", user_id, status, resp.status_code)
         return None
     return resp.json()
 
 
+def iter_user_item_ids(
+    access_token: str,
+    user_id: str,
+    status: str = "active",
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Iterator[str]:
+    """Gera todos os IDs de anúncios de um status, página a página (streaming).
+
+    Até ML_ITEMS_OFFSET_CAP resultados usa offset, buscando as páginas restantes em
+    paralelo (em blocos de ML_FANOUT_WORKERS, preservando a ordem). Acima disso troca
+    para o modo scan do ML (cursor scroll_id), que é sequencial mas não tem limite.
+    on_progress(buscados, total) é chamado após cada página. Se o prazo da requisição
+    (ml_deadline) acabar no meio, para de buscar e fica com o que já foi emitido.
+    Página que falha é tentada de novo (ML_ITEMS_PAGE_RETRIES); se continuar falhando, a
+    listagem segue sem ela e o escopo é marcado como parcial (X-Partial-Result).
+    """
+    try:
+        yield from _iter_user_item_ids(access_token, user_id, status, on_progress)
+    except ml_deadline.DeadlineExceeded:
+        _log.warning("ML items listing cut by deadline: user=%s status=%s", user_id, status)
+    except requests.Timeout:
+        if not ml_deadline.exceeded():
+            raise
+        _log.warning("ML items listing cut by deadline: user=%s status=%s", user_id, status)
+
+
+def _retry_items_page(fetch: Callable[[], Optional[dict]], what: str) -> Optional[dict]:
+    """Tenta de novo uma página da listagem que falhou. Sem sucesso, marca o resultado como parcial."""
+    for attempt in range(ML_ITEMS_PAGE_RETRIES):
+        delay = backoff_delay(attempt)
+        left = ml_deadline.remaining()
+        if left is not None and delay >= left:
+            break
+        time.sleep(delay)
+        page = fetch()
+        if page is not None:
+            return page
+    _log.warning("ML items page failed, listing is partial: %s", what)
+    ml_deadline.mark_exceeded()
+    return None
+
+
+def _iter_user_item_ids(
+    access_token: str,
+    user_id: str,
+    status: str,
+    on_progress: Optional[Callable[[int, int], None]],
+) -> Iterator[str]:
+    def _offset_page(off: int) -> Optional[dict]:
+        return get_user_items(access_token, user_id, status=status, limit=ML_ITEMS_PAGE_SIZE, offset=off)
+
+    first = _offset_page(0)
+    if first is None:
+        first = _retry_items_page(lambda: _offset_page(0), f"user={user_id} status={status} offset=0")
+    if not first:
+        return
+    total = int((first.get("paging") or {}).get("total") or 0)
+    seen = set()
+
+    def _emit(ids: Sequence[str]) -> Iterator[str]:
+        for item_id in ids or []:
+            if item_id not in seen:
+                seen.add(item_id)
+                yield item_id
+        if on_progress:
+            on_progress(len(seen), total)
+
+    yield from _emit(first.get("results") or [])
+    if len(seen) >= total:
+        return
+
+    if total <= ML_ITEMS_OFFSET_CAP:
+        offsets = list(range(ML_ITEMS_PAGE_SIZE, total, ML_ITEMS_PAGE_SIZE))
+        for i in range(0, len(offsets), ML_FANOUT_WORKERS):
+            batch = offsets[i:i + ML_FANOUT_WORKERS]
+            pages = _parallel_map(_offset_page, batch)
+            for off, page in zip(batch, pages):
+                if page is None:
+                    page = _retry_items_page(lambda: _offset_page(off), f"user={user_id} status={status} offset={off}")
+                    if page is None:
+                        continue
+                yield from _emit(page.get("results") or [])
+        return
+
+    # Catálogo grande: recomeça em modo scan (IDs já emitidos são ignorados)
+    scroll_id = None
+    while True:
+        page = _scan_user_items_page(access_token, user_id, status, scroll_id)
+        if page is None:
+            # Sem a página não há o scroll_id seguinte: o resto do catálogo fica de fora
+            page = _retry_items_page(
+                lambda: _scan_user_items_page(access_token, user_id, status, scroll_id),
+                f"user={user_id} status={status} scan",
+            )
+        if not page:
+            break
+        results = page.get("results") or []
+        if not results:
+            break
+        yield from _emit(results)
+        scroll_id = page.get("scroll_id")
+        if not scroll_id or len(seen) >= total:
+            break
+
+
+def get_all_user_item_ids(
+    access_token: str,
+    user_id: str,
+    statuses: Sequence[str] = ML_ITEM_STATUSES,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> List[str]:
+    """Todos os IDs de anúncios dos status informados (status em paralelo, ordem de statuses).
+
+    on_progress(buscados, total) recebe o agregado de todos os status.
+    """
+    lock = threading.Lock()
+    progress: Dict[str, tuple] = {}
+
+    def _run(st: str) -> List[str]:
+        def _report(fetched: int, total: int) -> None:
+            if not on_progress:
+                return
+            with lock:
+                progress[st] = (fetched, total)
+                done = sum(p[0] for p in progress.values())
+                expected = sum(p[1] for p in progress.values())
+                on_progress(done, expected)
+
+        return list(iter_user_item_ids(access_token, user_id, status=st, on_progress=_report))
+
+    all_ids: List[str] = []
+    for ids in _parallel_map(_run, statuses):
+        all_ids.extend(ids)
+    return all_ids
+
+
+def get_item_details(access_token: str, item_id: str) -> Optional[dict]:
+    """Busca detalhes de um anúncio específico (com cache, ver _get_json_cached)."""
+    body, _ = _get_json_cached(_ITEM_CACHE, f"/items/{item_id}", access_token)
+    return body
+
+
 def get_item_description(access_token: str, item_id: str) -> Optional[str]:
     """Busca a descrição de um anúncio."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{ML_API}/items/{item_id}/description", headers=headers, timeout=15)
+    resp = _request("GET", f"/items/{item_id}/description", access_token)
     if resp.status_code != 200:
         return None
     data = resp.json()
@@ -132,7 +506,6 @@ def get_orders(access_token: str, seller_id: str, status: Optional[str] = None,
         limit: Quantidade de resultados por página
         offset: Offset para paginação
     """
-    headers = {"Authorization": f"Bearer {access_token}"}
     params = {
         "seller": seller_id,
         "limit": limit,
@@ -141,7 +514,7 @@ def get_orders(access_token: str, seller_id: str, status: Optional[str] = None,
     if status:
         params["order.status"] = status
     
-    resp = requests.get(f"{ML_API}/orders/search", headers=headers, params=params, timeout=15)
+    resp = _request("GET", "/orders/search", access_token, params=params)
     if resp.status_code != 200:
         return None
     return resp.json()
@@ -149,8 +522,7 @@ def get_orders(access_token: str, seller_id: str, status: Optional[str] = None,
 
 def get_order_details(access_token: str, order_id: str) -> Optional[dict]:
     """Busca detalhes de um pedido específico."""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(f"{ML_API}/orders/{order_id}", headers=headers, timeout=15)
+    resp = _request("GET", f"/orders/{order_id}", access_token)
     if resp.status_code != 200:
         return None
     return resp.json()
@@ -178,12 +550,8 @@ def search_public(
     }
     if sort:
         params["sort"] = sort
-    headers = {}
-    if access_token:
-        headers["Authorization"] = f"Bearer {access_token}"
-    headers["User-Agent"] = "MLIntelligence/1.0 (https://mercadoinsights.online)"
     try:
-        resp = requests.get(f"{ML_API}/sites/{site_id}/search", params=params, headers=headers, timeout=15)
+        resp = _request("GET", f"/sites/{site_id}/search", access_token, params=params)
         if resp.status_code != 200:
             # Tenta extrair mensagem de erro do ML
             error_detail = "Erro desconhecido"
@@ -213,31 +581,165 @@ def search_public(
         }
 
 
-def get_multiple_items(access_token: str, item_ids: List[str]) -> Optional[List[dict]]:
-    """Busca múltiplos itens de uma vez (máx 20 por requisição).
+def _normalize_query(q: str) -> str:
+    return " ".join((q or "").lower().split())[:100]
+
+
+def _search_key(site_id: str, q: str, sort: Optional[str], offset: int, limit: int) -> tuple:
+    return (site_id, _normalize_query(q), sort or "", offset, min(limit, 50))
+
+
+def _search_fetch(
+    site_id: str,
+    q: str,
+    limit: int,
+    offset: int,
+    sort: Optional[str],
+    token_getter: Optional[Callable[[], Optional[str]]],
+) -> Optional[dict]:
+    """Busca anônima e, se falhar, com token. Pula a anônima quando a consulta já deu 403 sem token."""
+    query_key = (site_id, _normalize_query(q))
+    result = None
+    if _SEARCH_ANON_FORBIDDEN.get(query_key) is None:
+        result = search_public(site_id=site_id, q=q, limit=limit, offset=offset, sort=sort, access_token=None)
+        if not (result and result.get("error")):
+            return result
+        if result.get("status_code") == 403:
+            _SEARCH_ANON_FORBIDDEN.set(query_key, True)
+    access_token = token_getter() if token_getter else None
+    if not access_token:
+        return result
+    return search_public(site_id=site_id, q=q, limit=limit, offset=offset, sort=sort, access_token=access_token)
+
+
+def _search_refresh(key: tuple, args: tuple) -> None:
+    try:
+        result = _search_fetch(*args)
+        if result and not result.get("error"):
+            _SEARCH_CACHE.set(key, result)
+    except Exception as e:
+        _log.warning("ML search refresh error: %s", e)
+    finally:
+        with _search_refreshing_lock:
+            _search_refreshing.discard(key)
+
+
+def search_public_cached(
+    site_id: str = "MLB",
+    q: str = "",
+    limit: int = 50,
+    offset: int = 0,
+    sort: Optional[str] = None,
+    access_token: Optional[str] = None,
+    token_getter: Optional[Callable[[], Optional[str]]] = None,
+) -> Optional[dict]:
+    """search_public com cache stale-while-revalidate e fallback anônimo -> token.
+
+    Chave: (site, q normalizado, sort, offset, limit). Entrada fresca volta na hora; entrada
+    vencida (até ML_SEARCH_CACHE_STALE_TTL) também volta na hora e dispara uma atualização em
+    background. Em miss busca sem token e, se der erro, com o token (access_token ou
+    token_getter(), chamado só se preciso). Mesmo retorno de search_public; erros não vão ao cache.
+    """
+    if not q or not q.strip():
+        return None
+    if token_getter is None and access_token:
+        token_getter = lambda: access_token
+    key = _search_key(site_id, q, sort, offset, limit)
+    args = (site_id, q, limit, offset, sort, token_getter)
+    entry, fresh = _SEARCH_CACHE.lookup(key)
+    if entry is not None:
+        if not fresh:
+            with _search_refreshing_lock:
+                start = key not in _search_refreshing
+                _search_refreshing.add(key)
+            if start:
+                _SEARCH_REFRESH_EXECUTOR.submit(_search_refresh, key, args)
+        return copy.copy(entry.value)
+    result = _search_fetch(*args)
+    if result and not result.get("error"):
+        _SEARCH_CACHE.set(key, result)
+        return copy.copy(result)
+    return result
+
+
+def _fetch_items_chunk(access_token: str, ids: List[str], attributes: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """Um GET /items?ids=... (até ML_MULTIGET_MAX_IDS). Retorna {"bodies": {id: body}, "failures": [...], "ok": bool}."""
+    params = {"ids": ",".join(ids)}
+    if attributes:
+        params["attributes"] = ",".join(attributes)
+    try:
+        resp = _request("GET", "/items", access_token, params=params)
+    except requests.RequestException as e:
+        _log.warning("ML multiget error (%d ids): %s", len(ids), e)
+        return {"bodies": {}, "ok": False, "failures": [{"id": i, "code": 0, "message": str(e)} for i in ids]}
+    if resp.status_code != 200:
+        _log.warning("ML multiget failed (%d ids): status=%s", len(ids), resp.status_code)
+        return {"bodies": {}, "ok": False, "failures": [{"id": i, "code": resp.status_code, "message": resp.text[:200]} for i in ids]}
+    raw = resp.json()
+    bodies: Dict[str, dict] = {}
+    failures: List[dict] = []
+    # O ML responde na ordem pedida; o body de erro nem sempre traz o id
+    for pos, obj in enumerate(raw if isinstance(raw, list) else []):
+        if not isinstance(obj, dict):
+            continue
+        requested = ids[pos] if pos < len(ids) else None
+        body = obj.get("body") if isinstance(obj.get("body"), dict) else {}
+        if obj.get("code") == 200 and body:
+            bodies[str(body.get("id") or requested)] = body
+        else:
+            failures.append({
+                "id": body.get("id") or requested,
+                "code": obj.get("code"),
+                "message": body.get("message") or body.get("error"),
+            })
+    failed_ids = {f["id"] for f in failures}
+    missing = [i for i in ids if i not in bodies and i not in failed_ids]
+    failures.extend({"id": i, "code": None, "message": "ausente na resposta"} for i in missing)
+    return {"bodies": bodies, "ok": True, "failures": failures}
+
+
+def get_items_batch(access_token: str, item_ids: List[str], attributes: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Busca qualquer quantidade de itens via multi-get, em blocos de 20 buscados em paralelo.
+
+    attributes: projeção de campos (ex.: ["id", "title", "price"]); reduz bytes e parsing.
+    Retorna {"items": [...na ordem de entrada, sem duplicados...], "failures": [{"id", "code", "message"}],
+    "chunks": n, "chunks_failed": n}.
+    """
+    ids = list(dict.fromkeys(str(i) for i in item_ids or [] if i))
+    if not ids:
+        return {"items": [], "failures": [], "chunks": 0, "chunks_failed": 0}
+    if attributes and "id" not in attributes:
+        attributes = ["id", *attributes]
+    chunks = [ids[i:i + ML_MULTIGET_MAX_IDS] for i in range(0, len(ids), ML_MULTIGET_MAX_IDS)]
+    results = _parallel_map(lambda chunk: _fetch_items_chunk(access_token, chunk, attributes), chunks)
+    bodies: Dict[str, dict] = {}
+    failures: List[dict] = []
+    for r in results:
+        bodies.update(r["bodies"])
+        failures.extend(r["failures"])
+    return {
+        "items": [bodies[i] for i in ids if i in bodies],
+        "failures": failures,
+        "chunks": len(chunks),
+        "chunks_failed": sum(1 for r in results if not r["ok"]),
+    }
+
+
+def get_multiple_items(access_token: str, item_ids: List[str], attributes: Optional[Sequence[str]] = None) -> Optional[List[dict]]:
+    """Busca múltiplos itens (sem limite de quantidade; ver get_items_batch).
     
     A API do ML retorna [{code: 200, body: {...}}, ...]. Esta função
-    extrai o body de cada resposta e retorna lista de itens.
+    extrai o body de cada resposta e retorna lista de itens na ordem de item_ids.
+    Retorna None se todas as requisições falharem.
     """
     if not item_ids:
         return []
-    
-    headers = {"Authorization": f"Bearer {access_token}"}
-    ids_str = ",".join(item_ids[:20])  # ML limita a 20 por vez
-    resp = requests.get(f"{ML_API}/items", headers=headers, params={"ids": ids_str}, timeout=15)
-    if resp.status_code != 200:
+    batch = get_items_batch(access_token, item_ids, attributes=attributes)
+    if batch["chunks"] and batch["chunks_failed"] == batch["chunks"]:
         return None
-    
-    raw = resp.json()
-    if not isinstance(raw, list):
-        return []
-    
-    items = []
-    for obj in raw:
-        if isinstance(obj, dict) and obj.get("code") == 200 and "body" in obj:
-            items.append(obj["body"])
-    
-    return items
+    if batch["failures"]:
+        _log.info("ML multiget: %d de %d itens falharam", len(batch["failures"]), len(item_ids))
+    return batch["items"]
 
 
 # ------------------------------------------------------------------
@@ -256,7 +758,6 @@ def get_questions_search(
     """
     if not access_token or (not seller_id and not item_id):
         return None
-    headers = {"Authorization": f"Bearer {access_token}"}
     params = {"api_version": "4", "limit": min(limit, 50), "offset": offset}
     if seller_id:
         params["seller_id"] = seller_id
@@ -265,7 +766,7 @@ def get_questions_search(
     if status:
         params["status"] = status
     try:
-        resp = requests.get(f"{ML_API}/questions/search", headers=headers, params=params, timeout=15)
+        resp = _request("GET", "/questions/search", access_token, params=params)
         if resp.status_code != 200:
             _log.warning("ML questions search failed: status=%s body=%s", resp.status_code, resp.text[:200])
             return None
@@ -279,9 +780,8 @@ def get_question_detail(access_token: str, question_id: str) -> Optional[dict]:
     """Detalhe de uma pergunta (inclui dados do comprador quando aplicável)."""
     if not access_token or not question_id:
         return None
-    headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        resp = requests.get(f"{ML_API}/questions/{question_id}", headers=headers, timeout=15)
+        resp = _request("GET", f"/questions/{question_id}", access_token)
         if resp.status_code != 200:
             return None
         return resp.json()
@@ -294,10 +794,9 @@ def post_answer(access_token: str, question_id: str, text: str) -> Optional[dict
     """Publica resposta a uma pergunta. POST /answers."""
     if not access_token or not question_id or not (text or "").strip():
         return None
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     payload = {"question_id": question_id, "text": (text or "").strip()}
     try:
-        resp = requests.post(f"{ML_API}/answers", headers=headers, json=payload, timeout=15)
+        resp = _request("POST", "/answers", access_token, json=payload)
         if resp.status_code not in (200, 201):
             _log.warning("ML post answer failed: status=%s body=%s", resp.status_code, resp.text[:200])
             return None
@@ -312,18 +811,14 @@ def get_item_by_id(access_token: Optional[str], item_id: str) -> Optional[dict]:
     Retorna dict com 'error' se houver falha, para melhor diagnóstico."""
     if not item_id:
         return None
-    headers = {"User-Agent": "MLIntelligence/1.0 (https://mercadoinsights.online)"}
-    if access_token:
-        headers["Authorization"] = f"Bearer {access_token}"
     try:
-        resp = requests.get(f"{ML_API}/items/{item_id}", headers=headers, timeout=15)
-        if resp.status_code == 200:
-            return resp.json()
+        body, resp = _get_json_cached(_ITEM_CACHE, f"/items/{item_id}", access_token)
+        if body is not None:
+            return body
         if resp.status_code == 403 and access_token:
-            headers.pop("Authorization", None)
-            resp2 = requests.get(f"{ML_API}/items/{item_id}", headers=headers, timeout=15)
-            if resp2.status_code == 200:
-                return resp2.json()
+            body2, resp2 = _get_json_cached(_ITEM_CACHE, f"/items/{item_id}")
+            if body2 is not None:
+                return body2
             _log.warning("ML get item %s failed (public): status=%s", item_id, resp2.status_code)
             # Retorna dict com informações do erro
             error_detail = "Erro desconhecido"
@@ -363,3 +858,22 @@ def get_item_by_id(access_token: Optional[str], item_id: str) -> Optional[dict]:
             "message": str(e),
             "detail": f"Erro de conexão: {type(e).__name__}"
         }
+
+
+def get_ml_api_stats() -> Dict[str, Any]:
+    """Estatísticas da camada de acesso à API do ML (para o painel admin)."""
+    return {
+        "pool": ml_http.get_pool_stats(),
+        "item_cache": _ITEM_CACHE.stats(),
+        "search_cache": _SEARCH_CACHE.stats(),
+        "search_anon_forbidden": _SEARCH_ANON_FORBIDDEN.stats()["size"],
+        "rate_limit": _RATE_LIMITER.stats(),
+        "circuits": _CIRCUITS.stats(),
+        "coalescing": _SINGLE_FLIGHT.stats(),
+        "hedging": _HEDGER.stats(),
+    }
+
+
+def get_circuit_states() -> Dict[str, str]:
+    """Estado do circuit breaker de cada família de endpoints do ML ({família: estado})."""
+    return _CIRCUITS.summary()
@@ -0,0 +1,85 @@
+# app/services/ml_api_async.py — Versão awaitable de ml_api (mesmas funções) para fan-out concorrente
+# Cada função tem a mesma assinatura/retorno da versão síncrona; a chamada roda numa
+# thread e reaproveita o transporte compartilhado (pool keep-alive de ml_http).
+# ML_ASYNC_CONCURRENCY limita quantas chamadas ao ML rodam ao mesmo tempo por processo.
+import asyncio
+import functools
+import os
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+import requests
+
+from app.services import ml_api, ml_deadline
+
+ML_ASYNC_CONCURRENCY = int(os.getenv("ML_ASYNC_CONCURRENCY", "8"))
+
+T = TypeVar("T")
+
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Semáforo global por event loop (limita chamadas simultâneas ao ML)."""
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(ML_ASYNC_CONCURRENCY)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+def _to_async(fn: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        async with _get_semaphore():
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    return wrapper
+
+
+async def gather_limited(*aws: Awaitable[Any], limit: Optional[int] = None) -> List[Any]:
+    """asyncio.gather com limite de concorrência local (além do limite global do módulo).
+
+    Retorna os resultados na mesma ordem dos awaitables.
+    """
+    if not limit or limit >= len(aws):
+        return list(await asyncio.gather(*aws))
+    sem = asyncio.Semaphore(limit)
+
+    async def _run(aw: Awaitable[Any]) -> Any:
+        async with sem:
+            return await aw
+
+    return list(await asyncio.gather(*(_run(aw) for aw in aws)))
+
+
+async def until_deadline(aw: Awaitable[T]) -> Optional[T]:
+    """Aguarda aw; se a chamada foi abortada pelo prazo da requisição (ml_deadline), retorna None."""
+    try:
+        return await aw
+    except ml_deadline.DeadlineExceeded:
+        return None
+    except requests.Timeout:
+        if not ml_deadline.exceeded():
+            raise
+        return None
+
+
+exchange_code_for_tokens = _to_async(ml_api.exchange_code_for_tokens)
+refresh_access_token = _to_async(ml_api.refresh_access_token)
+get_user_info = _to_async(ml_api.get_user_info)
+get_user_items = _to_async(ml_api.get_user_items)
+get_all_user_item_ids = _to_async(ml_api.get_all_user_item_ids)
+get_item_details = _to_async(ml_api.get_item_details)
+get_item_description = _to_async(ml_api.get_item_description)
+get_orders = _to_async(ml_api.get_orders)
+get_order_details = _to_async(ml_api.get_order_details)
+search_public = _to_async(ml_api.search_public)
+search_public_cached = _to_async(ml_api.search_public_cached)
+get_multiple_items = _to_async(ml_api.get_multiple_items)
+get_items_batch = _to_async(ml_api.get_items_batch)
+get_questions_search = _to_async(ml_api.get_questions_search)
+get_question_detail = _to_async(ml_api.get_question_detail)
+post_answer = _to_async(ml_api.post_answer)
+get_item_by_id = _to_async(ml_api.get_item_by_id)
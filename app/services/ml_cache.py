@@ -0,0 +1,116 @@
+# app/services/ml_cache.py — Cache em memória (LRU + TTL) para respostas da API do ML
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class CacheEntry:
+    """Valor em cache + validadores HTTP (ETag/Last-Modified) para revalidação condicional."""
+
+    __slots__ = ("value", "etag", "last_modified", "stored_at", "expires_at")
+
+    def __init__(self, value: Any, ttl: float, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.monotonic()
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = now
+        self.expires_at = now + ttl
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) < self.expires_at
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Headers If-None-Match / If-Modified-Since para revalidar a entrada."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class TTLCache:
+    """LRU thread-safe com limite de tamanho e TTL por entrada.
+
+    Entradas vencidas não são descartadas na hora: ficam disponíveis como "stale"
+    (até stale_ttl segundos após vencer) para revalidação com ETag ou para servir
+    enquanto uma atualização roda em background.
+    """
+
+    def __init__(self, name: str, max_size: int = 1000, ttl: float = 60, stale_ttl: Optional[float] = None):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.stale_ttl = ttl * 10 if stale_ttl is None else stale_ttl
+        self._data: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "revalidated": 0, "sets": 0}
+
+    def lookup(self, key: Hashable) -> Tuple[Optional[CacheEntry], bool]:
+        """Retorna (entrada, fresca). Entrada None = miss; fresca False = stale (pode revalidar)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None, False
+            if now >= entry.expires_at + self.stale_ttl:
+                del self._data[key]
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None, False
+            self._data.move_to_end(key)
+            if entry.is_fresh(now):
+                self._counters["hits"] += 1
+                return entry, True
+            self._counters["stale_hits"] += 1
+            return entry, False
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Valor fresco ou None."""
+        entry, fresh = self.lookup(key)
+        return entry.value if entry is not None and fresh else None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        entry = CacheEntry(value, self.ttl if ttl is None else ttl, etag=etag, last_modified=last_modified)
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            self._counters["sets"] += 1
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def revalidated(self, key: Hashable, ttl: Optional[float] = None) -> None:
+        """Renova a validade após um 304 Not Modified."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            entry.expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._data.move_to_end(key)
+            self._counters["revalidated"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._data)
+        lookups = counters["hits"] + counters["stale_hits"] + counters["misses"]
+        return {
+            "name": self.name,
+            "size": size,
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+        }
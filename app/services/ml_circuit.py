@@ -0,0 +1,163 @@
+# app/services/ml_circuit.py — Circuit breaker por família de endpoints da API do ML
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+# closed: chamadas normais. open: falha imediata (CircuitOpenError) até ML_CIRCUIT_OPEN_SECONDS.
+# half_open: libera até ML_CIRCUIT_HALF_OPEN_PROBES chamadas de teste; sucesso fecha, falha reabre.
+ML_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("ML_CIRCUIT_FAILURE_THRESHOLD", "5"))  # falhas seguidas para abrir
+ML_CIRCUIT_OPEN_SECONDS = float(os.getenv("ML_CIRCUIT_OPEN_SECONDS", "30"))
+ML_CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("ML_CIRCUIT_HALF_OPEN_PROBES", "1"))
+ML_CIRCUIT_ENABLED = os.getenv("ML_CIRCUIT_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+ML_FAMILIES = ("items", "search", "questions", "orders", "oauth", "users")
+
+
+class CircuitOpenError(requests.RequestException):
+    """O circuito da família está aberto; a chamada nem é enviada ao ML."""
+
+    def __init__(self, family: str, retry_in: float):
+        super().__init__(f"API ML ({family}) indisponível; nova tentativa em {retry_in:.0f}s")
+        self.family = family
+        self.retry_in = retry_in
+
+
+def family_for_path(path: str) -> str:
+    """Família de endpoints de um path da API (ex.: /items/MLB1 -> items)."""
+    parts = [p for p in path.split("?", 1)[0].split("/") if p]
+    if not parts:
+        return "users"
+    head = parts[0]
+    if head == "sites" and "search" in parts:
+        return "search"
+    if head in ("questions", "answers"):
+        return "questions"
+    if head == "users" and "items" in parts:
+        return "items"
+    if head in ("items", "orders", "oauth", "users"):
+        return head
+    return "users"
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe (falhas consecutivas -> aberto -> meio-aberto com probes)."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = ML_CIRCUIT_FAILURE_THRESHOLD,
+        open_seconds: float = ML_CIRCUIT_OPEN_SECONDS,
+        half_open_probes: int = ML_CIRCUIT_HALF_OPEN_PROBES,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0, "last_error": None}
+
+    def before_call(self) -> None:
+        """Libera ou recusa a chamada. Levanta CircuitOpenError se aberto (ou sem vaga de probe)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+            if self._probes_in_flight >= self.half_open_probes:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, 0)
+            self._probes_in_flight += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._stats["successes"] += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self._probes_in_flight = 0
+
+    def release(self) -> None:
+        """Chamada liberada que não conta como sucesso nem falha (ex.: 429): devolve a vaga de probe."""
+        with self._lock:
+            if self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def record_failure(self, error: str) -> None:
+        with self._lock:
+            self._stats["failures"] += 1
+            self._stats["last_error"] = error[:200]
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self._stats["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probes_in_flight = 0
+
+    def current_state(self) -> str:
+        """Estado visto de fora: aberto com prazo vencido aparece como half_open."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.opened_at + self.open_seconds:
+                return HALF_OPEN
+            return self.state
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probes_in_flight = 0
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.current_state()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["consecutive_failures"] = self.consecutive_failures
+            retry_in = self.opened_at + self.open_seconds - time.monotonic() if self.state == OPEN else 0
+        stats["state"] = state
+        stats["retry_in_seconds"] = round(max(0.0, retry_in), 1)
+        return stats
+
+
+class CircuitRegistry:
+    """Um CircuitBreaker por família de endpoints (items, search, questions, orders, oauth, users)."""
+
+    def __init__(self, families=ML_FAMILIES):
+        self._breakers = {f: CircuitBreaker(f) for f in families}
+
+    def get(self, family: str) -> Optional[CircuitBreaker]:
+        if not ML_CIRCUIT_ENABLED:
+            return None
+        return self._breakers.get(family)
+
+    def reset(self) -> None:
+        for breaker in self._breakers.values():
+            breaker.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": ML_CIRCUIT_ENABLED,
+            "failure_threshold": ML_CIRCUIT_FAILURE_THRESHOLD,
+            "open_seconds": ML_CIRCUIT_OPEN_SECONDS,
+            "families": {name: b.stats() for name, b in self._breakers.items()},
+        }
+
+    def summary(self) -> Dict[str, str]:
+        """{família: estado} (para /health)."""
+        return {name: b.current_state() for name, b in self._breakers.items()}
@@ -0,0 +1,90 @@
+# app/services/ml_deadline.py — Prazo (deadline) por requisição para as chamadas à API do ML
+# O endpoint (ou o middleware) abre um escopo com deadline(segundos); ml_api consulta remaining()
+# para encurtar o timeout de cada chamada e desiste das restantes quando o prazo acaba.
+# O escopo vive num ContextVar: vale para threads de fan-out (com contexto copiado) e asyncio.to_thread.
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import requests
+
+# Abaixo disso não vale a pena iniciar uma chamada (ela só terminaria em timeout)
+ML_DEADLINE_MIN_CALL_SECONDS = 0.25
+
+
+class DeadlineExceeded(requests.Timeout):
+    """O prazo da requisição acabou; a chamada ao ML nem é enviada."""
+
+
+class DeadlineScope:
+    """Prazo absoluto (time.monotonic) + marca de que alguma chamada foi abortada por falta de tempo."""
+
+    __slots__ = ("expires_at", "exceeded", "skipped_calls")
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.exceeded = False
+        self.skipped_calls = 0
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+_current: contextvars.ContextVar[Optional[DeadlineScope]] = contextvars.ContextVar("ml_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[Optional[DeadlineScope]]:
+    """Abre um escopo com prazo de seconds. Escopos aninhados nunca estendem o prazo externo."""
+    outer = _current.get()
+    if seconds is None:
+        yield outer
+        return
+    scope = DeadlineScope(seconds)
+    if outer is not None and outer.expires_at < scope.expires_at:
+        scope.expires_at = outer.expires_at
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+        if outer is not None and scope.exceeded:
+            outer.exceeded = True
+            outer.skipped_calls += scope.skipped_calls
+
+
+def current() -> Optional[DeadlineScope]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Segundos restantes do escopo atual (None = sem prazo)."""
+    scope = _current.get()
+    return scope.remaining() if scope is not None else None
+
+
+def check(what: str = "chamada ao ML") -> Optional[float]:
+    """Retorna os segundos restantes; levanta DeadlineExceeded (e marca o escopo) se não houver tempo útil."""
+    scope = _current.get()
+    if scope is None:
+        return None
+    left = scope.remaining()
+    if left < ML_DEADLINE_MIN_CALL_SECONDS:
+        scope.exceeded = True
+        scope.skipped_calls += 1
+        raise DeadlineExceeded(f"Prazo da requisição esgotado antes de {what}")
+    return left
+
+
+def mark_exceeded() -> None:
+    """Marca o escopo atual como parcial (ex.: chamada que estourou o timeout encurtado)."""
+    scope = _current.get()
+    if scope is not None:
+        scope.exceeded = True
+
+
+def exceeded() -> bool:
+    """True se alguma chamada do escopo atual foi abortada por prazo (resultado parcial)."""
+    scope = _current.get()
+    return bool(scope is not None and scope.exceeded)
@@ -0,0 +1,140 @@
+# app/services/ml_hedge.py — Latência por família de endpoints e GETs "hedged" (requisição duplicada)
+# Com hedging ligado para uma família, o GET roda numa thread; se não responder dentro do p95
+# observado da família, uma cópia é enviada e vale a primeira resposta bem-sucedida.
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Sequence, TypeVar
+
+from app.services.metrics import LatencyWindow, percentile
+
+ML_HEDGE_ENABLED = os.getenv("ML_HEDGE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+ML_HEDGE_FAMILIES = tuple(f.strip() for f in os.getenv("ML_HEDGE_FAMILIES", "items,questions").split(",") if f.strip())
+ML_HEDGE_MAX_RATE = float(os.getenv("ML_HEDGE_MAX_RATE", "0.05"))  # no máximo 5% das chamadas ganham cópia
+ML_HEDGE_MIN_DELAY = float(os.getenv("ML_HEDGE_MIN_DELAY", "0.05"))
+ML_HEDGE_MIN_SAMPLES = int(os.getenv("ML_HEDGE_MIN_SAMPLES", "20"))  # sem histórico suficiente não há p95
+ML_HEDGE_WORKERS = int(os.getenv("ML_HEDGE_WORKERS", "32"))
+_WINDOW = 500  # últimas latências guardadas por família
+
+T = TypeVar("T")
+
+
+class Hedger:
+    """Mede a latência de cada família e, nas famílias habilitadas, envia GETs duplicados no p95.
+
+    raw = latência de cada requisição individual (o que se teria sem hedging);
+    effective = latência vista por quem chamou (primeira resposta). Comparar os p99 mostra o ganho.
+    """
+
+    def __init__(self, families: Sequence[str] = ML_HEDGE_FAMILIES, enabled: bool = ML_HEDGE_ENABLED):
+        self.enabled = enabled
+        self.families = set(families)
+        self._raw: Dict[str, LatencyWindow] = {}
+        self._effective: Dict[str, LatencyWindow] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hedgeable": 0, "hedges_sent": 0, "hedges_won": 0, "hedges_denied": 0}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _window(self, store: Dict[str, LatencyWindow], family: str) -> LatencyWindow:
+        with self._lock:
+            window = store.get(family)
+            if window is None:
+                window = store[family] = LatencyWindow(_WINDOW)
+            return window
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=ML_HEDGE_WORKERS, thread_name_prefix="ml-hedge")
+            return self._executor
+
+    def applies(self, family: str) -> bool:
+        return self.enabled and family in self.families
+
+    def observe(self, family: str, seconds: float) -> None:
+        """Registra a latência de uma chamada sem hedging (raw = effective)."""
+        self._window(self._raw, family).add(seconds)
+        self._window(self._effective, family).add(seconds)
+
+    def hedge_delay(self, family: str) -> Optional[float]:
+        """p95 da família (com piso ML_HEDGE_MIN_DELAY), ou None sem amostras suficientes."""
+        samples = self._window(self._raw, family).snapshot()
+        if len(samples) < ML_HEDGE_MIN_SAMPLES:
+            return None
+        return max(ML_HEDGE_MIN_DELAY, percentile(samples, 95) or 0)
+
+    def _within_rate(self) -> bool:
+        with self._lock:
+            if self._counters["hedges_sent"] + 1 > ML_HEDGE_MAX_RATE * self._counters["hedgeable"]:
+                self._counters["hedges_denied"] += 1
+                return False
+            return True
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _timed(self, family: str, fn: Callable[[], T]) -> Callable[[], T]:
+        def _run() -> T:
+            started = time.monotonic()
+            try:
+                return fn()
+            finally:
+                self._window(self._raw, family).add(time.monotonic() - started)
+
+        return _run
+
+    def run(self, family: str, fn: Callable[[], T], can_send_copy: Optional[Callable[[], bool]] = None) -> T:
+        """Executa fn com hedging: passado o p95 sem resposta, dispara uma cópia; vence a primeira que der certo.
+
+        can_send_copy() é consultado antes da cópia (ex.: rate limit local sem espera).
+        Se a primeira a terminar falhar, espera a outra; se ambas falharem, relança o erro da original.
+        """
+        started = time.monotonic()
+        self._count("hedgeable")
+        executor = self._get_executor()
+        primary: Future = executor.submit(self._timed(family, fn))
+        delay = self.hedge_delay(family)
+        pending = {primary}
+        hedge: Optional[Future] = None
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done and self._within_rate():
+                if can_send_copy is None or can_send_copy():
+                    self._count("hedges_sent")
+                    hedge = executor.submit(self._timed(family, fn))
+                    pending.add(hedge)
+                else:
+                    self._count("hedges_denied")
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    if fut.exception() is None:
+                        if fut is hedge:
+                            self._count("hedges_won")
+                        return fut.result()
+            return primary.result()
+        finally:
+            self._window(self._effective, family).add(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            families = sorted(set(self._raw) | set(self._effective))
+        return {
+            "enabled": self.enabled,
+            "families_enabled": sorted(self.families),
+            "max_rate": ML_HEDGE_MAX_RATE,
+            **counters,
+            "latency": {f: self._family_stats(f) for f in families},
+        }
+
+    def _family_stats(self, family: str) -> Dict[str, Any]:
+        delay = self.hedge_delay(family)
+        return {
+            "raw": self._window(self._raw, family).summary(),
+            "effective": self._window(self._effective, family).summary(),
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
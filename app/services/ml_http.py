@@ -0,0 +1,119 @@
+# app/services/ml_http.py — Transporte HTTP compartilhado (pool keep-alive) para a API do Mercado Livre
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_log = logging.getLogger("ml-intelligence")
+
+# Pool de conexões: pool_connections = nº de hosts distintos mantidos em cache,
+# pool_maxsize = conexões keep-alive por host. Com ML_HTTP_POOL_BLOCK=1 o maxsize
+# vira limite rígido por host (threads aguardam conexão livre em vez de abrir novas).
+ML_HTTP_POOL_CONNECTIONS = int(os.getenv("ML_HTTP_POOL_CONNECTIONS", "4"))
+ML_HTTP_POOL_MAXSIZE = int(os.getenv("ML_HTTP_POOL_MAXSIZE", "32"))
+ML_HTTP_POOL_BLOCK = os.getenv("ML_HTTP_POOL_BLOCK", "1").strip().lower() in ("1", "true", "yes")
+ML_HTTP_TIMEOUT = float(os.getenv("ML_HTTP_TIMEOUT", "15"))
+USER_AGENT = "MLIntelligence/1.0 (https://mercadoinsights.online)"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0}
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=ML_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=ML_HTTP_POOL_MAXSIZE,
+        pool_block=ML_HTTP_POOL_BLOCK,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept": "application/json",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session() -> requests.Session:
+    """Retorna a sessão compartilhada (criada sob demanda, thread-safe)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def reset_session() -> None:
+    """Fecha a sessão atual e zera as estatísticas (próxima chamada recria o pool)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+    with _stats_lock:
+        _stats["requests"] = 0
+        _stats["errors"] = 0
+
+
+def request(method: str, url: str, timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+    """Executa a requisição pelo pool compartilhado. Mesma assinatura de requests.request."""
+    try:
+        resp = get_session().request(method, url, timeout=timeout or ML_HTTP_TIMEOUT, **kwargs)
+    except requests.RequestException:
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["errors"] += 1
+        raise
+    with _stats_lock:
+        _stats["requests"] += 1
+    return resp
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Estatísticas do pool: requisições, conexões abertas por host e taxa de reuso."""
+    hosts = []
+    session = _session
+    if session is not None:
+        for adapter in set(session.adapters.values()):
+            manager = getattr(adapter, "poolmanager", None)
+            if manager is None:
+                continue
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                num_requests = getattr(pool, "num_requests", 0)
+                num_connections = getattr(pool, "num_connections", 0)
+                # a fila do urllib3 é pré-preenchida com None; só conta conexões reais
+                queue = getattr(pool, "pool", None)
+                idle = sum(1 for c in list(queue.queue) if c is not None) if queue is not None else 0
+                hosts.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "requests": num_requests,
+                    "connections_opened": num_connections,
+                    "idle_connections": idle,
+                    "reuse_rate": round(1 - num_connections / num_requests, 4) if num_requests else None,
+                })
+    with _stats_lock:
+        totals = dict(_stats)
+    total_requests = sum(h["requests"] for h in hosts)
+    total_conns = sum(h["connections_opened"] for h in hosts)
+    return {
+        "pool_connections": ML_HTTP_POOL_CONNECTIONS,
+        "pool_maxsize": ML_HTTP_POOL_MAXSIZE,
+        "pool_block": ML_HTTP_POOL_BLOCK,
+        "requests": totals["requests"],
+        "errors": totals["errors"],
+        "connections_opened": total_conns,
+        "reuse_rate": round(1 - total_conns / total_requests, 4) if total_requests else None,
+        "hosts": hosts,
+    }
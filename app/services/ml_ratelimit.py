@@ -0,0 +1,171 @@
+# app/services/ml_ratelimit.py — Rate limit local (token bucket) e backoff para chamadas à API do ML
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+
+# Limites locais: um bucket global (todas as chamadas do processo), um por access_token e um para
+# as chamadas anônimas (busca pública, fallback sem token) — um 429 só bloqueia o bucket de quem o recebeu.
+# rate = requisições/segundo sustentadas; burst = rajada máxima antes de enfileirar.
+ML_RATE_GLOBAL_PER_SEC = float(os.getenv("ML_RATE_GLOBAL_PER_SEC", "25"))
+ML_RATE_GLOBAL_BURST = float(os.getenv("ML_RATE_GLOBAL_BURST", "50"))
+ML_RATE_TOKEN_PER_SEC = float(os.getenv("ML_RATE_TOKEN_PER_SEC", "8"))
+ML_RATE_TOKEN_BURST = float(os.getenv("ML_RATE_TOKEN_BURST", "16"))
+ML_RATE_ANON_PER_SEC = float(os.getenv("ML_RATE_ANON_PER_SEC", str(ML_RATE_TOKEN_PER_SEC)))
+ML_RATE_ANON_BURST = float(os.getenv("ML_RATE_ANON_BURST", str(ML_RATE_TOKEN_BURST)))
+ML_RATE_MAX_WAIT = float(os.getenv("ML_RATE_MAX_WAIT", "20"))  # acima disso a chamada é recusada
+ML_RETRY_MAX = int(os.getenv("ML_RETRY_MAX", "2"))  # novas tentativas de GET após 429/503
+ML_RETRY_BASE_DELAY = float(os.getenv("ML_RETRY_BASE_DELAY", "0.5"))
+ML_RETRY_MAX_DELAY = float(os.getenv("ML_RETRY_MAX_DELAY", "10"))
+_MAX_TOKEN_BUCKETS = 5000
+
+
+class RateLimitExceeded(requests.RequestException):
+    """A espera na fila local passaria de ML_RATE_MAX_WAIT; a chamada nem é enviada ao ML."""
+
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        self.retry_in = retry_in  # espera prevista na fila no momento da recusa
+
+
+class TokenBucket:
+    """Token bucket com reserva antecipada: cada chamada reserva 1 token e recebe quanto deve esperar.
+
+    Os tokens podem ficar negativos (fila); blocked_until vem de um Retry-After do ML.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def peek_wait(self, now: float) -> float:
+        with self._lock:
+            self._refill(now)
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def reserve(self, now: float) -> float:
+        with self._lock:
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float) -> None:
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """Bucket global + um bucket por access_token (LRU limitado) ou o anônimo, com métricas de espera.
+
+    O global só limita o ritmo local do processo; Retry-After do ML bloqueia o bucket do token ou o anônimo.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(ML_RATE_GLOBAL_PER_SEC, ML_RATE_GLOBAL_BURST)
+        self._anon = TokenBucket(ML_RATE_ANON_PER_SEC, ML_RATE_ANON_BURST)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "throttled": 0, "rejected": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "responses_429": 0, "retries": 0}
+
+    def _bucket(self, token_key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(token_key)
+            if bucket is None:
+                bucket = TokenBucket(ML_RATE_TOKEN_PER_SEC, ML_RATE_TOKEN_BURST)
+                self._buckets[token_key] = bucket
+                while len(self._buckets) > _MAX_TOKEN_BUCKETS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(token_key)
+            return bucket
+
+    def acquire(self, token_key: Optional[str] = None, max_wait: Optional[float] = None) -> float:
+        """Aguarda a vez na fila (global e do token). Retorna segundos esperados.
+
+        Levanta RateLimitExceeded se a espera prevista passar de max_wait.
+        """
+        limit = ML_RATE_MAX_WAIT if max_wait is None else max_wait
+        buckets = [self._global, self._bucket(token_key) if token_key else self._anon]
+        now = time.monotonic()
+        expected = max(b.peek_wait(now) for b in buckets)
+        if expected > limit:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise RateLimitExceeded(f"Fila local do rate limit do ML excede {limit:.0f}s", retry_in=expected)
+        wait = max(b.reserve(now) for b in buckets)
+        with self._lock:
+            self._stats["acquired"] += 1
+            if wait > 0:
+                self._stats["throttled"] += 1
+                self._stats["wait_seconds_total"] += wait
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, token_key: Optional[str], seconds: float) -> None:
+        """Registra um 429: bloqueia o bucket do token (ou o anônimo) por seconds; o global não é afetado."""
+        with self._lock:
+            self._stats["responses_429"] += 1
+        (self._bucket(token_key) if token_key else self._anon).block(seconds)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["token_buckets"] = len(self._buckets)
+        stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 3)
+        stats["wait_seconds_max"] = round(stats["wait_seconds_max"], 3)
+        stats["limits"] = {
+            "global_per_sec": ML_RATE_GLOBAL_PER_SEC,
+            "global_burst": ML_RATE_GLOBAL_BURST,
+            "token_per_sec": ML_RATE_TOKEN_PER_SEC,
+            "token_burst": ML_RATE_TOKEN_BURST,
+            "anon_per_sec": ML_RATE_ANON_PER_SEC,
+            "anon_burst": ML_RATE_ANON_BURST,
+        }
+        stats["anon_blocked_seconds"] = round(max(0.0, self._anon.blocked_until - time.monotonic()), 3)
+        return stats
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After em segundos (aceita número ou data HTTP)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Backoff exponencial com jitter (entre metade e o teto do passo), respeitando Retry-After como mínimo."""
+    ceiling = min(ML_RETRY_MAX_DELAY, ML_RETRY_BASE_DELAY * (2 ** attempt))
+    delay = random.uniform(ceiling / 2, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, ML_RETRY_MAX_DELAY))
+    return delay
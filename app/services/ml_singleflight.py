@@ -0,0 +1,94 @@
+# app/services/ml_singleflight.py — Coalescência de chamadas idênticas em andamento (single-flight)
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class WaitTimeout(TimeoutError):
+    """O seguidor desistiu de esperar a execução do líder (wait_timeout)."""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Chamadas concorrentes com a mesma chave compartilham uma única execução.
+
+    A primeira thread (líder) executa fn; as que chegam enquanto ela roda esperam e
+    recebem o mesmo resultado (ou a mesma exceção). Nada fica guardado depois que a
+    chamada termina — isto não é cache, só evita trabalho duplicado simultâneo.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._counters = {"executed": 0, "shared": 0, "follower_retries": 0, "wait_timeouts": 0}
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], T],
+        wait_timeout: Optional[float] = None,
+        retry_if: Optional[Callable[[BaseException], bool]] = None,
+    ) -> Tuple[T, bool]:
+        """Executa fn (ou aguarda a execução em andamento). Retorna (resultado, compartilhado).
+
+        wait_timeout: quanto um seguidor espera pelo líder (None = sem limite); esgotado, levanta WaitTimeout.
+        retry_if(erro): se o erro do líder for desse tipo, o seguidor executa fn por conta própria em vez
+        de recebê-lo (ex.: o prazo da requisição do líder, que não vale para quem só esperou).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._counters["shared"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["executed"] += 1
+                leader = True
+        if not leader:
+            if not call.done.wait(None if wait_timeout is None else max(0.0, wait_timeout)):
+                with self._lock:
+                    self._counters["wait_timeouts"] += 1
+                raise WaitTimeout(f"{self.name}: espera pela chamada em andamento esgotada")
+            if call.error is not None:
+                if retry_if is not None and retry_if(call.error):
+                    with self._lock:
+                        self._counters["follower_retries"] += 1
+                    return fn(), False
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            in_flight = len(self._calls)
+        total = counters["executed"] + counters["shared"]
+        return {
+            "name": self.name,
+            "in_flight": in_flight,
+            "executed": counters["executed"],
+            "calls_saved": counters["shared"],
+            "saved_rate": round(counters["shared"] / total, 4) if total else None,
+            "follower_retries": counters["follower_retries"],
+            "wait_timeouts": counters["wait_timeouts"],
+        }
@@ -0,0 +1,228 @@
+# app/services/ml_token_service.py — Tokens OAuth do ML por usuário: cache em memória + renovação antecipada
+# Renovação "single-flight": um lock por usuário no processo + lock da linha MlToken no banco
+# (SELECT ... FOR UPDATE) entre workers. Quem chega depois reaproveita o token já renovado.
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, end_read
+from app.models import MlToken
+from app.services.ml_api import refresh_access_token
+
+_log = logging.getLogger("ml-intelligence")
+
+# Quanto tempo um token lido do banco fica em memória (limita o atraso entre workers do uvicorn)
+ML_TOKEN_CACHE_TTL = float(os.getenv("ML_TOKEN_CACHE_TTL", "300"))
+ML_TOKEN_NEGATIVE_TTL = float(os.getenv("ML_TOKEN_NEGATIVE_TTL", "30"))  # "sem conta ML conectada"
+# Na requisição: renova na hora se faltar menos que isto (o job deve ter renovado antes)
+ML_TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# Job em background: renova tokens que vencem dentro desta janela
+ML_TOKEN_REFRESH_AHEAD = timedelta(minutes=int(os.getenv("ML_TOKEN_REFRESH_AHEAD_MINUTES", "30")))
+ML_TOKEN_REFRESH_INTERVAL_MINUTES = int(os.getenv("ML_TOKEN_REFRESH_INTERVAL_MINUTES", "5"))
+
+
+class CachedMlToken:
+    """Cópia em memória de um MlToken (mesmos atributos; não depende de sessão aberta)."""
+
+    __slots__ = ("user_id", "access_token", "refresh_token", "seller_id", "expires_at", "created_at")
+
+    def __init__(self, row: MlToken):
+        self.user_id = row.user_id
+        self.access_token = row.access_token
+        self.refresh_token = row.refresh_token
+        self.seller_id = row.seller_id
+        self.expires_at = row.expires_at
+        self.created_at = row.created_at
+
+    def expires_within(self, delta: timedelta) -> bool:
+        return bool(self.expires_at and self.expires_at <= datetime.utcnow() + delta)
+
+
+_cache: Dict[int, Tuple[Optional[CachedMlToken], float]] = {}
+_cache_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "refreshed_in_request": 0,
+    "refreshed_ahead": 0,
+    "refresh_failures": 0,
+    "refresh_joined": 0,  # esperou outra renovação (thread ou worker) e reaproveitou o resultado
+}
+_refresh_locks: Dict[int, threading.Lock] = {}
+
+
+def _count(name: str) -> None:
+    with _cache_lock:
+        _stats[name] += 1
+
+
+def _cache_get(user_id: int) -> Tuple[bool, Optional[CachedMlToken]]:
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is None or entry[1] <= time.monotonic():
+            _stats["misses"] += 1
+            return False, None
+        _stats["hits"] += 1
+        return True, entry[0]
+
+
+def _cache_put(user_id: int, token: Optional[CachedMlToken]) -> None:
+    ttl = ML_TOKEN_CACHE_TTL if token is not None else ML_TOKEN_NEGATIVE_TTL
+    with _cache_lock:
+        _cache[user_id] = (token, time.monotonic() + ttl)
+
+
+def _peek(user_id: int) -> Optional[CachedMlToken]:
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        return entry[0] if entry and entry[1] > time.monotonic() else None
+
+
+def _refresh_lock(user_id: int) -> threading.Lock:
+    with _cache_lock:
+        lock = _refresh_locks.get(user_id)
+        if lock is None:
+            lock = _refresh_locks[user_id] = threading.Lock()
+        return lock
+
+
+def invalidate(user_id: int) -> None:
+    """Descarta o token em memória (chamar após conectar/desconectar a conta ML)."""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def apply_token_response(row: MlToken, tokens: dict) -> None:
+    """Copia a resposta de /oauth/token para a linha MlToken (sem commit)."""
+    row.access_token = tokens.get("access_token", "")
+    if "refresh_token" in tokens:
+        row.refresh_token = tokens.get("refresh_token", "")
+    expires_in = tokens.get("expires_in")
+    if expires_in:
+        row.expires_at = datetime.utcnow() + timedelta(seconds=int(expires_in))
+
+
+def _refresh_guarded(user_id: int, margin: timedelta) -> Tuple[Optional[CachedMlToken], bool]:
+    """Renova o token do usuário se vencer dentro de margin; uma renovação por vez por usuário.
+
+    Serializa no processo (lock por user_id) e entre workers (FOR UPDATE na linha MlToken;
+    o SQLite ignora FOR UPDATE, ver o fallback abaixo). Depois do lock, relê a linha:
+    se outro já renovou, devolve esse token sem chamar /oauth/token de novo.
+    Retorna (token, renovou_aqui); token None se não houver conta conectada ou se o ML recusar.
+    """
+    with _refresh_lock(user_id):
+        cached = _peek(user_id)
+        if cached is not None and not cached.expires_within(margin):
+            _count("refresh_joined")
+            return cached, False
+        db = SessionLocal()
+        try:
+            row = db.query(MlToken).filter(MlToken.user_id == user_id).with_for_update().first()
+            if row is None:
+                db.rollback()
+                _cache_put(user_id, None)
+                return None, False
+            token = CachedMlToken(row)
+            if not token.expires_within(margin):
+                db.rollback()  # libera o lock da linha
+                if cached is not None:
+                    _count("refresh_joined")
+                _cache_put(user_id, token)
+                return token, False
+            new_tokens = refresh_access_token(row.refresh_token)
+            if new_tokens and "access_token" in new_tokens:
+                apply_token_response(row, new_tokens)
+                db.commit()
+                token = CachedMlToken(row)
+                _cache_put(user_id, token)
+                return token, True
+            db.rollback()
+            _count("refresh_failures")
+            # Sem lock de linha (SQLite com vários processos) outro worker pode ter usado o mesmo
+            # refresh_token primeiro; se a linha já tem token novo, vale o dele.
+            row = db.query(MlToken).filter(MlToken.user_id == user_id).first()
+            if row is not None and row.access_token != token.access_token and not CachedMlToken(row).expires_within(margin):
+                token = CachedMlToken(row)
+                _count("refresh_joined")
+                _cache_put(user_id, token)
+                return token, False
+            invalidate(user_id)
+            return None, False
+        finally:
+            db.close()
+
+
+def refresh_if_expiring(user_id: int, margin: timedelta = ML_TOKEN_REFRESH_MARGIN) -> Optional[CachedMlToken]:
+    """Token do usuário renovado se vencer dentro de margin (single-flight; ver _refresh_guarded)."""
+    token, did_refresh = _refresh_guarded(user_id, margin)
+    if did_refresh:
+        _count("refreshed_in_request")
+        _log.info("Token ML renovado para usuário %s", user_id)
+    return token
+
+
+def get_valid_token(user_id: int, db: Optional[Session] = None) -> Optional[CachedMlToken]:
+    """Token válido do usuário (memória -> banco), renovando na hora só se estiver para vencer.
+
+    db: sessão da requisição, usada na leitura em caso de miss (sem ela, abre uma própria).
+    A renovação sempre usa sessão própria (transação com lock da linha).
+    """
+    found, cached = _cache_get(user_id)
+    if found and (cached is None or not cached.expires_within(ML_TOKEN_REFRESH_MARGIN)):
+        return cached
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        row = db.query(MlToken).filter(MlToken.user_id == user_id).first()
+        token = CachedMlToken(row) if row is not None else None
+        end_read(db)
+    finally:
+        if own_session:
+            db.close()
+    if token is None or not token.expires_within(ML_TOKEN_REFRESH_MARGIN):
+        _cache_put(user_id, token)
+        return token
+    token = refresh_if_expiring(user_id, ML_TOKEN_REFRESH_MARGIN)
+    if token is None:
+        _log.warning("Falha ao renovar token ML para usuário %s", user_id)
+    return token
+
+
+def refresh_expiring_tokens() -> int:
+    """Job em background: renova os tokens que vencem dentro de ML_TOKEN_REFRESH_AHEAD. Retorna quantos renovou."""
+    limit = datetime.utcnow() + ML_TOKEN_REFRESH_AHEAD
+    db = SessionLocal()
+    try:
+        user_ids = [
+            uid for (uid,) in db.query(MlToken.user_id).filter(MlToken.expires_at.isnot(None), MlToken.expires_at <= limit)
+        ]
+    finally:
+        db.close()
+    refreshed = 0
+    for user_id in user_ids:
+        try:
+            token, did_refresh = _refresh_guarded(user_id, ML_TOKEN_REFRESH_AHEAD)
+        except Exception as e:
+            _log.warning("Renovação antecipada do token ML: erro para user_id=%s: %s", user_id, e)
+            continue
+        if token is None:
+            _log.warning("Renovação antecipada do token ML falhou (user_id=%s)", user_id)
+        elif did_refresh:
+            refreshed += 1
+            _count("refreshed_ahead")
+    if refreshed:
+        _log.info("Tokens ML renovados antecipadamente: %d", refreshed)
+    return refreshed
+
+
+def get_stats() -> Dict[str, int]:
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["cached_users"] = len(_cache)
+    return stats
@@ -0,0 +1,74 @@
+# app/services/pagination.py — Paginação por cursor (keyset) em (created_at, id)
+# A página seguinte continua de onde a anterior parou (WHERE (created_at, id) < cursor), sem OFFSET:
+# com índice em (..., created_at) a página N custa o mesmo que a primeira.
+# Totais são opcionais e aproximados: count() cacheado por PAGINATION_COUNT_TTL segundos.
+import base64
+import os
+from datetime import datetime
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Query
+
+from app.services.ml_cache import TTLCache
+
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "500"))
+PAGINATION_COUNT_TTL = float(os.getenv("PAGINATION_COUNT_TTL", "60"))
+
+_COUNT_CACHE = TTLCache("pagination_counts", max_size=10000, ttl=PAGINATION_COUNT_TTL, stale_ttl=0)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("cursor inválido") from e
+
+
+def clamp_limit(limit: int, default: int) -> int:
+    if limit is None or limit <= 0:
+        return default
+    return min(limit, PAGINATION_MAX_LIMIT)
+
+
+def keyset_page(query: Query, model: Any, limit: int, cursor: Optional[str] = None) -> Tuple[List[Any], Optional[str]]:
+    """Uma página de query, do mais recente para o mais antigo. Retorna (linhas, cursor da próxima página ou None).
+
+    model precisa de created_at (não nulo) e id; id desempata linhas com o mesmo created_at.
+    Levanta InvalidCursor se o cursor não for um valor devolvido por esta função.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # created_at <= c isolado dá ao planner o intervalo do índice; o OR só desempata dentro de c
+        query = query.filter(model.created_at <= created_at, or_(model.created_at < created_at, model.id < row_id))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+def approx_count(key: Hashable, count: Callable[[], int]) -> int:
+    """count() cacheado por key (ex.: ("history", user_id)); pode ficar até PAGINATION_COUNT_TTL segundos defasado."""
+    cached = _COUNT_CACHE.get(key)
+    if cached is not None:
+        return cached
+    value = count()
+    _COUNT_CACHE.set(key, value)
+    return value
+
+
+def invalidate_count(key: Hashable) -> None:
+    _COUNT_CACHE.invalidate(key)
@@ -0,0 +1,191 @@
+# app/services/question_poller.py — Polling das perguntas não respondidas de todos os vendedores
+# Um ciclo: uma consulta lista os vendedores conectados; um pool limitado (QUESTION_POLL_WORKERS)
+# busca as perguntas de cada vendedor no ML em paralelo; uma consulta por vendedor descarta as já
+# enfileiradas; as novas vão para a fila da IA (QUESTION_LLM_WORKERS threads), que roda à parte —
+# o ciclo não espera a IA. Se o ciclo anterior ainda estiver rodando, o novo é pulado.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import MlToken, PendingQuestion, User
+from app.services import ml_api, ml_token_service
+from app.services.metrics import LatencyWindow
+
+logger = logging.getLogger("ml-intelligence")
+
+# Vendedores consultados ao mesmo tempo (cada um ocupa uma conexão do pool HTTP do ML, ML_HTTP_POOL_MAXSIZE)
+QUESTION_POLL_WORKERS = int(os.getenv("QUESTION_POLL_WORKERS", "8"))
+QUESTION_POLL_PAGE = int(os.getenv("QUESTION_POLL_PAGE", "50"))
+QUESTION_LLM_WORKERS = int(os.getenv("QUESTION_LLM_WORKERS", "4"))
+QUESTION_LLM_QUEUE_MAX = int(os.getenv("QUESTION_LLM_QUEUE_MAX", "500"))  # perguntas aguardando/na IA
+
+_CLOSED_STATUSES = ("ANSWERED", "BANNED", "DELETED", "DISABLED")
+
+ProcessQuestion = Callable[[str, int], None]
+
+_cycle_lock = threading.Lock()
+_llm_lock = threading.Lock()
+_llm_executor: Optional[ThreadPoolExecutor] = None
+_in_flight: Set[str] = set()  # question_ids na fila da IA (evita despachar de novo no ciclo seguinte)
+_durations = LatencyWindow(200)
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "cycles": 0,
+    "cycles_skipped": 0,
+    "sellers_polled": 0,
+    "seller_errors": 0,
+    "dispatched": 0,
+    "dispatch_dropped": 0,
+    "llm_done": 0,
+    "llm_failures": 0,
+}
+_last_cycle: Dict[str, Any] = {}
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def open_question_ids(questions: Iterable[dict]) -> List[str]:
+    """IDs (sem repetição, na ordem do ML) das perguntas que ainda aceitam resposta."""
+    out: List[str] = []
+    for q in questions:
+        if (q.get("status") or "").upper() in _CLOSED_STATUSES:
+            continue
+        question_id = str(q.get("id") or "").strip()
+        if question_id and question_id not in out:
+            out.append(question_id)
+    return out
+
+
+def existing_question_ids(db: Session, user_id: int, question_ids: List[str]) -> Set[str]:
+    """Quais dessas perguntas já estão em PendingQuestion (uma consulta para a lista toda)."""
+    if not question_ids:
+        return set()
+    rows = db.execute(
+        select(PendingQuestion.question_id).where(PendingQuestion.user_id == user_id, PendingQuestion.question_id.in_(question_ids))
+    )
+    return {r[0] for r in rows}
+
+
+def _connected_user_ids() -> List[int]:
+    db = SessionLocal()
+    try:
+        return list(db.execute(select(MlToken.user_id).join(User, User.id == MlToken.user_id).where(MlToken.seller_id.isnot(None))).scalars())
+    finally:
+        db.close()
+
+
+def _poll_seller(user_id: int) -> List[str]:
+    """Perguntas novas (não enfileiradas) de um vendedor."""
+    token = ml_token_service.get_valid_token(user_id)
+    if not token or not token.access_token or not token.seller_id:
+        return []
+    result = ml_api.get_questions_search(token.access_token, seller_id=token.seller_id, limit=QUESTION_POLL_PAGE, offset=0)
+    question_ids = open_question_ids((result or {}).get("questions") or [])
+    if not question_ids:
+        return []
+    db = SessionLocal()
+    try:
+        existing = existing_question_ids(db, user_id, question_ids)
+    finally:
+        db.close()
+    return [q for q in question_ids if q not in existing]
+
+
+def _get_llm_executor() -> ThreadPoolExecutor:
+    global _llm_executor
+    with _llm_lock:
+        if _llm_executor is None:
+            _llm_executor = ThreadPoolExecutor(max_workers=QUESTION_LLM_WORKERS, thread_name_prefix="question-llm")
+        return _llm_executor
+
+
+def _run_llm(process: ProcessQuestion, question_id: str, user_id: int) -> None:
+    try:
+        process(question_id, user_id)
+        _count("llm_done")
+    except Exception as e:
+        _count("llm_failures")
+        logger.warning("Polling de perguntas: falha ao processar %s (user_id=%s): %s", question_id, user_id, e)
+    finally:
+        with _llm_lock:
+            _in_flight.discard(question_id)
+
+
+def _dispatch(process: ProcessQuestion, question_id: str, user_id: int) -> bool:
+    executor = _get_llm_executor()
+    with _llm_lock:
+        if question_id in _in_flight:
+            return False
+        if len(_in_flight) >= QUESTION_LLM_QUEUE_MAX:
+            _count("dispatch_dropped")  # fica para o próximo ciclo
+            return False
+        _in_flight.add(question_id)
+    executor.submit(_run_llm, process, question_id, user_id)
+    _count("dispatched")
+    return True
+
+
+def run_cycle(process_question: ProcessQuestion) -> Optional[Dict[str, Any]]:
+    """Um ciclo de polling. process_question(question_id, user_id) roda na fila da IA.
+
+    Retorna o resumo do ciclo, ou None se o ciclo anterior ainda estava rodando.
+    """
+    if not _cycle_lock.acquire(blocking=False):
+        _count("cycles_skipped")
+        logger.warning("Polling de perguntas: ciclo anterior ainda em andamento, pulando este")
+        return None
+    try:
+        started = time.perf_counter()
+        user_ids = _connected_user_ids()
+        found = dispatched = errors = 0
+        if user_ids:
+            with ThreadPoolExecutor(max_workers=max(1, min(QUESTION_POLL_WORKERS, len(user_ids))), thread_name_prefix="question-poll") as pool:
+                futures = {pool.submit(_poll_seller, uid): uid for uid in user_ids}
+                for future in as_completed(futures):
+                    user_id = futures[future]
+                    try:
+                        new_ids = future.result()
+                    except Exception as e:
+                        errors += 1
+                        logger.warning("Polling de perguntas: erro no user_id=%s: %s", user_id, e)
+                        continue
+                    found += len(new_ids)
+                    dispatched += sum(1 for qid in new_ids if _dispatch(process_question, qid, user_id))
+        duration = time.perf_counter() - started
+        _durations.add(duration)
+        _count("cycles")
+        _count("sellers_polled", len(user_ids))
+        _count("seller_errors", errors)
+        summary = {
+            "sellers": len(user_ids),
+            "new_questions": found,
+            "dispatched": dispatched,
+            "errors": errors,
+            "duration_ms": round(duration * 1000, 1),
+            "finished_at": time.time(),
+        }
+        _last_cycle.clear()
+        _last_cycle.update(summary)
+        return summary
+    finally:
+        _cycle_lock.release()
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    with _llm_lock:
+        stats["llm_in_flight"] = len(_in_flight)
+    stats["cycle_duration"] = _durations.summary()
+    stats["last_cycle"] = dict(_last_cycle)
+    return stats
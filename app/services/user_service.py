@@ -1,23 +1,94 @@
 # app/services/user_service.py — Sincroniza usuários Clerk com o banco local
-from app.database import SessionLocal
+# get_current_user roda em toda requisição autenticada: o usuário fica num cache em memória
+# (clerk_user_id -> snapshot das colunas) e só volta ao banco quando o cache vence ou o registro muda.
+import os
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.database import SessionLocal, end_read
 from app.models import User
+from app.services.ml_cache import TTLCache
+
+# Alterações feitas em outro worker (plano, Telegram) aparecem aqui em até USER_CACHE_TTL segundos
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "5000"))
+
+_USER_CACHE = TTLCache("users", max_size=USER_CACHE_MAX, ttl=USER_CACHE_TTL, stale_ttl=0)
+_COLUMNS = tuple(c.key for c in User.__table__.columns)
+
+
+def _snapshot(user: User) -> Dict[str, Any]:
+    return {name: getattr(user, name) for name in _COLUMNS}
+
+
+def _from_snapshot(snap: Dict[str, Any]) -> User:
+    """Novo objeto User (fora de sessão) a cada requisição, para nenhuma rota alterar o cache."""
+    return User(**snap)
+
+
+_PENDING_KEY = "user_cache_invalidate"  # em Session.info: clerk_user_ids alterados na transação
 
 
-def get_or_create_user(clerk_user_id: str, email: str | None = None) -> User:
-    """Retorna usuário existente ou cria novo. Use após validar JWT do Clerk."""
-    db = SessionLocal()
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_on_write(mapper, connection, target: User) -> None:
+    """Alteração de User via ORM (plano, e-mail, Telegram): o snapshot em cache é descartado no commit.
+
+    Descartar já no flush não basta: até o commit outra requisição ainda lê a linha antiga e a
+    colocaria de volta no cache (ex.: plano "free" logo depois do pagamento).
+    """
+    session = object_session(target)
+    if not target.clerk_user_id:
+        return
+    if session is None:
+        _USER_CACHE.invalidate(target.clerk_user_id)
+        return
+    session.info.setdefault(_PENDING_KEY, set()).add(target.clerk_user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    for clerk_user_id in session.info.pop(_PENDING_KEY, ()):
+        _USER_CACHE.invalidate(clerk_user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def get_or_create_user(clerk_user_id: str, email: str | None = None, db: Optional[Session] = None) -> User:
+    """Retorna usuário existente ou cria novo. Use após validar JWT do Clerk.
+
+    db: sessão da requisição (get_current_user); sem ela, abre e fecha uma própria.
+    O User retornado é sempre uma cópia fora de sessão.
+    """
+    snap = _USER_CACHE.get(clerk_user_id)
+    if snap is not None and (not email or snap["email"] == email):
+        return _from_snapshot(snap)
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
     try:
         user = db.query(User).filter(User.clerk_user_id == clerk_user_id).first()
-        if user:
-            if email and user.email != email:
+        if user is None or (email and user.email != email):
+            if user is None:
+                user = User(clerk_user_id=clerk_user_id, email=email, plan="free")
+                db.add(user)
+            else:
                 user.email = email
-                db.commit()
-                db.refresh(user)
-            return user
-        user = User(clerk_user_id=clerk_user_id, email=email, plan="free")
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
+            db.commit()
+            db.refresh(user)
+        snap = _snapshot(user)
+        end_read(db)  # devolve a conexão ao pool antes do handler (que pode chamar o ML primeiro)
+        _USER_CACHE.set(clerk_user_id, snap)
+        return _from_snapshot(snap)
     finally:
-        db.close()
+        if own_session:
+            db.close()
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    return _USER_CACHE.stats()
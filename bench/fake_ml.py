@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""Servidor local que imita a API do Mercado Livre (benchmarks e testes offline).
+
+Uso:
+    python -m bench.fake_ml --port 8765 --sellers 5 --items 1200 --latency lognormal:80,0.5
+    ML_API=http://127.0.0.1:8765 uvicorn app.main:app
+
+Rotas: /oauth/token, /users/me, /users/{id}/items/search (offset e scan), /items/{id},
+/items?ids=, /items/{id}/description, /orders/search, /orders/{id}, /questions/search,
+/questions/{id}, /answers, /sites/{site}/search. Contadores por rota em GET /_fake/stats
+(POST /_fake/reset zera). Tokens de acesso são "APP_USR-fake-<seller_id>".
+
+Latência: "fixed:MS", "uniform:MIN_MS,MAX_MS" ou "lognormal:MEDIANA_MS,SIGMA" (global ou por
+família com --latency-family items=fixed:300). Erros: --error-rate (503) e --rate-429 (com Retry-After).
+Todo o dataset sai de --seed, então duas execuções com os mesmos parâmetros são idênticas.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+ITEM_STATUSES = ("active", "active", "active", "paused", "closed", "under_review")
+OFFSET_CAP = 1000
+MULTIGET_MAX = 20
+TOKEN_PREFIX = "APP_USR-fake-"
+WORDS = ("fone", "bluetooth", "capa", "celular", "carregador", "cabo", "usb", "notebook", "mouse", "teclado", "caixa", "som", "smartwatch", "suporte", "tripé", "lâmpada", "led")
+
+
+def parse_latency(spec: str) -> Tuple[str, Tuple[float, ...]]:
+    """'lognormal:80,0.5' -> ('lognormal', (80.0, 0.5)). Valores em milissegundos."""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    values = tuple(float(v) for v in args.split(",") if v.strip()) or (0.0,)
+    if kind not in ("fixed", "uniform", "lognormal"):
+        raise ValueError(f"Distribuição de latência desconhecida: {spec}")
+    return kind, values
+
+
+class FakeMlConfig:
+    """Parâmetros do servidor (padrões vindos de FAKE_ML_*)."""
+
+    def __init__(
+        self,
+        seed: int = int(os.getenv("FAKE_ML_SEED", "42")),
+        sellers: int = int(os.getenv("FAKE_ML_SELLERS", "3")),
+        items_per_seller: int = int(os.getenv("FAKE_ML_ITEMS", "300")),
+        orders_per_seller: int = int(os.getenv("FAKE_ML_ORDERS", "200")),
+        questions_per_seller: int = int(os.getenv("FAKE_ML_QUESTIONS", "60")),
+        latency: str = os.getenv("FAKE_ML_LATENCY", "lognormal:60,0.4"),
+        family_latency: Optional[Dict[str, str]] = None,
+        error_rate: float = float(os.getenv("FAKE_ML_ERROR_RATE", "0")),
+        rate_429: float = float(os.getenv("FAKE_ML_RATE_429", "0")),
+        retry_after: float = float(os.getenv("FAKE_ML_RETRY_AFTER", "1")),
+    ):
+        self.seed = seed
+        self.sellers = sellers
+        self.items_per_seller = items_per_seller
+        self.orders_per_seller = orders_per_seller
+        self.questions_per_seller = questions_per_seller
+        self.latency = parse_latency(latency)
+        self.family_latency = {k: parse_latency(v) for k, v in (family_latency or {}).items()}
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+
+class FakeMlData:
+    """Dataset determinístico: vendedores, anúncios, pedidos e perguntas."""
+
+    def __init__(self, config: FakeMlConfig):
+        rng = random.Random(config.seed)
+        self.seller_ids = [str(100000 + i) for i in range(config.sellers)]
+        self.items: Dict[str, dict] = {}
+        self.items_by_seller: Dict[str, List[str]] = {}
+        self.orders: Dict[str, dict] = {}
+        self.orders_by_seller: Dict[str, List[str]] = {}
+        self.questions: Dict[str, dict] = {}
+        self.questions_by_seller: Dict[str, List[str]] = {}
+        self.descriptions: Dict[str, str] = {}
+        for seller in self.seller_ids:
+            ids = []
+            for n in range(config.items_per_seller):
+                item_id = f"MLB{seller}{n:06d}"
+                title = " ".join(rng.sample(WORDS, 3)).title()
+                self.items[item_id] = {
+                    "id": item_id,
+                    "site_id": "MLB",
+                    "title": title,
+                    "seller_id": int(seller),
+                    "category_id": f"MLB{rng.randint(1000, 1999)}",
+                    "price": round(rng.uniform(9.9, 999.9), 2),
+                    "currency_id": "BRL",
+                    "available_quantity": rng.randint(0, 500),
+                    "sold_quantity": rng.randint(0, 2000),
+                    "listing_type_id": rng.choice(("gold_special", "gold_pro")),
+                    "status": rng.choice(ITEM_STATUSES),
+                    "condition": "new",
+                    "permalink": f"https://produto.mercadolivre.com.br/{item_id}",
+                    "thumbnail": f"https://http2.mlstatic.com/{item_id}.jpg",
+                    "seller_custom_field": f"SKU-{n:05d}",
+                    "attributes": [{"id": "BRAND", "value_name": rng.choice(("Genérica", "Acme", "XPTO"))}],
+                    "date_created": "2025-01-01T00:00:00.000Z",
+                    "last_updated": "2026-01-01T00:00:00.000Z",
+                }
+                self.descriptions[item_id] = f"Descrição de {title}."
+                ids.append(item_id)
+            self.items_by_seller[seller] = ids
+            order_ids = []
+            for n in range(config.orders_per_seller):
+                order_id = f"2000{seller}{n:06d}"
+                item_id = rng.choice(ids) if ids else None
+                item = self.items.get(item_id) or {}
+                qty = rng.randint(1, 3)
+                self.orders[order_id] = {
+                    "id": int(order_id),
+                    "status": rng.choice(("paid", "paid", "paid", "confirmed", "cancelled")),
+                    "date_created": f"2026-0{rng.randint(1, 9)}-{rng.randint(10, 28)}T12:00:00.000-03:00",
+                    "total_amount": round(item.get("price", 0) * qty, 2),
+                    "seller": {"id": int(seller)},
+                    "buyer": {"id": rng.randint(1, 10**8), "nickname": f"COMPRADOR{n}"},
+                    "order_items": [{"item": {"id": item_id, "title": item.get("title")}, "quantity": qty, "unit_price": item.get("price")}],
+                }
+                order_ids.append(order_id)
+            self.orders_by_seller[seller] = order_ids
+            question_ids = []
+            for n in range(config.questions_per_seller):
+                question_id = f"3000{seller}{n:06d}"
+                item_id = rng.choice(ids) if ids else None
+                self.questions[question_id] = {
+                    "id": int(question_id),
+                    "item_id": item_id,
+                    "seller_id": int(seller),
+                    "status": rng.choice(("UNANSWERED", "UNANSWERED", "ANSWERED")),
+                    "text": f"Olá, o {(self.items.get(item_id) or {}).get('title', 'produto')} tem garantia?",
+                    "date_created": "2026-09-01T10:00:00.000-03:00",
+                    "from": {"id": rng.randint(1, 10**8)},
+                    "answer": None,
+                }
+                question_ids.append(question_id)
+            self.questions_by_seller[seller] = question_ids
+
+
+def create_app(config: Optional[FakeMlConfig] = None) -> FastAPI:
+    """App FastAPI que responde como a API do ML (dataset de FakeMlData)."""
+    config = config or FakeMlConfig()
+    data = FakeMlData(config)
+    rng = random.Random(config.seed + 1)
+    rng_lock = threading.Lock()
+    counters: Counter = Counter()
+    scrolls: Dict[str, Tuple[str, List[str], int]] = {}
+    app = FastAPI(title="Fake Mercado Livre API")
+
+    def _rand() -> float:
+        with rng_lock:
+            return rng.random()
+
+    def _delay_seconds(family: str) -> float:
+        kind, args = config.family_latency.get(family, config.latency)
+        with rng_lock:
+            if kind == "uniform":
+                ms = rng.uniform(args[0], args[1] if len(args) > 1 else args[0])
+            elif kind == "lognormal":
+                ms = args[0] * math.exp(rng.gauss(0, args[1] if len(args) > 1 else 0.5))
+            else:
+                ms = args[0]
+        return max(0.0, ms) / 1000
+
+    def _seller_from_auth(request: Request) -> Optional[str]:
+        auth = request.headers.get("authorization", "")
+        token = auth[7:] if auth.lower().startswith("bearer ") else ""
+        return token[len(TOKEN_PREFIX):] if token.startswith(TOKEN_PREFIX) else None
+
+    def _error(status: int, message: str) -> JSONResponse:
+        return JSONResponse({"message": message, "error": message, "status": status, "cause": []}, status_code=status)
+
+    @app.middleware("http")
+    async def _simulate(request: Request, call_next):
+        if request.url.path.startswith("/_fake"):
+            return await call_next(request)
+        parts = [p for p in request.url.path.split("/") if p]
+        family = parts[0] if parts else "root"
+        if family == "sites":
+            family = "search"
+        elif family == "answers":
+            family = "questions"
+        counters["requests"] += 1
+        counters[f"{request.method} /{family}"] += 1
+        await asyncio.sleep(_delay_seconds(family))
+        roll = _rand()
+        if roll < config.rate_429:
+            counters["injected_429"] += 1
+            resp = _error(429, "too_many_requests")
+            resp.headers["Retry-After"] = f"{config.retry_after:g}"
+            return resp
+        if roll < config.rate_429 + config.error_rate:
+            counters["injected_5xx"] += 1
+            return _error(503, "service_unavailable")
+        return await call_next(request)
+
+    # ---------------- controle ----------------
+    @app.get("/_fake/stats")
+    def fake_stats():
+        return {"counters": dict(counters), "sellers": data.seller_ids, "items": len(data.items), "orders": len(data.orders), "questions": len(data.questions)}
+
+    @app.post("/_fake/reset")
+    def fake_reset():
+        counters.clear()
+        return {"ok": True}
+
+    # ---------------- oauth / usuário ----------------
+    @app.post("/oauth/token")
+    async def oauth_token(request: Request):
+        form = await request.form()
+        if form.get("grant_type") == "refresh_token":
+            seller = str(form.get("refresh_token", "")).rsplit("-", 1)[-1]
+        else:
+            seller = data.seller_ids[int(hashlib.md5(str(form.get("code", "")).encode()).hexdigest(), 16) % len(data.seller_ids)]
+        if seller not in data.items_by_seller:
+            return _error(400, "invalid_grant")
+        return {
+            "access_token": f"{TOKEN_PREFIX}{seller}",
+            "token_type": "Bearer",
+            "expires_in": 21600,
+            "scope": "offline_access read",
+            "user_id": int(seller),
+            "refresh_token": f"TG-fake-{seller}",
+        }
+
+    @app.get("/users/me")
+    def users_me(request: Request):
+        seller = _seller_from_auth(request)
+        if not seller:
+            return _error(401, "invalid access token")
+        return {"id": int(seller), "nickname": f"VENDEDOR{seller}", "site_id": "MLB", "email": f"vendedor{seller}@example.com"}
+
+    # ---------------- anúncios ----------------
+    @app.get("/users/{user_id}/items/search")
+    def user_items_search(user_id: str, status: Optional[str] = None, limit: int = 50, offset: int = 0, search_type: Optional[str] = None, scroll_id: Optional[str] = None):
+        ids = [i for i in data.items_by_seller.get(user_id, []) if not status or data.items[i]["status"] == status]
+        if search_type == "scan":
+            limit = min(limit, 100)
+            if scroll_id:
+                if scroll_id not in scrolls:
+                    return _error(400, "invalid scroll_id")
+                _, ids, pos = scrolls.pop(scroll_id)
+            else:
+                pos = 0
+            page = ids[pos:pos + limit]
+            next_id = None
+            if pos + limit < len(ids):
+                next_id = hashlib.sha1(f"{user_id}:{status}:{pos + limit}:{_rand()}".encode()).hexdigest()
+                scrolls[next_id] = (user_id, ids, pos + limit)
+            return {"seller_id": user_id, "results": page, "scroll_id": next_id, "paging": {"total": len(ids), "limit": limit}}
+        if offset > OFFSET_CAP:
+            return _error(400, "offset too large, use search_type=scan")
+        limit = min(limit, 50)
+        return {"seller_id": user_id, "results": ids[offset:offset + limit], "paging": {"total": len(ids), "offset": offset, "limit": limit}}
+
+    def _project(item: dict, attributes: Optional[str]) -> dict:
+        if not attributes:
+            return item
+        wanted = {a.strip() for a in attributes.split(",") if a.strip()}
+        return {k: v for k, v in item.items() if k in wanted}
+
+    @app.get("/items")
+    def items_multiget(ids: str = "", attributes: Optional[str] = None):
+        wanted = [i for i in ids.split(",") if i]
+        if len(wanted) > MULTIGET_MAX:
+            return _error(400, f"max {MULTIGET_MAX} ids")
+        out = []
+        for item_id in wanted:
+            item = data.items.get(item_id)
+            if item is None:
+                out.append({"code": 404, "body": {"message": f"Item with id {item_id} not found", "error": "not_found"}})
+            else:
+                out.append({"code": 200, "body": _project(item, attributes)})
+        return out
+
+    @app.get("/items/{item_id}")
+    def item_detail(item_id: str, request: Request):
+        item = data.items.get(item_id)
+        if item is None:
+            return _error(404, f"Item with id {item_id} not found")
+        etag = f'"{hashlib.md5((item_id + item["last_updated"]).encode()).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(item, headers={"ETag": etag, "Last-Modified": "Thu, 01 Jan 2026 00:00:00 GMT"})
+
+    @app.get("/items/{item_id}/description")
+    def item_description(item_id: str):
+        if item_id not in data.descriptions:
+            return _error(404, "not_found")
+        return {"plain_text": data.descriptions[item_id], "text": ""}
+
+    @app.get("/sites/{site_id}/search")
+    def site_search(site_id: str, request: Request, q: str = "", limit: int = 50, offset: int = 0, sort: Optional[str] = None):
+        terms = [t for t in q.lower().split() if t]
+        hits = [i for i in data.items.values() if i["status"] == "active" and all(t in i["title"].lower() for t in terms)]
+        if sort == "price_asc":
+            hits.sort(key=lambda i: i["price"])
+        elif sort == "price_desc":
+            hits.sort(key=lambda i: -i["price"])
+        elif sort == "sales_desc":
+            hits.sort(key=lambda i: -i["sold_quantity"])
+        limit = min(limit, 50)
+        return {"site_id": site_id, "query": q, "results": hits[offset:offset + limit], "paging": {"total": len(hits), "offset": offset, "limit": limit}}
+
+    # ---------------- pedidos ----------------
+    @app.get("/orders/search")
+    def orders_search(request: Request, seller: str = "", limit: int = 50, offset: int = 0):
+        status = request.query_params.get("order.status")
+        orders = [data.orders[o] for o in data.orders_by_seller.get(seller, []) if not status or data.orders[o]["status"] == status]
+        limit = min(limit, 50)
+        return {"results": orders[offset:offset + limit], "paging": {"total": len(orders), "offset": offset, "limit": limit}}
+
+    @app.get("/orders/{order_id}")
+    def order_detail(order_id: str):
+        order = data.orders.get(order_id)
+        return order if order is not None else _error(404, "order not found")
+
+    # ---------------- perguntas ----------------
+    @app.get("/questions/search")
+    def questions_search(seller_id: Optional[str] = None, item: Optional[str] = None, status: Optional[str] = None, limit: int = 50, offset: int = 0):
+        if seller_id:
+            qs = [data.questions[q] for q in data.questions_by_seller.get(seller_id, [])]
+        else:
+            qs = [q for q in data.questions.values() if q["item_id"] == item]
+        if status:
+            qs = [q for q in qs if q["status"] == status.upper()]
+        limit = min(limit, 50)
+        return {"questions": qs[offset:offset + limit], "total": len(qs), "limit": limit, "offset": offset}
+
+    @app.get("/questions/{question_id}")
+    def question_detail(question_id: str):
+        question = data.questions.get(question_id)
+        return question if question is not None else _error(404, "question not found")
+
+    @app.post("/answers")
+    async def post_answer(request: Request):
+        body = await request.json()
+        question = data.questions.get(str(body.get("question_id")))
+        if question is None:
+            return _error(404, "question not found")
+        question["status"] = "ANSWERED"
+        question["answer"] = {"text": body.get("text"), "status": "ACTIVE", "date_created": "2026-10-01T10:00:00.000-03:00"}
+        return JSONResponse(question, status_code=201)
+
+    app.state.data = data
+    app.state.counters = counters
+    return app
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API do Mercado Livre")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=int(os.getenv("FAKE_ML_SEED", "42")))
+    parser.add_argument("--sellers", type=int, default=int(os.getenv("FAKE_ML_SELLERS", "3")))
+    parser.add_argument("--items", type=int, default=int(os.getenv("FAKE_ML_ITEMS", "300")), help="anúncios por vendedor")
+    parser.add_argument("--orders", type=int, default=int(os.getenv("FAKE_ML_ORDERS", "200")), help="pedidos por vendedor")
+    parser.add_argument("--questions", type=int, default=int(os.getenv("FAKE_ML_QUESTIONS", "60")), help="perguntas por vendedor")
+    parser.add_argument("--latency", default=os.getenv("FAKE_ML_LATENCY", "lognormal:60,0.4"))
+    parser.add_argument("--latency-family", action="append", default=[], metavar="FAMÍLIA=SPEC", help="ex.: items=fixed:300 (repetível)")
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("FAKE_ML_ERROR_RATE", "0")), help="fração de respostas 503")
+    parser.add_argument("--rate-429", type=float, default=float(os.getenv("FAKE_ML_RATE_429", "0")), help="fração de respostas 429")
+    parser.add_argument("--retry-after", type=float, default=float(os.getenv("FAKE_ML_RETRY_AFTER", "1")))
+    return parser.parse_args(argv)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeMlConfig:
+    return FakeMlConfig(
+        seed=args.seed,
+        sellers=args.sellers,
+        items_per_seller=args.items,
+        orders_per_seller=args.orders,
+        questions_per_seller=args.questions,
+        latency=args.latency,
+        family_latency=dict(spec.split("=", 1) for spec in args.latency_family),
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    args = _parse_args(argv)
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# bench/index_advisor.py — EXPLAIN das consultas quentes de app/main.py num banco populado
+# Sinaliza varreduras sequenciais (e ordenações sem índice) nas consultas que deveriam usar índice.
+#
+#   python -m bench.index_advisor                      # SQLite temporário, dados sintéticos
+#   python -m bench.index_advisor --users 200 --rows 500
+#   DATABASE_URL=postgresql://... python -m bench.index_advisor --no-seed
+#
+# No PostgreSQL as tabelas pequenas sempre dão Seq Scan no plano "natural"; por isso o EXPLAIN roda
+# com enable_seqscan=off: se mesmo assim sair Seq Scan, não existe índice que sirva à consulta.
+# Sai com código 1 se alguma consulta for sinalizada (para usar em CI).
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, List
+
+
+@dataclass
+class QueryShape:
+    name: str
+    origin: str  # onde a consulta aparece no backend
+    build: Callable[[], Any]
+    expect_scan: bool = False  # listagens completas (admin) em que varrer a tabela é esperado
+    allow_sort: bool = False  # poucas linhas por usuário: ordenar em memória é barato
+
+
+@dataclass
+class PlanResult:
+    shape: QueryShape
+    plan: List[str]
+    issues: List[str] = field(default_factory=list)
+
+
+def _shapes() -> List[QueryShape]:
+    from sqlalchemy import and_, func, or_, select
+
+    from app.models import AuditLog, CompetitorItem, ItemCost, MlToken, PendingQuestion, QuestionAnswerFeedback, Subscription, User
+
+    uid, since = 1, datetime.utcnow()
+
+    def after(model):  # predicado do cursor de app/services/pagination.keyset_page
+        return and_(model.created_at <= since, or_(model.created_at < since, model.id < 1000))
+
+    def desc(model):
+        return (model.created_at.desc(), model.id.desc())
+
+    return [
+        QueryShape("pending_by_user_status", "ml_questions_pending",
+                   lambda: select(PendingQuestion).where(PendingQuestion.user_id == uid, PendingQuestion.status == "pending").order_by(*desc(PendingQuestion)).limit(101)),
+        QueryShape("pending_page_cursor", "ml_questions_pending?cursor=",
+                   lambda: select(PendingQuestion).where(PendingQuestion.user_id == uid, PendingQuestion.status == "pending", after(PendingQuestion)).order_by(*desc(PendingQuestion)).limit(101)),
+        QueryShape("pending_count", "_build_diagnostic_report",
+                   lambda: select(func.count()).select_from(PendingQuestion).where(PendingQuestion.user_id == uid, PendingQuestion.status == "pending")),
+        QueryShape("pending_by_question", "_process_ml_question_webhook",
+                   lambda: select(PendingQuestion).where(PendingQuestion.question_id == "Q1").limit(1)),
+        QueryShape("pending_by_user_question", "ml_questions_sync / ml_question_publish",
+                   lambda: select(PendingQuestion).where(PendingQuestion.user_id == uid, PendingQuestion.question_id == "Q1").limit(1)),
+        QueryShape("feedback_history", "_get_few_shot_feedback",
+                   lambda: select(QuestionAnswerFeedback).where(QuestionAnswerFeedback.user_id == uid).order_by(QuestionAnswerFeedback.created_at.desc()).limit(10)),
+        QueryShape("feedback_page_cursor", "ml_questions_history?cursor=",
+                   lambda: select(QuestionAnswerFeedback).where(QuestionAnswerFeedback.user_id == uid, after(QuestionAnswerFeedback)).order_by(*desc(QuestionAnswerFeedback)).limit(51)),
+        QueryShape("feedback_count", "ml_questions_history",
+                   lambda: select(func.count()).select_from(QuestionAnswerFeedback).where(QuestionAnswerFeedback.user_id == uid)),
+        QueryShape("competitor_by_user_item", "ml_competitors_add / ml_competitors_remove",
+                   lambda: select(CompetitorItem).where(CompetitorItem.user_id == uid, CompetitorItem.item_id == "MLB1").limit(1)),
+        QueryShape("competitors_by_user", "_list_competitor_rows",
+                   lambda: select(CompetitorItem).where(CompetitorItem.user_id == uid).order_by(CompetitorItem.created_at.desc()),
+                   allow_sort=True),
+        QueryShape("item_costs_by_ids", "ml_items",
+                   lambda: select(ItemCost).where(ItemCost.user_id == uid, ItemCost.item_id.in_(["MLB1", "MLB2", "MLB3"]))),
+        QueryShape("item_costs_by_user", "_compute_financial_panel",
+                   lambda: select(ItemCost).where(ItemCost.user_id == uid)),
+        QueryShape("item_cost_by_user_item", "save_financial_costs",
+                   lambda: select(ItemCost).where(ItemCost.user_id == uid, ItemCost.item_id == "MLB1").limit(1)),
+        QueryShape("item_cost_by_user_sku", "custos por SKU (planilha)",
+                   lambda: select(ItemCost).where(ItemCost.user_id == uid, ItemCost.sku == "SKU-1")),
+        QueryShape("audit_by_event", "admin_audit_logs?event_type=",
+                   lambda: select(AuditLog).where(AuditLog.event_type == "ia_insights_fail").order_by(*desc(AuditLog)).limit(101)),
+        QueryShape("audit_page_cursor", "admin_audit_logs?event_type=&cursor=",
+                   lambda: select(AuditLog).where(AuditLog.event_type == "ia_insights_fail", after(AuditLog)).order_by(*desc(AuditLog)).limit(101)),
+        QueryShape("audit_purge_batch", "audit_log.purge_expired",
+                   lambda: select(AuditLog.id).where(AuditLog.event_type == "billing", AuditLog.created_at < since).limit(5000)),
+        QueryShape("audit_recent", "admin_audit_logs",
+                   lambda: select(AuditLog).order_by(*desc(AuditLog)).limit(101)),
+        QueryShape("token_by_user", "get_valid_ml_token / ml_token_service",
+                   lambda: select(MlToken).where(MlToken.user_id == uid).limit(1)),
+        QueryShape("token_by_seller", "_user_by_seller_id (webhook)",
+                   lambda: select(MlToken).where(MlToken.seller_id == "100000").limit(1)),
+        QueryShape("tokens_expiring", "refresh_expiring_tokens",
+                   lambda: select(MlToken.user_id).where(MlToken.expires_at.isnot(None), MlToken.expires_at <= since)),
+        QueryShape("user_by_clerk_id", "get_or_create_user",
+                   lambda: select(User).where(User.clerk_user_id == "clerk_1").limit(1)),
+        QueryShape("subscriptions_by_user", "billing_status / billing_history",
+                   lambda: select(Subscription).where(Subscription.user_id == uid).order_by(Subscription.created_at.desc()),
+                   allow_sort=True),
+        QueryShape("subscription_active_by_user", "billing_cancel",
+                   lambda: select(Subscription).where(Subscription.user_id == uid, Subscription.status == "active").order_by(Subscription.created_at.desc()).limit(1),
+                   allow_sort=True),
+        QueryShape("subscription_by_external_id", "webhooks Stripe / Mercado Pago",
+                   lambda: select(Subscription).where(Subscription.stripe_subscription_id == "sub_1").limit(1)),
+        QueryShape("users_admin_page", "admin_users?cursor=",
+                   lambda: select(User).where(after(User)).order_by(*desc(User)).limit(201)),
+    ]
+
+
+def _seed(engine, users: int, rows: int, seed: int) -> None:
+    from sqlalchemy.orm import Session
+
+    from app.models import AuditLog, CompetitorItem, ItemCost, MlToken, PendingQuestion, QuestionAnswerFeedback, Subscription, User
+
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+
+    def ago() -> datetime:
+        return now - timedelta(minutes=rnd.randint(0, 60 * 24 * 90))
+
+    with Session(engine) as db:
+        db.add_all(User(id=u, clerk_user_id=f"clerk_{u}", email=f"u{u}@example.com", plan=rnd.choice(["free", "active"]), created_at=ago()) for u in range(1, users + 1))
+        db.flush()
+        qn = 0
+        for u in range(1, users + 1):
+            db.add(MlToken(user_id=u, access_token=f"APP_USR-{u}", refresh_token=f"TG-{u}", seller_id=str(100000 + u), expires_at=now + timedelta(minutes=rnd.randint(-60, 360))))
+            db.add(Subscription(user_id=u, stripe_subscription_id=f"sub_{u}", status=rnd.choice(["active", "canceled"]), created_at=ago()))
+            for r in range(rows):
+                qn += 1
+                db.add(PendingQuestion(user_id=u, question_id=f"Q{qn}", item_id=f"MLB{r % 50}", pergunta_texto="Tem em estoque?", status=rnd.choice(["pending", "published", "published"]), created_at=ago()))
+                db.add(QuestionAnswerFeedback(user_id=u, question_id=f"Q{qn}", item_id=f"MLB{r % 50}", pergunta_texto="Tem em estoque?", resposta_final_publicada="Sim!", created_at=ago()))
+                db.add(ItemCost(user_id=u, item_id=f"MLB{r}", sku=f"SKU-{r}", custo_produto=10.0))
+                db.add(AuditLog(user_id=u, event_type=rnd.choice(["ia_insights_fail", "ia_perguntas_fail", "billing"]), message="x", created_at=ago()))
+            for r in range(min(rows, 20)):
+                db.add(CompetitorItem(user_id=u, item_id=f"MLB{900000 + r}", created_at=ago()))
+            db.flush()
+        db.commit()
+
+
+def _explain(conn, stmt) -> List[str]:
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if conn.dialect.paramstyle in ("qmark", "numeric", "format"):
+        params = tuple(params[k] for k in compiled.positiontup)
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+        return [r[-1] for r in rows]
+    rows = conn.exec_driver_sql("EXPLAIN " + str(compiled), params).all()
+    return [r[0] for r in rows]
+
+
+_SQLITE_SCAN = re.compile(r"^SCAN \w+(?!\w)(?! USING (COVERING )?INDEX)")
+
+
+def _issues(dialect: str, plan: List[str], allow_sort: bool) -> List[str]:
+    found = []
+    for line in plan:
+        text = line.strip()
+        if dialect == "sqlite":
+            if _SQLITE_SCAN.match(text):
+                found.append(f"varredura sequencial: {text}")
+            elif "USE TEMP B-TREE" in text and not allow_sort:
+                found.append(f"ordenação sem índice: {text}")
+        elif "Seq Scan" in text or ("Sort Key" in text and not allow_sort):
+            kind = "varredura sequencial" if "Seq Scan" in text else "ordenação sem índice"
+            found.append(f"{kind}: {text.split('  (')[0].strip(' ->')}")
+    return found
+
+
+def analyze(engine) -> List[PlanResult]:
+    results = []
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        for shape in _shapes():
+            plan = _explain(conn, shape.build())
+            results.append(PlanResult(shape, plan, _issues(conn.dialect.name, plan, shape.allow_sort)))
+        conn.rollback()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN das consultas quentes do backend; sinaliza varreduras sem índice.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200, help="linhas por usuário em cada tabela grande")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-seed", action="store_true", help="usa o DATABASE_URL como está (não cria nem popula)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="mostra o plano de todas as consultas")
+    args = parser.parse_args(argv)
+
+    tmp = None
+    if not args.no_seed and not os.getenv("DATABASE_URL"):
+        tmp = tempfile.TemporaryDirectory(prefix="ml-index-advisor-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp.name}/advisor.db"
+
+    from app.database import engine, init_db
+
+    if not args.no_seed:
+        init_db()
+        _seed(engine, args.users, args.rows, args.seed)
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("ANALYZE")
+        elif not args.no_seed:
+            conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+
+    results = analyze(engine)
+    flagged = [r for r in results if r.issues and not r.shape.expect_scan]
+    for r in results:
+        status = "OK " if not r.issues else ("esp" if r.shape.expect_scan else "!! ")
+        print(f"[{status}] {r.shape.name:<30} ({r.shape.origin})")
+        if r.issues and not r.shape.expect_scan:
+            for issue in r.issues:
+                print(f"        {issue}")
+        if args.verbose:
+            for line in r.plan:
+                print(f"        | {line}")
+    print(f"\n{len(results)} consultas, {len(flagged)} sinalizadas.")
+    engine.dispose()
+    if tmp is not None:
+        tmp.cleanup()
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
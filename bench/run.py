@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""Benchmark ponta a ponta dos endpoints do backend contra a API do ML simulada (bench/fake_ml.py).
+
+Sobe, no mesmo processo, o servidor fake do ML e o app.main:app (uvicorn, SQLite temporário),
+cria N vendedores com plano ativo e token do ML e roda os cenários:
+
+  dashboard      — cada vendedor abre o dashboard: /api/financial-panel, /api/ml/items,
+                   /api/ml/metrics e /api/ml/competitors ao mesmo tempo
+  webhook_burst  — rajada de POST /api/ml-webhook (tópico questions)
+  question_sync  — polling de perguntas de todos os vendedores (_sync_all_users_questions)
+  sheet_upload   — POST /api/financial-dashboard com planilha de N linhas
+
+Para cada cenário: p50/p95/p99 (ms), throughput (req/s), erros, status HTTP e chamadas feitas
+ao ML (contadores do servidor fake). O resultado vai para um JSON (com o commit atual) para
+comparar execuções:
+
+    python -m bench.run --sellers 5 --items 800 --latency lognormal:60,0.4 --output bench/results/base.json
+    python -m bench.run --scenarios dashboard,webhook_burst --repeat 5
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from bench import fake_ml
+
+SCENARIOS = ("dashboard", "webhook_burst", "question_sync", "sheet_upload")
+BENCH_USER_HEADER = "X-Bench-User"
+_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+class _ServerThread:
+    """uvicorn.Server rodando numa thread (para subir o fake do ML e o backend no mesmo processo)."""
+
+    def __init__(self, app: Any, port: int):
+        import uvicorn
+
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> "_ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"Servidor na porta {self.port} não subiu")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+class Recorder:
+    """Acumula latência, status e erros das requisições de um cenário."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, status: Any) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            key = str(status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors += 1
+
+    def timed(self, fn: Callable[[], requests.Response]) -> Optional[requests.Response]:
+        started = time.perf_counter()
+        try:
+            resp = fn()
+        except requests.RequestException as e:
+            self.record(time.perf_counter() - started, type(e).__name__)
+            return None
+        self.record(time.perf_counter() - started, resp.status_code)
+        return resp
+
+    def summary(self, wall_seconds: float) -> Dict[str, Any]:
+        def _ms(pct: float) -> Optional[float]:
+            value = _percentile(self.latencies, pct)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "wall_seconds": round(wall_seconds, 3),
+            "throughput_rps": round(len(self.latencies) / wall_seconds, 2) if wall_seconds > 0 else None,
+            "p50_ms": _ms(50),
+            "p95_ms": _ms(95),
+            "p99_ms": _ms(99),
+            "max_ms": round(max(self.latencies) * 1000, 2) if self.latencies else None,
+        }
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="ml-bench-")
+        self.fake_config = fake_ml.config_from_args(args)
+        self.fake_port = _free_port()
+        self.app_port = _free_port()
+        self.users: List[Tuple[str, str]] = []  # (clerk_user_id, seller_id)
+        self.fake: Optional[_ServerThread] = None
+        self.backend: Optional[_ServerThread] = None
+        self.main = None
+
+    # ---------------- setup ----------------
+    def _configure_env(self) -> None:
+        os.environ["ML_API"] = f"http://127.0.0.1:{self.fake_port}"
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(self.tmpdir.name, 'bench.db').as_posix()}"
+        os.environ.pop("CLERK_JWKS_URL", None)
+        os.environ.pop("OPENAI_API_KEY", None)  # respostas de IA caem no texto padrão, sem rede
+        os.environ.pop("TELEGRAM_BOT_TOKEN", None)
+        os.environ["DEBUG_LOG"] = (_ROOT / "bench" / "results" / "debug.log").as_posix()  # não suja .cursor/debug.log
+
+    def _install_auth(self) -> None:
+        """Troca a autenticação Clerk por um header com o clerk_user_id do vendedor de benchmark."""
+        from fastapi import Depends, HTTPException, Request
+        from sqlalchemy.orm import Session
+
+        from app.auth import get_current_user
+        from app.database import get_db
+        from app.models import User
+        from app.services.user_service import get_or_create_user
+
+        def _bench_user(request: Request, db: Session = Depends(get_db)) -> User:
+            clerk_user_id = request.headers.get(BENCH_USER_HEADER, "")
+            user = get_or_create_user(clerk_user_id, db=db) if clerk_user_id.startswith("bench_user_") else None
+            if user is None:
+                raise HTTPException(status_code=401, detail="Não autenticado")
+            return user
+
+        self.main.app.dependency_overrides[get_current_user] = _bench_user
+
+    def _seed(self) -> None:
+        from app.database import SessionLocal, init_db
+        from app.models import CompetitorItem, MlToken, User
+
+        init_db()
+        data = self.fake.server.config.app.state.data
+        db = SessionLocal()
+        try:
+            for idx, seller in enumerate(data.seller_ids):
+                user = User(clerk_user_id=f"bench_user_{idx}", email=f"bench{idx}@example.com", plan="active")
+                db.add(user)
+                db.flush()
+                db.add(MlToken(
+                    user_id=user.id,
+                    access_token=f"{fake_ml.TOKEN_PREFIX}{seller}",
+                    refresh_token=f"TG-fake-{seller}",
+                    seller_id=seller,
+                    expires_at=datetime.utcnow() + timedelta(hours=6),
+                ))
+                others = [s for s in data.seller_ids if s != seller] or [seller]
+                for n in range(self.args.competitors):
+                    other = others[n % len(others)]
+                    ids = data.items_by_seller.get(other) or []
+                    if ids:
+                        db.add(CompetitorItem(user_id=user.id, item_id=ids[(n * 7) % len(ids)], nickname=f"conc{n}"))
+                self.users.append((user.clerk_user_id, seller))
+            db.commit()
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        self._configure_env()
+        self.fake = _ServerThread(fake_ml.create_app(self.fake_config), self.fake_port).start()
+        sys.path.insert(0, str(_ROOT))
+        import app.main as main
+
+        logging.getLogger("ml-intelligence").setLevel(self.args.log_level.upper())
+        self.main = main
+        self._install_auth()
+        self._seed()
+        self.backend = _ServerThread(main.app, self.app_port).start()
+
+    def stop(self) -> None:
+        for server in (self.backend, self.fake):
+            if server is not None:
+                server.stop()
+        self.tmpdir.cleanup()
+
+    # ---------------- helpers ----------------
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.app_port}"
+
+    def _fake_counters(self) -> Dict[str, int]:
+        return dict(self.fake.server.config.app.state.counters)
+
+    def _session(self, clerk_user_id: Optional[str] = None) -> requests.Session:
+        session = requests.Session()
+        if clerk_user_id:
+            session.headers[BENCH_USER_HEADER] = clerk_user_id
+        return session
+
+    def _run(self, name: str, body: Callable[[Recorder], None]) -> Dict[str, Any]:
+        recorder = Recorder()
+        before = self._fake_counters()
+        started = time.perf_counter()
+        for _ in range(self.args.repeat):
+            body(recorder)
+        wall = time.perf_counter() - started
+        after = self._fake_counters()
+        ml_calls = {k: after.get(k, 0) - before.get(k, 0) for k in after if after.get(k, 0) != before.get(k, 0)}
+        result = recorder.summary(wall)
+        result["ml_calls"] = ml_calls.pop("requests", 0)
+        result["ml_calls_by_route"] = ml_calls
+        print(f"  {name:<14} p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+              f"rps={result['throughput_rps']} erros={result['errors']} chamadas_ml={result['ml_calls']}", flush=True)
+        return result
+
+    # ---------------- cenários ----------------
+    def scenario_dashboard(self, rec: Recorder) -> None:
+        paths = ("/api/financial-panel", "/api/ml/items", "/api/ml/metrics", "/api/ml/competitors")
+
+        def _load(user: Tuple[str, str]) -> None:
+            session = self._session(user[0])
+            with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+                list(pool.map(lambda p: rec.timed(lambda: session.get(f"{self.base}{p}", timeout=120)), paths))
+
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(_load, self.users))
+
+    def scenario_webhook_burst(self, rec: Recorder) -> None:
+        data = self.fake.server.config.app.state.data
+        events = []
+        for seller in data.seller_ids:
+            for qid in data.questions_by_seller.get(seller, [])[: self.args.webhook_events]:
+                events.append({"topic": "questions", "resource": f"/questions/{qid}", "user_id": int(seller), "attempts": 1})
+        session = self._session()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(lambda ev: rec.timed(lambda: session.post(f"{self.base}/api/ml-webhook", json=ev, timeout=60)), events))
+        # libera a idempotência para a próxima repetição
+        self.main._WEBHOOK_PROCESSED.clear()
+
+    def scenario_question_sync(self, rec: Recorder) -> None:
+        from app.database import SessionLocal
+        from app.models import PendingQuestion
+
+        db = SessionLocal()
+        try:
+            db.query(PendingQuestion).delete()
+            db.commit()
+        finally:
+            db.close()
+        started = time.perf_counter()
+        try:
+            self.main._sync_all_users_questions()
+            rec.record(time.perf_counter() - started, 200)
+        except Exception as e:
+            rec.record(time.perf_counter() - started, type(e).__name__)
+
+    def _sheet_bytes(self) -> bytes:
+        import pandas as pd
+
+        data = self.fake.server.config.app.state.data
+        ids = list(data.items)[: self.args.sheet_rows] or ["MLB1"]
+        rows = [
+            {
+                "ITEM_ID": ids[n % len(ids)],
+                "SKU": f"SKU-{n:05d}",
+                "TITLE": f"Produto {n}",
+                "PRICE": round(10.9 + n % 500, 2),
+                "FEE_PER_SALE": f"{11 + n % 6}%",
+                "STATUS": "Ativo" if n % 5 else "Pausado",
+                "QUANTITY": n % 40,
+            }
+            for n in range(self.args.sheet_rows)
+        ]
+        buf = io.BytesIO()
+        pd.DataFrame(rows).to_excel(buf, index=False)
+        return buf.getvalue()
+
+    def scenario_sheet_upload(self, rec: Recorder) -> None:
+        payload = self._sheet_bytes()
+        user = self.users[0][0]
+
+        def _upload(_: int) -> None:
+            session = self._session(user)
+            files = {"file": ("anuncios.xlsx", payload, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+            rec.timed(lambda: session.post(f"{self.base}/api/financial-dashboard", files=files, timeout=120))
+
+        with ThreadPoolExecutor(max_workers=min(self.args.concurrency, 4)) as pool:
+            list(pool.map(_upload, range(self.args.sheet_uploads)))
+
+    def run(self, scenarios: List[str]) -> Dict[str, Any]:
+        results = {}
+        for name in scenarios:
+            results[name] = self._run(name, getattr(self, f"scenario_{name}"))
+        return results
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta dos endpoints contra o ML simulado")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"lista separada por vírgula ({', '.join(SCENARIOS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="repetições de cada cenário")
+    parser.add_argument("--concurrency", type=int, default=8, help="clientes simultâneos")
+    parser.add_argument("--competitors", type=int, default=10, help="concorrentes cadastrados por vendedor")
+    parser.add_argument("--webhook-events", type=int, default=20, help="notificações por vendedor em cada rajada")
+    parser.add_argument("--sheet-rows", type=int, default=2000)
+    parser.add_argument("--sheet-uploads", type=int, default=4, help="uploads por repetição")
+    parser.add_argument("--output", default=None, help="arquivo JSON (padrão: bench/results/<data>-<commit>.json)")
+    parser.add_argument("--log-level", default="CRITICAL", help="nível do log do backend durante o benchmark")
+    # parâmetros do ML simulado (mesmos de bench/fake_ml.py)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sellers", type=int, default=3)
+    parser.add_argument("--items", type=int, default=300, help="anúncios por vendedor")
+    parser.add_argument("--orders", type=int, default=200, help="pedidos por vendedor")
+    parser.add_argument("--questions", type=int, default=60, help="perguntas por vendedor")
+    parser.add_argument("--latency", default="lognormal:60,0.4")
+    parser.add_argument("--latency-family", action="append", default=[], metavar="FAMÍLIA=SPEC")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = _parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Cenários desconhecidos: {', '.join(unknown)}")
+    bench = Bench(args)
+    print(f"Subindo ML simulado (:{bench.fake_port}) e backend (:{bench.app_port})...", flush=True)
+    bench.start()
+    try:
+        results = bench.run(scenarios)
+    finally:
+        bench.stop()
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": results,
+    }
+    output = Path(args.output) if args.output else _ROOT / "bench" / "results" / f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Resultado: {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()